@@ -0,0 +1,60 @@
+#!/usr/bin/python2
+
+'''Benchmark subtree operations (rename/delete) against the table size'''
+
+import sys
+import os
+import time
+
+BASE = os.path.abspath(__file__)
+DIR = os.path.dirname(BASE)
+TARGET = os.path.join(DIR, '..', 'src')
+CLEAN = os.path.abspath(TARGET)
+assert(os.path.isdir(CLEAN))
+sys.path.insert(0, CLEAN)
+
+from pathwatch.database import DBFilesHelper
+
+FILES_PER_DIR = 100
+SUBTREE_DIRS = 10
+SIZES = [10000, 100000, 1000000]
+REPEAT = 10
+
+
+def _fill(database, size):
+    """Fill the files table with <size> files in a two level tree"""
+    rows = []
+    for index in xrange(size):
+        parent = '/root/{:06d}/{:03d}'.format(index // (FILES_PER_DIR *
+                                                         SUBTREE_DIRS),
+                                              (index // FILES_PER_DIR) %
+                                              SUBTREE_DIRS)
+        rows.append((42, parent, '{:03d}'.format(index % FILES_PER_DIR), 1))
+    database.insert_files(rows)
+
+
+def _timed(function, *args):
+    """Return the time spent running function(*args), in milliseconds"""
+    start = time.time()
+    function(*args)
+    return (time.time() - start) * 1000
+
+
+def bench(size):
+    """Measure the latency of move_dir and delete_path for a table size"""
+    database = DBFilesHelper(':memory:')
+    _fill(database, size)
+    moves = []
+    deletes = []
+    for index in xrange(REPEAT):
+        path = '/root/{:06d}'.format(index)
+        moves.append(_timed(database.move_dir, path, path + '.moved'))
+        deletes.append(_timed(database.delete_path, path + '.moved'))
+    database.close()
+    print '{:>9} rows: move_dir {:8.3f} ms, delete_path {:8.3f} ms'.format(
+        size, sum(moves) / REPEAT, sum(deletes) / REPEAT)
+
+
+if __name__ == '__main__':
+    for table_size in [int(arg) for arg in sys.argv[1:]] or SIZES:
+        bench(table_size)
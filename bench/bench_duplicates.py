@@ -0,0 +1,78 @@
+#!/usr/bin/python2
+
+'''Benchmark duplicate lookups: GROUP BY over files against the copies kept
+by the hashes'''
+
+import sys
+import os
+import time
+
+BASE = os.path.abspath(__file__)
+DIR = os.path.dirname(BASE)
+TARGET = os.path.join(DIR, '..', 'src')
+CLEAN = os.path.abspath(TARGET)
+assert(os.path.isdir(CLEAN))
+sys.path.insert(0, CLEAN)
+
+from pathwatch.database import DBFilesHelper, DBHashHelper, DBQueryHelper
+
+FILES_PER_DIR = 100
+# One file out of DUPLICATED shares its content with the previous one
+DUPLICATED = 10
+SIZES = [10000, 100000, 1000000]
+REPEAT = 10
+
+
+def _fill(filedb, size):
+    """Fill the files table with <size> hashed files"""
+    hashdb = DBHashHelper(None, filedb)
+    filedb.begin()
+    for index in xrange(size):
+        if index % DUPLICATED != 1:
+            rowid = hashdb.insert_hash('{:032x}'.format(index),
+                                       '{:08x}'.format(index), index)
+        path = '/root/{:06d}/{:03d}'.format(index // FILES_PER_DIR,
+                                            index % FILES_PER_DIR)
+        filedb.insert_file(path, 42)
+        filedb.link_to_hash(path, rowid)
+    filedb.commit()
+
+
+def _group_by(filedb):
+    """The ad-hoc query: group the whole files table"""
+    # pylint: disable=W0212
+    filedb._cursor.execute('SELECT f.identity,'
+                           ' (count(*) - 1) * h.size AS wasted'
+                           ' FROM files AS f'
+                           ' JOIN hashes AS h ON h.id = f.identity'
+                           ' WHERE f.identity != 0'
+                           ' GROUP BY f.identity HAVING count(*) > 1'
+                           ' ORDER BY wasted DESC LIMIT 100')
+    return filedb._cursor.fetchall()
+
+
+def _timed(function, *args):
+    """Return the time spent running function(*args), in milliseconds"""
+    start = time.time()
+    function(*args)
+    return (time.time() - start) * 1000
+
+
+def bench(size):
+    """Measure the latency of the top 100 duplicates for a table size"""
+    filedb = DBFilesHelper(':memory:')
+    query = DBQueryHelper(None, filedb)
+    _fill(filedb, size)
+    group_by = sum(_timed(_group_by, filedb) for _ in xrange(REPEAT))
+    duplicates = sum(_timed(query.duplicates) for _ in xrange(REPEAT))
+    below = sum(_timed(query.duplicates_below, '/root/000000')
+                for _ in xrange(REPEAT))
+    filedb.close()
+    print ('{:>9} rows: GROUP BY {:9.3f} ms, duplicates {:7.3f} ms,'
+           ' duplicates_below {:7.3f} ms').format(
+               size, group_by / REPEAT, duplicates / REPEAT, below / REPEAT)
+
+
+if __name__ == '__main__':
+    for table_size in [int(arg) for arg in sys.argv[1:]] or SIZES:
+        bench(table_size)
@@ -0,0 +1,61 @@
+#!/usr/bin/python2
+
+'''Benchmark exporting the files of a database in each format'''
+
+import sys
+import os
+import tempfile
+import time
+
+BASE = os.path.abspath(__file__)
+DIR = os.path.dirname(BASE)
+TARGET = os.path.join(DIR, '..', 'src')
+CLEAN = os.path.abspath(TARGET)
+assert(os.path.isdir(CLEAN))
+sys.path.insert(0, CLEAN)
+
+from pathwatch.database import DBFilesHelper, DBHashHelper
+from pathwatch.export import FORMATS, export
+
+FILES_PER_DIR = 100
+SIZES = [10000, 100000, 1000000]
+
+
+def _fill(database, size):
+    """Fill the database with <size> hashed files"""
+    filedb = DBFilesHelper(database)
+    hashdb = DBHashHelper(None, filedb)
+    filedb.begin()
+    for index in xrange(size):
+        rowid = hashdb.insert_hash('{:032x}'.format(index),
+                                   '{:08x}'.format(index), index)
+        path = '/root/{:06d}/{:03d}'.format(index // FILES_PER_DIR,
+                                            index % FILES_PER_DIR)
+        filedb.insert_file(path, 42, index)
+        filedb.link_to_hash(path, rowid)
+    filedb.commit()
+    filedb.close()
+
+
+def bench(size):
+    """Measure the export rate of each format for a table size"""
+    tempdir = tempfile.mkdtemp()
+    database = os.path.join(tempdir, 'database')
+    _fill(database, size)
+    rates = []
+    with open(os.devnull, 'w') as output:
+        for fmt in FORMATS:
+            start = time.time()
+            export(database, '/root', output, fmt)
+            rates.append('{} {:9.0f} files/s'.format(
+                fmt, size / (time.time() - start)))
+    os.remove(database)
+    for name in os.listdir(tempdir):
+        os.remove(os.path.join(tempdir, name))
+    os.rmdir(tempdir)
+    print '{:>9} rows: {}'.format(size, ', '.join(rates))
+
+
+if __name__ == '__main__':
+    for table_size in [int(arg) for arg in sys.argv[1:]] or SIZES:
+        bench(table_size)
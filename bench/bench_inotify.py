@@ -0,0 +1,58 @@
+#!/usr/bin/python2
+
+'''Benchmark the event throughput of the inotify interfaces'''
+
+import sys
+import os
+import shutil
+import tempfile
+import time
+import Queue
+
+BASE = os.path.abspath(__file__)
+DIR = os.path.dirname(BASE)
+TARGET = os.path.join(DIR, '..', 'src')
+CLEAN = os.path.abspath(TARGET)
+assert(os.path.isdir(CLEAN))
+sys.path.insert(0, CLEAN)
+
+from pathwatch.inotify_interface import InotifyWatch
+from pathwatch.native_inotify import NativeInotifyWatch
+
+FILES = 5000
+
+
+def _throughput(watch_class, files):
+    """Return the number of updates per second received from watch_class
+    while files are written in a watched folder"""
+    tempdir = tempfile.mkdtemp()
+    queue = Queue.Queue()
+    watch = watch_class(queue)
+    watch.start()
+    watch.add(tempdir)
+    start = time.time()
+    for i in xrange(files):
+        with open(os.path.join(tempdir, str(i)), 'w') as new_file:
+            new_file.write('x')
+    for _ in xrange(files):
+        queue.get()
+    spent = time.time() - start
+    watch.stop()
+    shutil.rmtree(tempdir, ignore_errors=True)
+    return files / spent
+
+
+def bench(files):
+    """Compare both interfaces"""
+    print '{} written files:'.format(files)
+    print '  pyinotify {:12.1f} updates/s'.format(_throughput(InotifyWatch,
+                                                              files))
+    print '  native    {:12.1f} updates/s'.format(
+        _throughput(NativeInotifyWatch, files))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        bench(int(sys.argv[1]))
+    else:
+        bench(FILES)
@@ -0,0 +1,67 @@
+#!/usr/bin/python2
+
+'''Benchmark looking up paths by e2dk hash, one by one and by batches'''
+
+import sys
+import os
+import random
+import time
+
+BASE = os.path.abspath(__file__)
+DIR = os.path.dirname(BASE)
+TARGET = os.path.join(DIR, '..', 'src')
+CLEAN = os.path.abspath(TARGET)
+assert(os.path.isdir(CLEAN))
+sys.path.insert(0, CLEAN)
+
+from pathwatch.database import DBFilesHelper, DBHashHelper, DBQueryHelper
+
+FILES_PER_DIR = 100
+SIZES = [10000, 100000, 1000000]
+LOOKUPS = 1000
+
+
+def _e2dk(index):
+    """e2dk hash of the file <index>"""
+    return '{:032x}'.format(index)
+
+
+def _fill(filedb, size):
+    """Fill the files table with <size> hashed files"""
+    hashdb = DBHashHelper(None, filedb)
+    filedb.begin()
+    for index in xrange(size):
+        rowid = hashdb.insert_hash(_e2dk(index), '{:08x}'.format(index))
+        path = '/root/{:06d}/{:03d}'.format(index // FILES_PER_DIR,
+                                            index % FILES_PER_DIR)
+        filedb.insert_file(path, 42)
+        filedb.link_to_hash(path, rowid)
+    filedb.commit()
+
+
+def _one_by_one(query, keys):
+    """Look up the keys one by one"""
+    for (e2dk, crc) in keys:
+        query.lookup(e2dk, crc)
+
+
+def bench(size):
+    """Measure the latency of e2dk lookups for a table size"""
+    filedb = DBFilesHelper(':memory:')
+    query = DBQueryHelper(None, filedb)
+    _fill(filedb, size)
+    keys = [(_e2dk(random.randrange(size)), None) for _ in xrange(LOOKUPS)]
+    start = time.time()
+    _one_by_one(query, keys)
+    single = (time.time() - start) * 1000 / LOOKUPS
+    start = time.time()
+    query.lookup_many(keys)
+    batched = (time.time() - start) * 1000 / LOOKUPS
+    filedb.close()
+    print '{:>9} rows: lookup {:7.4f} ms, lookup_many {:7.4f} ms/hash'.format(
+        size, single, batched)
+
+
+if __name__ == '__main__':
+    for table_size in [int(arg) for arg in sys.argv[1:]] or SIZES:
+        bench(table_size)
@@ -0,0 +1,71 @@
+#!/usr/bin/python2
+
+'''Benchmark root and watch descriptor lookups: PathTrie against scans'''
+
+import sys
+import os
+import time
+
+BASE = os.path.abspath(__file__)
+DIR = os.path.dirname(BASE)
+TARGET = os.path.join(DIR, '..', 'src')
+CLEAN = os.path.abspath(TARGET)
+assert(os.path.isdir(CLEAN))
+sys.path.insert(0, CLEAN)
+
+from pathwatch.pathtrie import PathTrie
+
+WATCHES = 200000
+ROOTS = 1000
+LOOKUPS = 100
+
+
+def _timed(function, *args):
+    """Return the time spent running function(*args), in microseconds"""
+    start = time.time()
+    for _ in xrange(LOOKUPS):
+        function(*args)
+    return (time.time() - start) * 1000000 / LOOKUPS
+
+
+def _scan_subtree(watches, path):
+    """Find the watches below path by scanning all of them"""
+    return [watches[key] for key in watches if key.startswith(path)]
+
+
+def _scan_roots(roots, path):
+    """Find if path is in a root by scanning all of them"""
+    for root in roots:
+        if path.startswith(root):
+            return True
+    return False
+
+
+def bench(watches, roots):
+    """Compare subtree and root lookups"""
+    paths = ['/data/{:04d}/{:03d}/{:03d}'.format(i // 10000, (i // 100) % 100,
+                                                 i % 100)
+             for i in xrange(watches)]
+    wd_dict = dict((path, wd) for (wd, path) in enumerate(paths))
+    wd_trie = PathTrie(wd_dict)
+    moved = '/data/0000/042'
+    print '{} watches, subtree of {}:'.format(watches, moved)
+    print '  dict scan {:12.1f} us'.format(_timed(_scan_subtree, wd_dict,
+                                                  moved))
+    print '  PathTrie  {:12.1f} us'.format(_timed(
+        lambda path: list(wd_trie.iter_subtree(path)), moved))
+    root_list = ['/roots/{:05d}'.format(i) for i in xrange(roots)]
+    root_trie = PathTrie((root, True) for root in root_list)
+    unmatched = '/elsewhere/a/b/c'
+    print '{} roots, unmatched path:'.format(roots)
+    print '  list scan {:12.1f} us'.format(_timed(_scan_roots, root_list,
+                                                  unmatched))
+    print '  PathTrie  {:12.1f} us'.format(_timed(root_trie.contains_prefix,
+                                                  unmatched))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        bench(int(sys.argv[1]), int(sys.argv[2]))
+    else:
+        bench(WATCHES, ROOTS)
@@ -0,0 +1,54 @@
+#!/usr/bin/python2
+
+'''Benchmark the Scheduler with many pending timers'''
+
+import sys
+import os
+import threading
+import time
+
+BASE = os.path.abspath(__file__)
+DIR = os.path.dirname(BASE)
+TARGET = os.path.join(DIR, '..', 'src')
+CLEAN = os.path.abspath(TARGET)
+assert(os.path.isdir(CLEAN))
+sys.path.insert(0, CLEAN)
+
+from pathwatch.scheduler import Scheduler
+
+TIMERS = 100000
+
+
+def _nop():
+    """Timer callback"""
+    pass
+
+
+def bench(timers):
+    """Time the addition, cancellation and expiry of <timers> timers"""
+    scheduler = Scheduler()
+    scheduler.start()
+    print '{} timers:'.format(timers)
+    start = time.time()
+    for i in xrange(timers):
+        scheduler.add(60, i, _nop)
+    print '  add    {:8.3f} s'.format(time.time() - start)
+    start = time.time()
+    for i in xrange(timers):
+        scheduler.cancel(i)
+    print '  cancel {:8.3f} s'.format(time.time() - start)
+    done = threading.Event()
+    start = time.time()
+    for i in xrange(timers - 1):
+        scheduler.add(0.5, i, _nop)
+    scheduler.add(0.5, timers, done.set)
+    done.wait()
+    print '  expiry {:8.3f} s (0.5 s delay)'.format(time.time() - start)
+    scheduler.stop()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        bench(int(sys.argv[1]))
+    else:
+        bench(TIMERS)
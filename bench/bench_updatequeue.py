@@ -0,0 +1,69 @@
+#!/usr/bin/python2
+
+'''Benchmark draining updates from Queue.Queue and from UpdateQueue'''
+
+import sys
+import os
+import threading
+import time
+import Queue
+
+BASE = os.path.abspath(__file__)
+DIR = os.path.dirname(BASE)
+TARGET = os.path.join(DIR, '..', 'src')
+CLEAN = os.path.abspath(TARGET)
+assert(os.path.isdir(CLEAN))
+sys.path.insert(0, CLEAN)
+
+from pathwatch.updatequeue import UpdateQueue
+
+UPDATES = 200000
+BATCH = 1000
+
+
+def _produce(queue, updates):
+    """Put <updates> updates in the queue"""
+    for i in xrange(updates):
+        queue.put(('modified', str(i)))
+
+
+def _drain_queue(queue, updates):
+    """Get the updates one by one, as PathWatch used to"""
+    got = 0
+    while got < updates:
+        batch = [queue.get(True, 1)]
+        while len(batch) < BATCH:
+            try:
+                batch.append(queue.get(True, 0.01))
+            except Queue.Empty:
+                break
+        got += len(batch)
+
+
+def _drain_update_queue(queue, updates):
+    """Get the updates by batches"""
+    got = 0
+    while got < updates:
+        got += len(queue.get_many(BATCH, 1, 0.01))
+
+
+def bench(updates):
+    """Time <updates> updates through both queues, with a producer
+    thread"""
+    print '{} updates:'.format(updates)
+    for (name, queue, drain) in (
+            ('Queue.Queue', Queue.Queue(), _drain_queue),
+            ('UpdateQueue', UpdateQueue(updates), _drain_update_queue)):
+        producer = threading.Thread(target=_produce, args=(queue, updates))
+        start = time.time()
+        producer.start()
+        drain(queue, updates)
+        producer.join()
+        print '  {:12} {:8.3f} s'.format(name, time.time() - start)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        bench(int(sys.argv[1]))
+    else:
+        bench(UPDATES)
@@ -0,0 +1,94 @@
+# ----------------------------------------------------------------------------
+# "THE BEER-WARE LICENSE" (Revision 42):
+# <git@lerya.net> wrote this file. As long as you retain this notice you can
+# do whatever you want with this stuff. If we meet some day, and you think
+# this stuff is worth it, you can buy me a beer in return. Vincent Brillault
+# ----------------------------------------------------------------------------
+
+"""Keep the number of inotify watches under a budget"""
+
+from heapq import heapify, heappop, heappush
+
+from .pathtrie import PathTrie
+
+
+class WatchBudget(object):
+    """Track the watched folders with the time of their last change. When
+    more than <max_watches> folders are watched, the least recently changed
+    ones (never the roots) should be unwatched and polled instead."""
+
+    def __init__(self, max_watches):
+        self.max_watches = max_watches
+        self._roots = set()
+        # Watched folder -> time of its last change
+        self._watched = PathTrie()
+        # Heap of (time, folder), valid if _watched has the same time
+        self._heap = []
+
+    def __len__(self):
+        """Number of watched folders"""
+        return len(self._watched)
+
+    def __contains__(self, path):
+        """Check if a folder is watched"""
+        return path in self._watched
+
+    def add_root(self, root):
+        """Roots are watched and never evicted"""
+        self._roots.add(root)
+
+    def remove_root(self, root):
+        """Forget a root and the folders below it"""
+        self._roots.discard(root)
+        self.remove(root)
+
+    def move_root(self, src, dst, now):
+        """A root was moved, with its subfolders"""
+        self._roots.discard(src)
+        self._roots.add(dst)
+        self.move(src, dst, now)
+
+    def _set(self, path, now):
+        """Set the last change of a watched folder"""
+        self._watched[path] = now
+        heappush(self._heap, (now, path))
+
+    def watch(self, paths, now):
+        """Folders started to be watched"""
+        for path in paths:
+            self._set(path, now)
+
+    def touch(self, path, now):
+        """Something changed in a folder, nop if it is not watched"""
+        if path in self._watched:
+            self._set(path, now)
+
+    def move(self, src, dst, now):
+        """A folder was moved, with its subfolders"""
+        moved = list(self._watched.iter_subtree(src))
+        for (path, _) in moved:
+            del self._watched[path]
+        for (path, _) in moved:
+            self._set(dst + path[len(src):], now)
+
+    def remove(self, path):
+        """A folder was removed, with its subfolders"""
+        for (folder, _) in list(self._watched.iter_subtree(path)):
+            del self._watched[folder]
+
+    def evict(self):
+        """Return (and forget) the least recently changed folders exceeding
+        the budget"""
+        evicted = []
+        while len(self._watched) > self.max_watches and len(self._heap) != 0:
+            (last, path) = heappop(self._heap)
+            if self._watched.get(path) != last or path in self._roots:
+                # Changed since, removed or pinned
+                continue
+            del self._watched[path]
+            evicted.append(path)
+        if len(self._heap) > 2 * len(self._watched):
+            self._heap = [(last, path) for (path, last)
+                          in self._watched.iteritems()]
+            heapify(self._heap)
+        return evicted
@@ -0,0 +1,142 @@
+# ----------------------------------------------------------------------------
+# "THE BEER-WARE LICENSE" (Revision 42):
+# <git@lerya.net> wrote this file. As long as you retain this notice you can
+# do whatever you want with this stuff. If we meet some day, and you think
+# this stuff is worth it, you can buy me a beer in return. Vincent Brillault
+# ----------------------------------------------------------------------------
+
+"""Merge redundant inotify updates before applying them"""
+
+
+class _Coalescer(object):
+    """Build the merged list of updates, one update at a time"""
+
+    def __init__(self):
+        self.result = []
+        # path -> index in result of the last update of that kind on path
+        self._modified = {}
+        self._new_dir = {}
+        self._moved_file_to = {}
+        # origin -> destination of the pending move_file chains
+        self._moved_file_from = {}
+
+    def _drop(self, index):
+        """Remove an update from the result"""
+        self.result[index] = None
+
+    def _append(self, update):
+        """Add an update at the end of the result, return its index"""
+        self.result.append(update)
+        return len(self.result) - 1
+
+    def _unchain(self, new_path):
+        """Stop chaining moves with the move_file to new_path, return its
+        index (None if there is none)"""
+        index = self._moved_file_to.pop(new_path, None)
+        if index is not None:
+            del self._moved_file_from[self.result[index][1]]
+        return index
+
+    def _forget(self, path):
+        """Drop the pending updates that a new update on path overrides"""
+        for pending in (self._modified, self._new_dir):
+            try:
+                self._drop(pending.pop(path))
+            except KeyError:
+                pass
+        self._unchain(path)
+        # A chain moves its origin later, once the origin (or a folder
+        # above it) changed it would move the new content
+        prefix = path + '/'
+        for origin in [origin for origin in self._moved_file_from
+                       if origin == path or origin.startswith(prefix)]:
+            self._unchain(self._moved_file_from[origin])
+
+    def _barrier(self, update):
+        """Add an update that prevents merging across it"""
+        self._modified.clear()
+        self._new_dir.clear()
+        self._moved_file_to.clear()
+        self._moved_file_from.clear()
+        self._append(update)
+
+    def _move_file(self, old_path, new_path):
+        """Add a move_file, chaining it with a previous one"""
+        was_modified = old_path in self._modified
+        index = self._unchain(old_path)
+        if index is not None:
+            origin = self.result[index][1]
+            self._drop(index)
+        else:
+            origin = old_path
+        self._forget(old_path)
+        self._forget(new_path)
+        if origin != new_path:
+            self._moved_file_to[new_path] = self._append(('move_file', origin,
+                                                          new_path))
+            self._moved_file_from[origin] = new_path
+        if was_modified:
+            self._modified[new_path] = self._append(('modified', new_path))
+
+    def _move_dir(self, old_path, new_path):
+        """Add a move_dir, chaining it with a move_dir right before"""
+        # Pending scans inside the moved folder happen at the new place
+        prefix = old_path + '/'
+        moved = []
+        for pending in (self._new_dir, self._modified):
+            for path in [path for path in pending
+                         if path == old_path or path.startswith(prefix)]:
+                index = pending.pop(path)
+                moved.append((index, (self.result[index][0],
+                                      new_path + path[len(old_path):])))
+                self._drop(index)
+        while len(self.result) != 0 and self.result[-1] is None:
+            self.result.pop()
+        if (len(self.result) != 0 and self.result[-1][0] == 'move_dir' and
+                self.result[-1][2] == old_path):
+            origin = self.result.pop()[1]
+        else:
+            origin = old_path
+        if origin != new_path:
+            self._barrier(('move_dir', origin, new_path))
+        else:
+            self._barrier(None)
+        for (_, update) in sorted(moved):
+            self.add(update)
+
+    def add(self, update):
+        """Merge a new update"""
+        cmd = update[0]
+        if cmd == 'modified':
+            self._forget(update[1])
+            self._modified[update[1]] = self._append(update)
+        elif cmd == 'new_dir':
+            self._forget(update[1])
+            self._new_dir[update[1]] = self._append(update)
+        elif cmd == 'remove_file' or cmd == 'remove_dir':
+            self._forget(update[1])
+            self._append(update)
+        elif cmd == 'move_file':
+            self._move_file(update[1], update[2])
+        elif cmd == 'move_dir':
+            self._move_dir(update[1], update[2])
+        else:
+            self._barrier(update)
+
+
+def coalesce_updates(updates):
+    """Merge redundant updates (as sent by InotifyWatch) on the same paths:
+        - only the last modified/new_dir on a path is kept,
+        - a removal or a move cancels the previous modified/new_dir on the
+          removed/overwritten path,
+        - a modified/new_dir on a path moved afterwards is applied on the
+          new path,
+        - chained moves (a -> b -> c) are merged (a -> c), unless a got
+          another update in between.
+    Updates are applied after the events happened, thus modified and new_dir
+    look at the current state anyway: dropping the earlier ones loses
+    nothing."""
+    coalescer = _Coalescer()
+    for update in updates:
+        coalescer.add(update)
+    return [update for update in coalescer.result if update is not None]
@@ -9,6 +9,251 @@
 
 import sqlite3
 import os
+import threading
+import time
+
+from .errorwarn import DBChangesPruned
+
+# Connections wait that long for a lock before raising, in seconds
+BUSY_TIMEOUT = 30
+# Number of compiled statements kept by each connection
+CACHED_STATEMENTS = 256
+# Number of idle connections kept in the pool of each database
+POOL_SIZE = 4
+# Values bound by each batched lookup, below the SQLITE_MAX_VARIABLE_NUMBER
+# of older SQLite versions (999)
+MAX_VARIABLES = 500
+# Executed on each new connection: WAL lets readers work while a writer
+# commits, and synchronous=NORMAL only syncs the WAL on checkpoints
+PRAGMAS = ('PRAGMA journal_mode = WAL',
+           'PRAGMA synchronous = NORMAL',
+           'PRAGMA cache_size = -16384',
+           'PRAGMA mmap_size = 268435456',
+           'PRAGMA temp_store = MEMORY',
+           # The rows replaced by INSERT OR REPLACE fire the delete triggers
+           'PRAGMA recursive_triggers = ON')
+
+
+def _subtree_range(path):
+    """Return the half-open [low, high) range of parents below a path
+
+    Every parent strictly below path starts with path + '/', and '0' is the
+    character right after '/': comparing on this range uses the primary key
+    index, where a LIKE prefix match would scan the whole table."""
+    if path.endswith('/'):
+        low = path
+    else:
+        low = path + '/'
+    return (low, low[:-1] + '0')
+
+
+def _add_column(cursor, table, column, declaration):
+    """Add a column missing from a table created by an older version, return
+    True if it was missing"""
+    cursor.execute('PRAGMA table_info({})'.format(table))
+    if any(row[1] == column for row in cursor.fetchall()):
+        return False
+    cursor.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(table, column,
+                                                          declaration))
+    return True
+
+
+# Statistics of a folder: (files, bytes, unhashed, duplicate_bytes) of the
+# files below it, at any depth
+_NO_STATS = (0, 0, 0, 0)
+_ADD_STATS = ('UPDATE dirstats SET files = files + ?, bytes = bytes + ?,'
+              ' unhashed = unhashed + ?,'
+              ' duplicate_bytes = duplicate_bytes + ?'
+              ' WHERE path = ?')
+# Path of the folder stored in a files row
+_FOLDER_PATH = ("CASE WHEN {0}.name = '' THEN {0}.parent"
+                " ELSE rtrim({0}.parent, '/') || '/' || {0}.name END")
+# A file linked to a hash counts in hashes.copies, then its duplicate bytes
+# are logged if <condition> (a file, not a folder): its own if the hash has
+# other copies, and those of the other copy if it was alone. The other copy
+# is only looked up when copies reaches 2, a link costs the same whatever
+# the number of copies: CROSS JOIN keeps hashes as the outer loop
+_LINK = ('UPDATE hashes SET copies = copies + 1 WHERE id = new.identity;'
+         ' INSERT INTO dirstats_delta'
+         ' SELECT new.parent, 0, 0, 0, coalesce(new.size, 0) FROM hashes'
+         ' WHERE id = new.identity AND copies > 1 AND {0};'
+         ' INSERT INTO dirstats_delta'
+         ' SELECT f.parent, 0, 0, 0, coalesce(f.size, 0)'
+         ' FROM hashes AS h CROSS JOIN files AS f'
+         ' WHERE h.id = new.identity AND h.copies = 2 AND {0}'
+         ' AND f.identity = h.id'
+         ' AND (f.parent != new.parent OR f.name != new.name);')
+# A file unlinked from a hash, the reverse
+_UNLINK = ('UPDATE hashes SET copies = copies - 1 WHERE id = old.identity;'
+           ' INSERT INTO dirstats_delta'
+           ' SELECT old.parent, 0, 0, 0, -coalesce(old.size, 0) FROM hashes'
+           ' WHERE id = old.identity AND copies > 0 AND {0};'
+           ' INSERT INTO dirstats_delta'
+           ' SELECT f.parent, 0, 0, 0, -coalesce(f.size, 0)'
+           ' FROM hashes AS h CROSS JOIN files AS f'
+           ' WHERE h.id = old.identity AND h.copies = 1 AND {0}'
+           ' AND f.identity = h.id;')
+# (name, event, body) of the triggers logging the changes of each folder, and
+# counting the copies of each hash
+_STATS_TRIGGERS = (
+    ('dirstats_folder', 'AFTER INSERT ON files WHEN new.mtime = 0',
+     'INSERT OR IGNORE INTO dirstats (path)'
+     ' VALUES (' + _FOLDER_PATH.format('new') + ');'),
+    ('dirstats_insert', 'AFTER INSERT ON files WHEN new.mtime != 0',
+     'INSERT INTO dirstats_delta VALUES (new.parent, 1,'
+     ' coalesce(new.size, 0), new.identity IS 0, 0);'),
+    ('files_link_insert', 'AFTER INSERT ON files WHEN new.identity != 0',
+     _LINK.format('new.mtime != 0')),
+    ('dirstats_delete', 'AFTER DELETE ON files WHEN old.mtime != 0',
+     'INSERT INTO dirstats_delta VALUES (old.parent, -1,'
+     ' -coalesce(old.size, 0), -(old.identity IS 0), 0);'),
+    ('files_link_delete', 'AFTER DELETE ON files WHEN old.identity != 0',
+     _UNLINK.format('old.mtime != 0')),
+    ('dirstats_update',
+     'AFTER UPDATE OF size, identity ON files'
+     ' WHEN old.mtime != 0 AND new.mtime != 0'
+     ' AND (old.size IS NOT new.size'
+     ' OR (old.identity IS 0) != (new.identity IS 0))',
+     'INSERT INTO dirstats_delta VALUES (new.parent, 0,'
+     ' coalesce(new.size, 0) - coalesce(old.size, 0),'
+     ' (new.identity IS 0) - (old.identity IS 0), 0);'),
+    ('files_link_update',
+     'AFTER UPDATE OF identity ON files'
+     ' WHEN old.identity IS NOT new.identity',
+     _UNLINK.format('old.mtime != 0 AND new.mtime != 0') +
+     _LINK.format('old.mtime != 0 AND new.mtime != 0')))
+# Triggers of older versions, replaced by the files_link_* ones which keep
+# hashes.copies and the duplicate bytes in the same order
+_OLD_TRIGGERS = ('files_copies_insert', 'files_copies_delete',
+                 'files_copies_update', 'dirstats_insert_link',
+                 'dirstats_delete_unlink', 'dirstats_update_unlink',
+                 'dirstats_update_link')
+
+
+def _plus(left, right):
+    """Sum of two statistics"""
+    return tuple(a + b for (a, b) in zip(left, right))
+
+
+def _minus(stats):
+    """Opposite of statistics"""
+    return tuple(-value for value in stats)
+
+
+def _add_stats(cursor, deltas):
+    """Add {folder: statistics} deltas to the folders and their ancestors.
+    Folders without statistics (unknown or deleted) are skipped"""
+    totals = {}
+    for (path, delta) in deltas.iteritems():
+        if delta == _NO_STATS:
+            continue
+        cursor.execute(_ADD_STATS, delta + (path,))
+        if cursor.rowcount == 0:
+            continue
+        (child, parent) = (path, os.path.dirname(path))
+        while parent != child:
+            totals[parent] = _plus(totals.get(parent, _NO_STATS), delta)
+            (child, parent) = (parent, os.path.dirname(parent))
+    cursor.executemany(_ADD_STATS, (delta + (path,) for (path, delta)
+                                    in totals.iteritems()
+                                    if delta != _NO_STATS))
+
+
+def _flush_stats(cursor):
+    """Add the deltas logged by the triggers to the folder statistics, each
+    ancestor is updated once"""
+    cursor.execute('SELECT max(rowid) FROM dirstats_delta')
+    last = cursor.fetchone()[0]
+    if last is None:
+        return
+    cursor.execute('SELECT path, sum(files), sum(bytes), sum(unhashed),'
+                   ' sum(duplicate_bytes)'
+                   ' FROM dirstats_delta WHERE rowid <= ? GROUP BY path',
+                   (last,))
+    deltas = dict((row[0], tuple(row[1:])) for row in cursor.fetchall())
+    cursor.execute('DELETE FROM dirstats_delta WHERE rowid <= ?', (last,))
+    _add_stats(cursor, deltas)
+
+
+def _rebuild_stats(cursor):
+    """Compute the statistics of every folder from the files table"""
+    cursor.execute('DELETE FROM dirstats')
+    cursor.execute('DELETE FROM dirstats_delta')
+    cursor.execute('INSERT OR IGNORE INTO dirstats (path)'
+                   ' SELECT ' + _FOLDER_PATH.format('files') +
+                   ' FROM files WHERE mtime = 0')
+    cursor.execute('INSERT INTO dirstats_delta'
+                   ' SELECT f.parent, count(*), sum(coalesce(f.size, 0)),'
+                   ' sum(f.identity IS 0), sum(CASE WHEN h.copies > 1'
+                   '  THEN coalesce(f.size, 0) ELSE 0 END)'
+                   ' FROM files AS f'
+                   ' LEFT JOIN hashes AS h ON h.id = f.identity'
+                   ' WHERE f.mtime != 0 GROUP BY f.parent')
+    _flush_stats(cursor)
+
+
+class DBConnectionManager(object):
+    """Hand out connections to a database, configured for concurrent access
+
+    Released connections are kept, with their statement cache, for the next
+    helper. In-memory databases are private to their connection, thus never
+    pooled."""
+
+    def __init__(self, database, pool_size=POOL_SIZE):
+        self._database = database
+        self._pool_size = pool_size
+        self._pool = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Open and configure a new connection"""
+        # Pooled connections may be used by another thread, one at a time
+        con = sqlite3.connect(self._database, isolation_level=None,
+                              timeout=BUSY_TIMEOUT, check_same_thread=False,
+                              cached_statements=CACHED_STATEMENTS)
+        for pragma in PRAGMAS:
+            con.execute(pragma)
+        return con
+
+    def acquire(self):
+        """Get a connection, from the pool if possible"""
+        if self._database != ':memory:':
+            with self._lock:
+                if len(self._pool) != 0:
+                    return self._pool.pop()
+        return self._connect()
+
+    def release(self, con):
+        """Give a connection back, close it if the pool is full"""
+        if self._database != ':memory:':
+            with self._lock:
+                if len(self._pool) < self._pool_size:
+                    self._pool.append(con)
+                    return
+        con.close()
+
+    def close(self):
+        """Close all the idle connections"""
+        with self._lock:
+            pool = self._pool
+            self._pool = []
+        for con in pool:
+            con.close()
+
+
+_MANAGERS = {}
+_MANAGERS_LOCK = threading.Lock()
+
+
+def get_manager(database):
+    """Get the connection manager shared by all the users of a database"""
+    with _MANAGERS_LOCK:
+        try:
+            return _MANAGERS[database]
+        except KeyError:
+            manager = DBConnectionManager(database)
+            _MANAGERS[database] = manager
+            return manager
 
 
 class DBHelper(object):
@@ -16,10 +261,12 @@ class DBHelper(object):
 
     def __init__(self, database, dbhelper=None):
         if dbhelper is None:
-            self._con = sqlite3.connect(database, isolation_level=None)
+            self._manager = get_manager(database)
+            self._con = self._manager.acquire()
             self._cursor = self._con.cursor()
         else:
             # Using a cursor from another helper. It's ours, thus W0212
+            self._manager = None
             self._con = None
             self._cursor = dbhelper._cursor  # pylint: disable=W0212
         self.create_table()
@@ -28,10 +275,34 @@ class DBHelper(object):
         """Create the table used by this helper"""
         raise NotImplementedError("Sub-Classes need to implement create table")
 
+    def begin(self):
+        """Start a transaction, ended by commit()"""
+        self._cursor.execute('BEGIN')
+
+    def commit(self):
+        """Commit the transaction started by begin()"""
+        self._cursor.execute('COMMIT')
+
+    def savepoint(self, name):
+        """Start a nested part of the transaction, ended by release(name) or
+        undone by rollback_to(name)"""
+        self._cursor.execute('SAVEPOINT {}'.format(name))
+
+    def release(self, name):
+        """Keep what was done since savepoint(name)"""
+        self._cursor.execute('RELEASE {}'.format(name))
+
+    def rollback_to(self, name):
+        """Undo what was done since savepoint(name), and end it"""
+        self._cursor.execute('ROLLBACK TO {}'.format(name))
+        self._cursor.execute('RELEASE {}'.format(name))
+
     def close(self):
-        """Close the connection to the database"""
+        """Give the connection back to the pool"""
         if self._con is not None:
-            self._con.close()
+            self._cursor.close()
+            self._manager.release(self._con)
+            self._con = None
 
 
 class DBRootHelper(DBHelper):
@@ -39,43 +310,219 @@ class DBRootHelper(DBHelper):
 
     def create_table(self):
         """Create the file table needed for the algorithm"""
+        # Removed roots are kept until their files are deleted
         self._cursor.execute('CREATE TABLE IF NOT EXISTS roots ('
-                             ' path TEXT NOT NULL PRIMARY KEY'
+                             ' path TEXT NOT NULL PRIMARY KEY,'
+                             ' removed INTEGER NOT NULL DEFAULT 0'
                              ')')
+        _add_column(self._cursor, 'roots', 'removed',
+                    'INTEGER NOT NULL DEFAULT 0')
 
     def add_root(self, path):
-        """Add a new root, should not be present before"""
+        """Add a new root, should not be present before. A root whose
+        files are still being deleted is added back"""
+        self._cursor.execute('UPDATE roots SET removed = 0'
+                             ' WHERE path = ? AND removed != 0', (path,))
+        if self._cursor.rowcount != 0:
+            return
         self._cursor.execute(('INSERT INTO roots'
                               ' (path)'
                               ' VALUES (?)'),
                              (path,))
 
+    def retire_root(self, path):
+        """Mark a root as removed, remove_root must be called once its files
+        are deleted"""
+        self._cursor.execute('UPDATE roots SET removed = 1 WHERE path = ?',
+                             (path,))
+
+    def remove_root(self, path):
+        """Remove a root, its files are not removed"""
+        self._cursor.execute(('DELETE FROM roots'
+                              ' WHERE path = ?'),
+                             (path,))
+
+    def move_root(self, old_path, new_path):
+        """Rename a root, its files are not moved"""
+        self._cursor.execute(('UPDATE roots SET path = ?'
+                              ' WHERE path = ?'),
+                             (new_path, old_path,))
+
     def is_root(self, path):
         """Test if given path is a root"""
         self._cursor.execute(('SELECT path FROM roots'
-                              ' WHERE path = ?'),
+                              ' WHERE path = ? AND removed = 0'),
                              (path,))
         return self._cursor.fetchone() is not None
 
     def list_roots(self):
         """List all the existing roots"""
-        self._cursor.execute('SELECT path FROM roots')
+        self._cursor.execute('SELECT path FROM roots WHERE removed = 0')
+        return [row[0] for row in self._cursor.fetchall()]
+
+    def list_retired_roots(self):
+        """List the removed roots whose files are not deleted yet"""
+        self._cursor.execute('SELECT path FROM roots WHERE removed != 0')
         return [row[0] for row in self._cursor.fetchall()]
 
 
 class DBFilesHelper(DBHelper):
-    """Database interactions for adding/removing files and paths"""
+    """Database interactions for adding/removing files and paths
+
+    Each mutation is also appended to the change feed (see DBChangesHelper):
+    ('insert', path, None, mtime, None), ('update', path, None, mtime, None),
+    ('move', path, new_path, None, None), ('delete', path, None, None, None)
+    for the path and everything below it, and ('hash', path, None, None,
+    identity)
+
+    Each folder keeps the statistics of the files below it (see
+    DBQueryHelper.dir_stats). Triggers log the changes of each folder, they
+    are added to the folder and its ancestors on commit, or after each
+    mutation outside of transactions. Folders moved or deleted carry their
+    statistics at once."""
+
+    _in_transaction = False
+
+    @staticmethod
+    def _create_table(cursor):
+        """Create the file table needed for the algorithm"""
+        DBHashHelper._create_table(cursor)
+        DBChangesHelper._create_table(cursor)
+        cursor.execute('CREATE TABLE IF NOT EXISTS files ('
+                       ' parent TEXT NOT NULL,'
+                       ' name TEXT NOT NULL,'
+                       ' mtime INTEGER,'
+                       ' identity INTEGER REFERENCES hashes (id),'
+                       ' size INTEGER,'
+                       ' PRIMARY KEY (parent, name)'
+                       ')')
+        # Files scanned by older versions get their size on their next update
+        _add_column(cursor, 'files', 'size', 'INTEGER')
+        cursor.execute('CREATE INDEX IF NOT EXISTS files_identity'
+                       ' ON files (identity)')
+        if _add_column(cursor, 'hashes', 'copies',
+                       'INTEGER NOT NULL DEFAULT 0'):
+            cursor.execute('UPDATE hashes SET copies = ('
+                           ' SELECT count(*) FROM files'
+                           ' WHERE identity = hashes.id)')
+        # Only the duplicated hashes, ordered by wasted bytes
+        cursor.execute('CREATE INDEX IF NOT EXISTS hashes_wasted'
+                       ' ON hashes ((copies - 1) * size) WHERE copies > 1')
+        cursor.execute("SELECT name FROM sqlite_master"
+                       " WHERE type = 'table' AND name = 'dirstats'")
+        upgrade = cursor.fetchone() is None
+        cursor.execute('CREATE TABLE IF NOT EXISTS dirstats ('
+                       ' path TEXT PRIMARY KEY,'
+                       ' files INTEGER NOT NULL DEFAULT 0,'
+                       ' bytes INTEGER NOT NULL DEFAULT 0,'
+                       ' unhashed INTEGER NOT NULL DEFAULT 0,'
+                       ' duplicate_bytes INTEGER NOT NULL DEFAULT 0'
+                       ')')
+        cursor.execute('CREATE TABLE IF NOT EXISTS dirstats_delta ('
+                       ' path TEXT NOT NULL,'
+                       ' files INTEGER NOT NULL,'
+                       ' bytes INTEGER NOT NULL,'
+                       ' unhashed INTEGER NOT NULL,'
+                       ' duplicate_bytes INTEGER NOT NULL'
+                       ')')
+        # hashes.copies counts the files linked to each hash (files_link_*),
+        # unhashed files have the identity 0 which matches no hash
+        for name in _OLD_TRIGGERS:
+            cursor.execute('DROP TRIGGER IF EXISTS {}'.format(name))
+        for (name, event, body) in _STATS_TRIGGERS:
+            cursor.execute('CREATE TRIGGER IF NOT EXISTS {} {} BEGIN {} END'
+                           .format(name, event, body))
+        if upgrade:
+            # Folders scanned by older versions
+            cursor.execute('BEGIN')
+            _rebuild_stats(cursor)
+            cursor.execute('COMMIT')
 
     def create_table(self):
         """Create the file table needed for the algorithm"""
-        DBHashHelper._create_table(self._cursor)
-        self._cursor.execute('CREATE TABLE IF NOT EXISTS files ('
-                             ' parent TEXT NOT NULL,'
-                             ' name TEXT NOT NULL,'
-                             ' mtime INTEGER,'
-                             ' identity INTEGER REFERENCES hashes (id),'
-                             ' PRIMARY KEY (parent, name)'
-                             ')')
+        DBFilesHelper._create_table(self._cursor)
+
+    def begin(self):
+        """Start a transaction, ended by commit(). The folder statistics are
+        updated on commit"""
+        super(DBFilesHelper, self).begin()
+        self._in_transaction = True
+
+    def commit(self):
+        """Update the folder statistics, commit the transaction started by
+        begin()"""
+        self.flush_stats()
+        super(DBFilesHelper, self).commit()
+        self._in_transaction = False
+
+    def flush_stats(self):
+        """Add the changes logged since the last flush to the folder
+        statistics"""
+        _flush_stats(self._cursor)
+
+    def rebuild_stats(self):
+        """Compute the statistics of every folder again from the files"""
+        _rebuild_stats(self._cursor)
+
+    def _mutated(self, detached=False):
+        """Update the folder statistics after a mutation, unless in a
+        transaction. Always after deleting a detached folder: the changes
+        logged below it are dropped before it can be created again"""
+        if detached or not self._in_transaction:
+            self.flush_stats()
+
+    def _contribution(self, path):
+        """Statistics that a path adds to its ancestors: those of the files
+        below it for a folder"""
+        parent = os.path.dirname(path)
+        name = os.path.basename(path)
+        self._cursor.execute('SELECT f.mtime, coalesce(f.size, 0),'
+                             ' f.identity IS 0, coalesce(h.copies, 0)'
+                             ' FROM files AS f'
+                             ' LEFT JOIN hashes AS h ON h.id = f.identity'
+                             ' WHERE f.parent = ? AND f.name = ?',
+                             (parent, name,))
+        row = self._cursor.fetchone()
+        if row is None:
+            return _NO_STATS
+        elif row[0] != 0:
+            return (1, row[1], row[2], row[1] if row[3] > 1 else 0)
+        return self._folder_stats(path)
+
+    def _folder_stats(self, path):
+        """Statistics of a folder, including the changes logged below it"""
+        self.flush_stats()
+        self._cursor.execute('SELECT files, bytes, unhashed, duplicate_bytes'
+                             ' FROM dirstats WHERE path = ?', (path,))
+        row = self._cursor.fetchone()
+        if row is None:
+            return _NO_STATS
+        return tuple(row)
+
+    def _detach(self, path):
+        """Remove the statistics of a folder from its ancestors, delete them
+        and those of the folders below it, before deleting the folder.
+        Return True if the path had statistics"""
+        self._cursor.execute('SELECT 1 FROM dirstats WHERE path = ?',
+                             (path,))
+        if self._cursor.fetchone() is None:
+            return False
+        stats = self._folder_stats(path)
+        _add_stats(self._cursor, {os.path.dirname(path): _minus(stats)})
+        (low, high) = _subtree_range(path)
+        # The changes logged below are dropped with their folders
+        self._cursor.execute('DELETE FROM dirstats'
+                             ' WHERE path = ? OR (path >= ? AND path < ?)',
+                             (path, low, high,))
+        return True
+
+    def _log(self, changes):
+        """Append (op, path, dest, mtime, identity) changes to the feed"""
+        now = int(time.time())
+        self._cursor.executemany('INSERT INTO changes'
+                                 ' (time, op, path, dest, mtime, identity)'
+                                 ' VALUES (?, ?, ?, ?, ?, ?)',
+                                 ((now,) + change for change in changes))
 
     def get_path(self, path):
         """Get the information about a file/folder"""
@@ -101,14 +548,16 @@ class DBFilesHelper(DBHelper):
             row = self._cursor.fetchone()
         return (files, dirs)
 
-    def insert_file(self, path, mtime):
-        """Insert a new file"""
+    def insert_file(self, path, mtime, size=None):
+        """Insert a new file, replacing any previous entry"""
         parent = os.path.dirname(path)
         name = os.path.basename(path)
-        self._cursor.execute(('INSERT INTO files'
-                              ' (mtime, parent, name, identity)'
-                              ' VALUES (?, ?, ? ,0)'),
-                             (mtime, parent, name,))
+        self._cursor.execute(('INSERT OR REPLACE INTO files'
+                              ' (mtime, parent, name, size, identity)'
+                              ' VALUES (?, ?, ?, ?, 0)'),
+                             (mtime, parent, name, size,))
+        self._log([('insert', path, None, mtime, None)])
+        self._mutated()
 
     def insert_dir(self, path):
         """Insert a new folder"""
@@ -116,25 +565,36 @@ class DBFilesHelper(DBHelper):
         self.insert_file(path, 0)
 
     def insert_files(self, new_data):
-        """Insert a bunch of files"""
+        """Insert a bunch of (mtime, parent, name, size) files"""
         if len(new_data) == 0:
             return
-        self._cursor.executemany(('INSERT INTO files'
-                                  ' (mtime, parent, name, identity)'
-                                  ' VALUES (?, ?, ? ,0)'),
+        self._cursor.executemany(('INSERT OR REPLACE INTO files'
+                                  ' (mtime, parent, name, size, identity)'
+                                  ' VALUES (?, ?, ?, ?, 0)'),
                                  iter(new_data))
+        self._log(('insert', os.path.join(parent, name), None, mtime, None)
+                  for (mtime, parent, name, _) in new_data)
+        self._mutated()
 
     def insert_dirs(self, root, names):
         """Insert a bunch of files"""
         if len(names) == 0:
             return
-        self._cursor.executemany(('INSERT INTO files'
+        self._cursor.executemany(('INSERT OR REPLACE INTO files'
                                   ' (mtime, parent, name, identity)'
                                   ' VALUES (0, ?, ? ,0)'),
                                  iter([(root, name) for name in names]))
+        self._log(('insert', os.path.join(root, name), None, 0, None)
+                  for name in names)
+        self._mutated()
 
     def move_file(self, old_path, new_path):
-        """Move a file"""
+        """Move a file, over the destination if it exists, return True if it
+        was found"""
+        if old_path == new_path:
+            return False
+        self.delete_single(new_path)
+        stats = self._contribution(old_path)
         old_parent = os.path.dirname(old_path)
         old_name = os.path.basename(old_path)
         new_parent = os.path.dirname(new_path)
@@ -142,60 +602,134 @@ class DBFilesHelper(DBHelper):
         self._cursor.execute('UPDATE files SET parent = ?, name = ?'
                              ' WHERE parent == ? AND name == ?',
                              (new_parent, new_name, old_parent, old_name,))
+        if self._cursor.rowcount == 0:
+            return False
+        self._cursor.execute('UPDATE dirstats SET path = ? WHERE path = ?',
+                             (new_path, old_path,))
+        # Both parents are the same folder for a rename
+        deltas = {old_parent: _minus(stats)}
+        deltas[new_parent] = _plus(deltas.get(new_parent, _NO_STATS), stats)
+        _add_stats(self._cursor, deltas)
+        self._log([('move', old_path, new_path, None, None)])
+        self._mutated()
+        return True
 
     def move_dir(self, old_path, new_path):
-        """Move a folder"""
-        self._cursor.execute('UPDATE files SET parent = replace(parent, ?, ?)'
-                             ' WHERE parent like ?',
-                             (old_path, new_path, old_path + '%',))
-        self.move_file(old_path, new_path)
-
-    def update_file(self, path, mtime):
-        """Update the mtime information about a file"""
+        """Move a folder, over the destination if it exists"""
+        if old_path == new_path:
+            return
+        self.delete_path(new_path)
+        # The changes logged below the folder are for their old paths
+        self.flush_stats()
+        (low, high) = _subtree_range(old_path)
+        self._cursor.execute('UPDATE dirstats'
+                             ' SET path = ? || substr(path, length(?) + 1)'
+                             ' WHERE path >= ? AND path < ?',
+                             (new_path, old_path, low, high,))
+        self._cursor.execute('UPDATE files'
+                             ' SET parent = ? || substr(parent, length(?) + 1)'
+                             ' WHERE parent = ?'
+                             ' OR (parent >= ? AND parent < ?)',
+                             (new_path, old_path, old_path, low, high,))
+        moved = self._cursor.rowcount
+        if not self.move_file(old_path, new_path) and moved != 0:
+            # The content moved without its folder row
+            self._log([('move', old_path, new_path, None, None)])
+
+    def update_file(self, path, mtime, size=None):
+        """Update the mtime information about a file, insert it if missing
+        (the caller might have read an outdated state)"""
         parent = os.path.dirname(path)
         name = os.path.basename(path)
-        self._cursor.execute(('UPDATE files SET mtime = ?, identity = 0'
+        self._cursor.execute(('UPDATE files SET mtime = ?, size = ?,'
+                              ' identity = 0'
                               ' WHERE parent == ? AND name == ?'),
-                             (mtime, parent, name,))
+                             (mtime, size, parent, name,))
+        if self._cursor.rowcount == 0:
+            self.insert_file(path, mtime, size)
+        else:
+            self._log([('update', path, None, mtime, None)])
+            self._mutated()
 
     def update_files(self, new_data):
-        """Update the mtime information about a bunch of files"""
+        """Update the mtime information about a bunch of (mtime, parent,
+        name, size) files"""
         if len(new_data) == 0:
             return
-        self._cursor.executemany(('UPDATE files SET mtime = ?, identity=0'
-                                  ' WHERE parent == ? AND name == ?'),
+        self._cursor.executemany(('UPDATE files SET mtime = ?1, size = ?4,'
+                                  ' identity = 0'
+                                  ' WHERE parent == ?2 AND name == ?3'),
                                  iter(new_data))
+        # Only the files found are logged
+        now = int(time.time())
+        self._cursor.executemany("INSERT INTO changes"
+                                 " (time, op, path, dest, mtime, identity)"
+                                 " SELECT ?, 'update', ?, NULL, mtime, NULL"
+                                 " FROM files WHERE parent = ? AND name = ?",
+                                 ((now, os.path.join(parent, name), parent,
+                                   name)
+                                  for (_, parent, name, _) in new_data))
+        self._mutated()
 
     def delete_single(self, path):
-        """Delete a single file/folder"""
+        """Delete a single file/folder, return True if it was found"""
+        detached = self._detach(path)
         parent = os.path.dirname(path)
         name = os.path.basename(path)
         self._cursor.execute(('DELETE FROM files'
                               ' WHERE parent == ?  AND name == ?'),
                              (parent, name,))
+        if self._cursor.rowcount == 0:
+            return False
+        self._log([('delete', path, None, None, None)])
+        self._mutated(detached)
+        return True
+
+    def _delete_subtree(self, path):
+        """Delete the content of the tree under a path, not the path itself,
+        return the number of deleted rows"""
+        (low, high) = _subtree_range(path)
+        self._cursor.execute('DELETE FROM files'
+                             ' WHERE parent = ?'
+                             ' OR (parent >= ? AND parent < ?)',
+                             (path, low, high,))
+        return self._cursor.rowcount
+
+    def delete_subtree_chunk(self, path, limit):
+        """Delete up to <limit> rows of the tree under a path (not the path
+        itself), return the number of deleted rows"""
+        # The whole tree goes, its statistics leave at the first chunk and
+        # each chunk deletes below a detached folder
+        self._detach(path)
+        (low, high) = _subtree_range(path)
+        self._cursor.execute('DELETE FROM files WHERE rowid IN ('
+                             ' SELECT rowid FROM files'
+                             ' WHERE parent = ?'
+                             ' OR (parent >= ? AND parent < ?)'
+                             ' LIMIT ?)',
+                             (path, low, high, limit,))
+        deleted = self._cursor.rowcount
+        self._mutated(True)
+        return deleted
 
     def delete_path(self, path):
         """Delete the whole tree under a path"""
-        self._cursor.execute('DELETE FROM files'
-                             ' WHERE parent = ? OR parent LIKE ?',
-                             (path, os.path.join(path, '%'),))
-        self.delete_single(path)
+        detached = self._detach(path)
+        deleted = self._delete_subtree(path)
+        if not self.delete_single(path) and deleted != 0:
+            # The content was deleted without its folder row
+            self._log([('delete', path, None, None, None)])
+        self._mutated(detached)
 
     def delete_singles(self, root, names):
         """Remove a bunch of outdated paths"""
         for name in names:
-            self._cursor.execute(('DELETE FROM files'
-                                  ' WHERE parent == ?  AND name == ?'),
-                                 (root, name,))
+            self.delete_single(os.path.join(root, name))
 
     def delete_paths(self, root, names):
         """Remove a bunch of outdated paths"""
         for name in names:
-            path = os.path.join(root, name)
-            self._cursor.execute('DELETE FROM files'
-                                 ' WHERE parent = ? OR parent LIKE ?',
-                                 (path, os.path.join(path, '%'),))
-        self.delete_singles(root, names)
+            self.delete_path(os.path.join(root, name))
 
     def link_to_hash(self, path, rowid):
         """Link a path to a hash"""
@@ -205,7 +739,11 @@ class DBFilesHelper(DBHelper):
                              ' SET identity = ?'
                              ' WHERE parent == ?  AND name == ?',
                              (rowid, parent, name,))
-        return self._cursor.rowcount
+        linked = self._cursor.rowcount
+        if linked != 0:
+            self._log([('hash', path, None, None, rowid)])
+            self._mutated()
+        return linked
 
     def get_unhashed_files(self, max_files):
         """Get at most <max> files that weren't hashed yet"""
@@ -234,8 +772,9 @@ class DBFilesHelper(DBHelper):
     def _list_hashes_join(self):
         """List all the files, with their hash_ids, for testing purpose only"""
         self._cursor.execute('SELECT f.parent,f.name,h.crc,h.e2dk'
-                             ' FROM files AS f NATURAL LEFT JOIN hashes AS h'
-                             ' WHERE mtime IS NOT 0')
+                             ' FROM files AS f'
+                             ' LEFT JOIN hashes AS h ON h.id = f.identity'
+                             ' WHERE f.mtime IS NOT 0')
         result = {}
         row = self._cursor.fetchone()
         while row is not None:
@@ -266,8 +805,14 @@ class DBHashHelper(DBHelper):
                        ' e2dk TEXT NOT NULL,'
                        ' content INTEGER,'
                        ' upstream INTEGER,'
+                       ' size INTEGER,'
+                       ' copies INTEGER NOT NULL DEFAULT 0,'
                        ' UNIQUE (crc, e2dk)'
                        ')')
+        _add_column(cursor, 'hashes', 'size', 'INTEGER')
+        # UNIQUE (crc, e2dk) serves the lookups by CRC, not by e2dk
+        cursor.execute('CREATE INDEX IF NOT EXISTS hashes_e2dk'
+                       ' ON hashes (e2dk)')
 
     def create_table(self):
         """Create the file table needed for the storing hash"""
@@ -280,20 +825,25 @@ class DBHashHelper(DBHelper):
                              (e2dk, crc,))
         return self._cursor.fetchone()
 
-    def insert_hash(self, e2dk, crc):
-        """Insert a new hash into the database"""
+    def insert_hash(self, e2dk, crc, size=None):
+        """Insert a new hash into the database, of content of <size> bytes
+        if known"""
         try:
             self._cursor.execute('INSERT INTO hashes'
-                                 ' (e2dk, crc) '
-                                 ' VALUES (?, ?)',
-                                 (e2dk, crc,))
+                                 ' (e2dk, crc, size) '
+                                 ' VALUES (?, ?, ?)',
+                                 (e2dk, crc, size,))
             return self._cursor.lastrowid
         except sqlite3.IntegrityError as sqlie:
             rowid = self._get_id(e2dk, crc)
             if rowid is None:
                 raise sqlie
-            else:
-                return rowid[0]
+            if size is not None:
+                # Hashes inserted by older versions have no size
+                self._cursor.execute('UPDATE hashes SET size = ?'
+                                     ' WHERE id = ? AND size IS NULL',
+                                     (size, rowid[0],))
+            return rowid[0]
 
     def _get_full_content(self):
         """Fetch the whole content of the database, for testing purpose only"""
@@ -304,3 +854,199 @@ class DBHashHelper(DBHelper):
             real_database[row[0]] = row[1:]
             row = self._cursor.fetchone()
         return real_database
+
+
+class DBChangesHelper(DBHelper):
+    """Database interactions for the consumers of the change feed
+
+    Every mutation of the files table appends a change with a monotonic
+    sequence number (see DBFilesHelper). Consumers keep the last sequence
+    number they handled, read the changes following it, and only read the
+    files table again if those were pruned."""
+
+    @staticmethod
+    def _create_table(cursor):
+        """Create the table of the change feed"""
+        # AUTOINCREMENT: sequence numbers are not reused once pruned
+        cursor.execute('CREATE TABLE IF NOT EXISTS changes ('
+                       ' seq INTEGER PRIMARY KEY AUTOINCREMENT,'
+                       ' time INTEGER NOT NULL,'
+                       ' op TEXT NOT NULL,'
+                       ' path TEXT NOT NULL,'
+                       ' dest TEXT,'
+                       ' mtime INTEGER,'
+                       ' identity INTEGER'
+                       ')')
+
+    def create_table(self):
+        """Create the table of the change feed"""
+        DBChangesHelper._create_table(self._cursor)
+
+    def last_seq(self):
+        """Sequence number of the last change, 0 if there were none: a new
+        consumer reading the files table now starts from it"""
+        self._cursor.execute('SELECT seq FROM sqlite_sequence'
+                             ' WHERE name = ?', ('changes',))
+        row = self._cursor.fetchone()
+        if row is None:
+            return 0
+        return row[0]
+
+    def changes_since(self, seq, limit=1000):
+        """Return up to <limit> changes following the sequence number <seq>,
+        as (seq, op, path, dest, mtime, identity) tuples. Raise
+        DBChangesPruned if some of them were pruned"""
+        self._cursor.execute('SELECT seq, op, path, dest, mtime, identity'
+                             ' FROM changes WHERE seq > ?'
+                             ' ORDER BY seq LIMIT ?',
+                             (seq, limit,))
+        changes = self._cursor.fetchall()
+        # Sequence numbers only have holes where changes were pruned
+        if len(changes) != 0:
+            missed = changes[0][0] > seq + 1
+        else:
+            missed = self.last_seq() > seq
+        if missed:
+            raise DBChangesPruned(seq)
+        return changes
+
+    def prune(self, before):
+        """Delete the changes older than the timestamp <before>, return the
+        number of deleted changes"""
+        # Sequence numbers follow time: only the pruned rows are read
+        self._cursor.execute('DELETE FROM changes WHERE seq < coalesce('
+                             ' (SELECT seq FROM changes WHERE time >= ?'
+                             '  ORDER BY seq LIMIT 1),'
+                             ' (SELECT max(seq) + 1 FROM changes))',
+                             (before,))
+        return self._cursor.rowcount
+
+
+class DBQueryHelper(DBHelper):
+    """Read-only queries over the files and their hashes
+
+    Each hash counts the files linked to it (hashes.copies), maintained by
+    triggers on the files table: the duplicates are read from the hashes
+    having more than one copy, without grouping the files table."""
+
+    def create_table(self):
+        """Create the tables queried by this helper"""
+        DBFilesHelper._create_table(self._cursor)
+
+    def dir_stats(self, path):
+        """Return the (files, bytes, unhashed, duplicate_bytes) of the files
+        below a folder, at any depth, None if the folder is unknown. Files
+        without a known size count for 0 bytes. Duplicate bytes are those
+        of the files whose content has another copy anywhere"""
+        self._cursor.execute('SELECT files, bytes, unhashed, duplicate_bytes'
+                             ' FROM dirstats WHERE path = ?',
+                             (path.rstrip('/') or '/',))
+        row = self._cursor.fetchone()
+        if row is None:
+            return None
+        return tuple(row)
+
+    def paths(self, identity):
+        """List the paths linked to a hash"""
+        self._cursor.execute('SELECT parent, name FROM files'
+                             ' WHERE identity = ?', (identity,))
+        return [os.path.join(parent, name)
+                for (parent, name) in self._cursor.fetchall()]
+
+    def duplicates(self, limit=100, offset=0):
+        """Return up to <limit> duplicated hashes, by decreasing wasted bytes
+        (those of unknown size last), as (identity, copies, size, wasted)
+        tuples"""
+        self._cursor.execute('SELECT id, copies, size, (copies - 1) * size'
+                             ' FROM hashes WHERE copies > 1'
+                             ' ORDER BY (copies - 1) * size DESC'
+                             ' LIMIT ? OFFSET ?', (limit, offset,))
+        return self._cursor.fetchall()
+
+    def duplicates_below(self, path):
+        """Map each hash having a copy under a path and another copy
+        anywhere to the paths of its copies under the path"""
+        (low, high) = _subtree_range(path)
+        self._cursor.execute('SELECT f.parent, f.name, f.identity'
+                             ' FROM files AS f'
+                             ' JOIN hashes AS h ON h.id = f.identity'
+                             ' WHERE (f.parent = ?'
+                             ' OR (f.parent >= ? AND f.parent < ?))'
+                             ' AND h.copies > 1',
+                             (path, low, high,))
+        result = {}
+        row = self._cursor.fetchone()
+        while row is not None:
+            result.setdefault(row[2], []).append(os.path.join(row[0], row[1]))
+            row = self._cursor.fetchone()
+        return result
+
+    def _paths_by(self, column, values):
+        """Yield the (e2dk, crc, path) of the files whose hash has one of the
+        values in a column, by batches of MAX_VARIABLES values"""
+        values = list(values)
+        for start in xrange(0, len(values), MAX_VARIABLES):
+            chunk = values[start:start + MAX_VARIABLES]
+            self._cursor.execute('SELECT h.e2dk, h.crc, f.parent, f.name'
+                                 ' FROM hashes AS h'
+                                 ' JOIN files AS f ON f.identity = h.id'
+                                 ' WHERE h.{} IN ({})'.format(
+                                     column, ', '.join('?' * len(chunk))),
+                                 chunk)
+            for (e2dk, crc, parent, name) in self._cursor.fetchall():
+                yield (e2dk, crc, os.path.join(parent, name))
+
+    def lookup_many(self, keys):
+        """Map each (e2dk, crc) key, either of them being None if unknown, to
+        the paths whose content matches it. Hashes are case-insensitive"""
+        keys = set(keys)
+        result = dict((key, []) for key in keys)
+        # Lower-case hashes -> the keys asking for them
+        by_e2dk = {}
+        by_crc = {}
+        for (e2dk, crc) in keys:
+            assert(e2dk is not None or crc is not None)
+            if e2dk is not None:
+                by_e2dk.setdefault(e2dk.lower(), []).append((e2dk, crc))
+            else:
+                by_crc.setdefault(crc.lower(), []).append((e2dk, crc))
+        for (e2dk, crc, path) in self._paths_by('e2dk', by_e2dk):
+            for key in by_e2dk[e2dk]:
+                if key[1] is None or key[1].lower() == crc:
+                    result[key].append(path)
+        for (e2dk, crc, path) in self._paths_by('crc', by_crc):
+            for key in by_crc[crc]:
+                result[key].append(path)
+        return result
+
+    def lookup(self, e2dk=None, crc=None):
+        """List the paths whose content has an e2dk hash and/or a CRC"""
+        return self.lookup_many([(e2dk, crc)])[(e2dk, crc)]
+
+    def iter_files(self, path, batch_size=1000):
+        """Yield the (path, mtime, size, e2dk, crc) of the files under a
+        path, sorted by folder, e2dk and crc being None until hashed. Rows
+        are read <batch_size> at a time from a dedicated cursor: memory use
+        does not depend on the number of files, and this helper can be used
+        meanwhile"""
+        (low, high) = _subtree_range(path)
+        cursor = self._cursor.connection.cursor()
+        try:
+            # A single range of the primary key, without the siblings
+            # sorting between path and path + '/' (e.g. path + '-')
+            cursor.execute('SELECT f.parent, f.name, f.mtime,'
+                           ' coalesce(f.size, h.size), h.e2dk, h.crc'
+                           ' FROM files AS f'
+                           ' LEFT JOIN hashes AS h ON h.id = f.identity'
+                           ' WHERE f.parent >= ? AND f.parent < ?'
+                           ' AND (f.parent = ? OR f.parent >= ?)'
+                           ' AND f.mtime != 0'
+                           ' ORDER BY f.parent, f.name',
+                           (path, high, path, low,))
+            rows = cursor.fetchmany(batch_size)
+            while len(rows) != 0:
+                for (parent, name, mtime, size, e2dk, crc) in rows:
+                    yield (os.path.join(parent, name), mtime, size, e2dk, crc)
+                rows = cursor.fetchmany(batch_size)
+        finally:
+            cursor.close()
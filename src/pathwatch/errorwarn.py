@@ -6,7 +6,7 @@ class InotifyFSUnmount(Warning):
 
 
 class InotifyQueueOverflow(Warning):
-    """The underlying queue overflowed, stopping inotify daemon"""
+    """The underlying queue overflowed, events were lost: rescanning"""
 
 
 class InotifyUnexpectedEvent(Warning):
@@ -18,8 +18,8 @@ class InotifyRootDeleted(Warning):
 
 
 class InotifyRootMoved(Warning):
-    """A inotify root was deleted, please update the configuration.
-    Moves to other roots not supported yet"""
+    """A inotify root was moved but could not be followed, please update
+    the configuration"""
 
 
 class InotifyTranscientPath(Warning):
@@ -32,3 +32,33 @@ class InotifyDisappearingWD(Warning):
 
 class InotifyMissingingWD(Warning):
     """A watch Descriptor from inotify disappeared"""
+
+
+class DBFailedMutation(Warning):
+    """A queued database mutation could not be applied"""
+
+
+class DBWriterStopped(Exception):
+    """The database writer is not running, the queued mutations will not be
+    committed"""
+
+
+class InvalidRoot(Exception):
+    """A root must be an existing folder"""
+
+
+class PollingRootDeleted(Warning):
+    """A polled root was deleted, please update the configuration"""
+
+
+class DBChangesPruned(Exception):
+    """The changes following a cursor were pruned from the change feed, the
+    consumer should read the files table again"""
+
+
+class SubscriberFailed(Warning):
+    """A subscriber raised while receiving events, they were dropped"""
+
+
+class SubscribersLagging(Warning):
+    """Changes were pruned before being delivered to the subscribers"""
@@ -0,0 +1,92 @@
+# ----------------------------------------------------------------------------
+# "THE BEER-WARE LICENSE" (Revision 42):
+# <git@lerya.net> wrote this file. As long as you retain this notice you can
+# do whatever you want with this stuff. If we meet some day, and you think
+# this stuff is worth it, you can buy me a beer in return. Vincent Brillault
+# ----------------------------------------------------------------------------
+
+"""Export the files known under a path as ed2k links, CSV or JSON lines"""
+
+import csv
+import os
+import urllib
+from json.encoder import encode_basestring_ascii
+
+from .database import DBQueryHelper
+
+FORMATS = ('ed2k', 'csv', 'json')
+CSV_HEADER = ('path', 'mtime', 'size', 'e2dk', 'crc')
+# JSON object of a file, its values encoded by _json_value
+_JSON_ROW = '{{{}}}\n'.format(','.join('"{}":%s'.format(key)
+                                       for key in CSV_HEADER))
+
+
+def _utf8(text):
+    """Encode the text read from the database for byte-oriented writers"""
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+
+def ed2k_link(path, size, e2dk):
+    """Return the ed2k link of a file"""
+    return 'ed2k://|file|{}|{}|{}|/'.format(
+        urllib.quote(_utf8(os.path.basename(path))), size, e2dk.upper())
+
+
+def _write_ed2k(output, files):
+    """Write the link of each hashed file of known size"""
+    count = 0
+    for (path, _, size, e2dk, _) in files:
+        if e2dk is None or size is None:
+            continue
+        output.write(ed2k_link(path, size, e2dk) + '\n')
+        count += 1
+    return count
+
+
+def _write_csv(output, files):
+    """Write a CSV header, then a row for each file"""
+    writer = csv.writer(output)
+    writer.writerow(CSV_HEADER)
+    count = 0
+    for row in files:
+        writer.writerow([_utf8(value) for value in row])
+        count += 1
+    return count
+
+
+def _json_value(value):
+    """Encode a value read from the database as JSON"""
+    if value is None:
+        return 'null'
+    elif isinstance(value, basestring):
+        return encode_basestring_ascii(value)
+    return str(value)
+
+
+def _write_json(output, files):
+    """Write a JSON object for each file, one per line"""
+    # Formatting the known keys is several times faster than json.dumps
+    count = 0
+    for row in files:
+        output.write(_JSON_ROW % tuple(_json_value(value) for value in row))
+        count += 1
+    return count
+
+
+_WRITERS = {'ed2k': _write_ed2k, 'csv': _write_csv, 'json': _write_json}
+
+
+def export(database, path, output, fmt='ed2k'):
+    """Write the files under a root or a prefix to the file object <output>,
+    in a format of FORMATS: ed2k links of the hashed files, CSV rows (with a
+    header) or JSON objects, one per line. Files are streamed from the
+    database, the memory used does not depend on their number. Return the
+    number of files written"""
+    assert(fmt in FORMATS)
+    query = DBQueryHelper(database)
+    try:
+        return _WRITERS[fmt](output, query.iter_files(path))
+    finally:
+        query.close()
@@ -23,11 +23,14 @@ def _get_md4():
 
 
 def _crc_and_e2dk(filename):
-    """Compute the CRC and e2dk hash of a given file, can raise an IOError"""
+    """Compute the CRC, e2dk hash and size of a given file, can raise an
+    IOError"""
     with open(filename, 'rb') as input_file:
         crc = 0
         e2dk = []
+        size = 0
         for buf in iter(lambda: input_file.read(E2DK_BLOCK), ""):
+            size += len(buf)
             crc = zlib.crc32(buf, crc)
             md4 = _get_md4()
             md4.update(buf)
@@ -42,18 +45,19 @@ def _crc_and_e2dk(filename):
             for md4 in e2dk:
                 final_md4.update(md4.digest())
             final_e2dk = final_md4.hexdigest()
-        return (final_crc, final_e2dk)
+        return (final_crc, final_e2dk, size)
 
 
 class Hasher(threading.Thread):
     """Threaded process that gets files to hash from the database and
-    hash them"""
+    hash them. If a DBWriter is given, results are queued to it."""
 
-    def __init__(self, database, files_per_call=10):
+    def __init__(self, database, files_per_call=10, writer=None):
         super(Hasher, self).__init__()
         self._wakeup = threading.Condition()
         self.files_per_call = files_per_call
         self._db = database
+        self._writer = writer
         self._end = threading.Event()
 
     def run(self):
@@ -61,19 +65,31 @@ class Hasher(threading.Thread):
         hashdb = DBHashHelper(self._db)
         filedb = DBFilesHelper(None, hashdb)
         while not self._end.is_set():
+            if self._writer is not None:
+                # Wait for the files we were notified about, and for the
+                # results of the previous call (otherwise returned again)
+                self._writer.flush()
             to_be_hashed = filedb.get_unhashed_files(self.files_per_call)
             for filename in to_be_hashed:
                 try:
-                    (crc, e2dk) = _crc_and_e2dk(filename)
-                    rowid = hashdb.insert_hash(e2dk, crc)
-                    filedb.link_to_hash(filename, rowid)
+                    (crc, e2dk, size) = _crc_and_e2dk(filename)
+                    if self._writer is None:
+                        rowid = hashdb.insert_hash(e2dk, crc, size)
+                        filedb.link_to_hash(filename, rowid)
+                    else:
+                        self._writer.hash_file(filename, e2dk, crc, size)
                 except IOError:
-                    filedb.delete_path(filename)
+                    if self._writer is None:
+                        filedb.delete_path(filename)
+                    else:
+                        self._writer.delete_path(filename)
                 if self._end.is_set():
                     break
             if len(to_be_hashed) == 0:
                 with self._wakeup:
-                    self._wakeup.wait()
+                    # stop() might have notified before the lock was taken
+                    if not self._end.is_set():
+                        self._wakeup.wait()
 
     def notify(self):
         """Notify about new files to hash"""
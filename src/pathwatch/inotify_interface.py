@@ -10,15 +10,49 @@
 import os.path
 import pyinotify
 import threading
+import time
 from warnings import warn
 
 from .errorwarn import (InotifyFSUnmount, InotifyQueueOverflow,
                         InotifyUnexpectedEvent, InotifyTranscientPath,
                         InotifyDisappearingWD, InotifyMissingingWD,
                         InotifyRootDeleted, InotifyRootMoved)
+from .pathtrie import PathTrie
+from .rootfd import RootFDs
 from .scheduler import Scheduler
 
 
+def _rm_watches(watch_manager, watch_descriptors, paths):
+    """Remove the watches of those folders (in the wd lock). pyinotify drops
+    the IN_IGNORED events of the watches it removed: forget them now"""
+    wds = {}
+    for path in paths:
+        wd = watch_descriptors.get(path)
+        if wd is not None:
+            wds[wd] = path
+            del watch_descriptors[path]
+    if len(wds) == 0:
+        return
+    for (wd, removed) in watch_manager.rm_watch(wds.keys(),
+                                                quiet=True).iteritems():
+        if not removed:
+            warn(InotifyDisappearingWD(wds[wd]))
+
+
+def _rebase_watches(watch_manager, watch_descriptors, src, dst):
+    """A watched folder moved: update the paths of the watches below it
+    (in the wd lock), in pyinotify too"""
+    moved = list(watch_descriptors.iter_subtree(src))
+    for (path, _) in moved:
+        del watch_descriptors[path]
+    for (path, wd) in moved:
+        path = dst + path[len(src):]
+        watch_descriptors[path] = wd
+        watch = watch_manager.get_watch(wd)
+        if watch is not None:
+            watch.path = path
+
+
 class _DefaultEventProcessing(pyinotify.ProcessEvent):
     """Base event processing, cover the weird cases"""
 
@@ -45,12 +79,14 @@ class _DefaultEventProcessing(pyinotify.ProcessEvent):
     def process_IN_UNMOUNT(self, event):  # pylint: disable=C0103
         """The whole fs was unmount, global failure !
         Non-standard method name set by libnotify"""
+        self._parent.release_root(event.wd)
         self._parent.die_on(warn(InotifyFSUnmount(event)))
 
     def process_IN_Q_OVERFLOW(self, event):  # pylint: disable=C0103
-        """The event queue overflowed, global failure !
+        """The event queue overflowed, some events were lost
         Non-standard method name set by libnotify"""
-        self._parent.die_on(warn(InotifyQueueOverflow(event)))
+        warn(InotifyQueueOverflow(event))
+        self._parent.overflow()
 
     def process_IN_IGNORED(self, event):  # pylint: disable=C0103
         """This watch will now be ignored by pynotify
@@ -78,15 +114,22 @@ class _EventProcessing(_DefaultEventProcessing):
             pyinotify.IN_DELETE)  # pylint: disable=E1101
 
     def my_init(self, remove_scheduler=None, delay=10, outqueue=None,
-                **kargs):
+                moving=None, batch_moving=None, move_lock=None, **kargs):
         """Called by pyinotify.ProcessEvent.__init__()
         pyinotify documentation explicitly warns against modifying __init__,
-        thus we need to define our variables here, thus we violate W0201."""
+        thus we need to define our variables here, thus we violate W0201.
+        The moving tables are shared by all the processors: batch_moving
+        holds the IN_MOVED_FROM of the current batch, moving the ones
+        waiting in the scheduler for a later batch"""
         super(_EventProcessing, self).my_init(**kargs)
         assert(remove_scheduler is not None)
         assert(outqueue is not None)
-        self._moving = {}  # pylint: disable=W0201
-        self._move_lock = threading.RLock()  # pylint: disable=W0201
+        assert(moving is not None)
+        assert(batch_moving is not None)
+        assert(move_lock is not None)
+        self._moving = moving  # pylint: disable=W0201
+        self._batch_moving = batch_moving  # pylint: disable=W0201
+        self._move_lock = move_lock  # pylint: disable=W0201
         self._scheduler = remove_scheduler  # pylint: disable=W0201
         self._delay = delay  # pylint: disable=W0201
         self._queue = outqueue  # pylint: disable=W0201
@@ -99,21 +142,29 @@ class _EventProcessing(_DefaultEventProcessing):
     def process_IN_MOVED_FROM(self, event):  # pylint: disable=C0103
         """A file/folder was moved in
         Non-standard method name set by libnotify"""
+        # Its pair is nearly always in the same batch, only schedule its
+        # removal if it is not (flush_moves)
         with self._move_lock:
-            self._moving[event.cookie] = event.pathname
-            self._scheduler.add(self._delay, event.cookie, self.delete,
-                                (event.cookie, event.dir))
+            self._batch_moving[event.cookie] = (event.pathname, event.dir)
 
     def process_IN_MOVED_TO(self, event):  # pylint: disable=C0103
         """A file/folder was moved out
         Non-standard method name set by libnotify"""
-        self._scheduler.cancel(event.cookie)
         with self._move_lock:
-            if event.cookie in self._moving:
+            src = self._batch_moving.pop(event.cookie, None)
+            if src is None:
+                self._scheduler.cancel(event.cookie)
+                src = self._moving.pop(event.cookie, None)
+            else:
+                src = src[0]
+            if src is not None:
                 # moved from watched place
-                assert(self._moving[event.cookie] == event.src_pathname)
-                del self._moving[event.cookie]
+                assert(src == event.src_pathname)
                 if event.dir:
+                    # pyinotify only follows the moves of the roots
+                    with self._wd_lock:
+                        _rebase_watches(self._wm, self._wd, src,
+                                        event.pathname)
                     self._queue.put(('move_dir', event.src_pathname,
                                      event.pathname))
                 else:
@@ -148,21 +199,26 @@ class _EventProcessing(_DefaultEventProcessing):
 
     def _add_rec(self, event):
         """Recursiverly add a folder to the watched ones"""
-        try:
-            with self._wd_lock:
-                self._wd.update(self._wm.add_watch(event.pathname,
-                                                   _EventProcessing.MASK,
-                                                   rec=True,
-                                                   auto_add=False,
-                                                   quiet=False))
-        except pyinotify.WatchManagerError as err:
-            # The path disappeared
-            warn(InotifyTranscientPath("{}:{}".format(event.pathname, err)))
+        if not self._parent.add_dir(event.pathname):
             return
 
         # The listener should use the scanner to find sub-files/folders
         self._queue.put(('new_dir', event.pathname))
 
+    def flush_moves(self):
+        """End of a batch: schedule the removal of the unpaired
+        IN_MOVED_FROM, their pair may come in a later batch"""
+        with self._move_lock:
+            if len(self._batch_moving) == 0:
+                return
+            for (cookie, (path, _)) in self._batch_moving.iteritems():
+                self._moving[cookie] = path
+            self._scheduler.add_many(
+                self._delay, [(cookie, self.delete, ((cookie, is_dir),))
+                              for (cookie, (_, is_dir))
+                              in self._batch_moving.iteritems()])
+            self._batch_moving.clear()
+
     def delete(self, data):
         """Callback from the scheduler"""
         (cookie, is_dir) = data
@@ -178,21 +234,9 @@ class _EventProcessing(_DefaultEventProcessing):
                 self._queue.put(('remove_file', path))
                 return
             with self._wd_lock:
-                remove_wd = []
-                for k in self._wd:
-                    if k.startswith(path):
-                        remove_wd.append(self._wd[k])
-                        # The removal from _wd will be done by IN_IGNORE calls
-                if len(remove_wd) != 0:
-                    try:
-                        self._wm.rm_watch(remove_wd, rec=False, quiet=False)
-                    except pyinotify.WatchManagerError as err:
-                        warn(InotifyDisappearingWD(err))
-                        for key in remove_wd:
-                            try:
-                                self._wm.rm_watch(key, rec=False, quiet=False)
-                            except pyinotify.WatchManagerError:
-                                pass
+                _rm_watches(self._wm, self._wd,
+                            [folder for (folder, _)
+                             in self._wd.iter_subtree(path)])
             self._queue.put(('remove_dir', path))
 
 
@@ -206,13 +250,35 @@ class _RootEventProcessing(_EventProcessing):
     def process_IN_DELETE_SELF(self, event):  # pylint: disable=C0103
         """The root folder was deleted, failure
         Non-standard method name set by libnotify"""
+        self._parent.release_root(event.wd)
         self._parent.die_on(InotifyRootDeleted(event))
 
     def process_IN_MOVE_SELF(self, event):  # pylint: disable=C0103
-        """The root folder was moved, failure
+        """The root folder was moved, follow it or fail
         Non-standard method name set by libnotify"""
-        # TODO: support move inside watched dirs
-        self._parent.die_on(InotifyRootMoved(event))
+        if not self._parent.root_moved(event.wd):
+            self._parent.die_on(InotifyRootMoved(event))
+
+
+class _Notifier(pyinotify.ThreadedNotifier):
+    """ThreadedNotifier remembering when it last emptied the inotify queue"""
+
+    def __init__(self, watch_manager, default_proc_fun):
+        pyinotify.ThreadedNotifier.__init__(self, watch_manager,
+                                            default_proc_fun=default_proc_fun)
+        self.last_read = time.time()
+        self.previous_read = self.last_read
+
+    def read_events(self):
+        """Read all the events available, remember when"""
+        self.previous_read = self.last_read
+        self.last_read = time.time()
+        pyinotify.ThreadedNotifier.read_events(self)
+
+    def process_events(self):
+        """Process all the events read, then the leftovers of the batch"""
+        pyinotify.ThreadedNotifier.process_events(self)
+        self._default_proc_fun.flush_moves()
 
 
 class InotifyWatch(object):
@@ -220,9 +286,13 @@ class InotifyWatch(object):
 
     def __init__(self, listener, delay=2):
         self._wm = pyinotify.WatchManager()
-        self._wd = {}
+        self._wd = PathTrie()
         self._wd_lock = threading.RLock()
+        # Root wd -> root path
+        self._root_wds = {}
+        self._root_fds = RootFDs()
         self._scheduler = Scheduler()
+        self._delay = delay
         self._queue = listener
         kargs = {'parent': self,
                  'watch_manager': self._wm,
@@ -230,12 +300,14 @@ class InotifyWatch(object):
                  'wd_lock': self._wd_lock,
                  'remove_scheduler': self._scheduler,
                  'delay': delay,
-                 'outqueue': self._queue}
+                 'outqueue': self._queue,
+                 'moving': {},
+                 'batch_moving': {},
+                 'move_lock': threading.RLock()}
         ev_proc = _EventProcessing(**kargs)
         self._rootevent_process = _RootEventProcessing(**kargs)
 
-        self._notifier = pyinotify.ThreadedNotifier(self._wm,
-                                                    default_proc_fun=ev_proc)
+        self._notifier = _Notifier(self._wm, default_proc_fun=ev_proc)
 
         self._started = False
 
@@ -243,6 +315,7 @@ class InotifyWatch(object):
         """Start the threads, must not be called twice on the same instance"""
         assert(not self._started)
         self._scheduler.start()
+        self._release_roots()
         self._notifier.start()
         self._started = True
 
@@ -251,19 +324,21 @@ class InotifyWatch(object):
         if self._started:
             self._scheduler.stop()
             self._notifier.stop()
+            self._root_fds.close()
         self._started = False
 
     def started(self):
         """"Check if we started"""
         return self._started
 
-    def add(self, root):
-        """Add a folder to the list of watched folders"""
+    def add(self, root, rec=True):
+        """Add a folder to the list of watched folders, and the folders below
+        it unless rec is False"""
         assert(os.path.isdir(root))
         with self._wd_lock:
             self._wd.update(self._wm.add_watch(root,
                                                _EventProcessing.MASK,
-                                               rec=True,
+                                               rec=rec,
                                                auto_add=False,
                                                quiet=False))
             try:
@@ -273,8 +348,76 @@ class InotifyWatch(object):
                                       quiet=False)
             except KeyError:
                 return False
+            self._root_wds[new_wd] = root
+            self._root_fds.add(root)
         return True
 
+    def add_dir(self, path, rec=True):
+        """Add a folder, and the folders below it unless rec is False, to the
+        watched ones"""
+        try:
+            with self._wd_lock:
+                self._wd.update(self._wm.add_watch(path,
+                                                   _EventProcessing.MASK,
+                                                   rec=rec,
+                                                   auto_add=False,
+                                                   quiet=False))
+        except pyinotify.WatchManagerError as err:
+            # The path disappeared
+            warn(InotifyTranscientPath("{}:{}".format(path, err)))
+            return False
+        return True
+
+    def watched(self, path):
+        """List the watched folders below path (included)"""
+        with self._wd_lock:
+            return [folder for (folder, _) in self._wd.iter_subtree(path)]
+
+    def unwatch(self, paths):
+        """Stop watching those folders (not the folders below them)"""
+        paths = set(paths)
+        with self._wd_lock:
+            for (wd, root) in self._root_wds.items():
+                if root in paths:
+                    del self._root_wds[wd]
+                    self._root_fds.remove(root)
+            _rm_watches(self._wm, self._wd, paths)
+
+    def root_moved(self, wd):
+        """A root was moved: follow it, return False if it cannot be
+        found"""
+        with self._wd_lock:
+            root = self._root_wds.get(wd)
+            if root is None:
+                return False
+            new_root = self._root_fds.moved(root)
+            if new_root is None:
+                return False
+            _rebase_watches(self._wm, self._wd, root, new_root)
+            self._root_wds[wd] = new_root
+        self._queue.put(('move_root', root, new_root))
+        return True
+
+    def release_root(self, wd):
+        """Close the fd of a deleted or unmounted root right away, nop for
+        other folders"""
+        with self._wd_lock:
+            root = self._root_wds.get(wd)
+            if root is not None:
+                self._root_fds.remove(root)
+
+    def _release_roots(self):
+        """Let the kernel notify the deletion of the roots, check again
+        later"""
+        with self._wd_lock:
+            self._root_fds.release_deleted()
+        self._scheduler.add(self._delay, 'release_roots', self._release_roots)
+
+    def overflow(self):
+        """Overflow callback: events were lost, but the queue was empty at
+        the previous read, send its time to the listener"""
+        self._queue.put(('overflow', self._notifier.previous_read))
+
     def die_on(self, warning):
         """Dying callback"""
         self._queue.put(('DIE', warning))
@@ -0,0 +1,399 @@
+# ----------------------------------------------------------------------------
+# "THE BEER-WARE LICENSE" (Revision 42):
+# <git@lerya.net> wrote this file. As long as you retain this notice you can
+# do whatever you want with this stuff. If we meet some day, and you think
+# this stuff is worth it, you can buy me a beer in return. Vincent Brillault
+# ----------------------------------------------------------------------------
+
+'''Interface with inotify through libc, without pyinotify'''
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import threading
+import time
+from fcntl import fcntl, F_SETFL
+from select import poll, POLLIN
+from warnings import warn
+
+from .errorwarn import (InotifyFSUnmount, InotifyQueueOverflow,
+                        InotifyTranscientPath, InotifyDisappearingWD,
+                        InotifyRootDeleted, InotifyRootMoved)
+from .pathtrie import PathTrie
+from .rootfd import RootFDs
+from .scheduler import Scheduler
+
+# From linux/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+        IN_DELETE | IN_ONLYDIR | IN_DONT_FOLLOW)
+ROOT_MASK = MASK | IN_DELETE_SELF | IN_MOVE_SELF
+
+# struct inotify_event header: wd, mask, cookie, len
+_HEADER = struct.Struct('iIII')
+# Read that many bytes at once, enough for thousands of events
+READ_SIZE = 1 << 20
+
+_LIBC = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+_LIBC.inotify_init1.argtypes = [ctypes.c_int]
+_LIBC.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                    ctypes.c_uint32]
+_LIBC.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+
+def _check(result):
+    """Raise an OSError if a libc call failed"""
+    if result == -1:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return result
+
+
+def decode_events(buf):
+    """Decode a buffer read from an inotify fd into a list of
+    (wd, mask, cookie, name) tuples"""
+    events = []
+    offset = 0
+    size = len(buf)
+    unpack = _HEADER.unpack_from
+    header_size = _HEADER.size
+    while offset < size:
+        (wd, mask, cookie, length) = unpack(buf, offset)
+        offset += header_size
+        # The name is padded with NUL bytes
+        name = buf[offset:offset + length].split('\0', 1)[0]
+        offset += length
+        events.append((wd, mask, cookie, name))
+    return events
+
+
+class NativeInotifyWatch(object):
+    """Interface to inotify, watch any folder. Same contract as
+    InotifyWatch, but reads the inotify fd directly, in large buffers, and
+    processes each read as one batch"""
+
+    def __init__(self, listener, delay=2):
+        self._queue = listener
+        self._delay = delay
+        self._fd = None
+        # wd -> path and path -> wd
+        self._paths = {}
+        self._wd = PathTrie()
+        self._root_wds = set()
+        self._root_fds = RootFDs()
+        self._wd_lock = threading.RLock()
+        # cookie -> (path, is_dir), for IN_MOVED_FROM waiting for their pair
+        self._moving = {}
+        self._move_lock = threading.RLock()
+        self._scheduler = Scheduler()
+        self._pipe = None
+        self._thread = None
+        self._end = threading.Event()
+        self.last_read = time.time()
+        self.previous_read = self.last_read
+        self._started = False
+
+    def _open(self):
+        """Create the inotify fd, if needed"""
+        if self._fd is None:
+            self._fd = _check(_LIBC.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+
+    def start(self):
+        """Start the threads, must not be called twice on the same instance"""
+        assert(not self._started)
+        self._open()
+        self._pipe = os.pipe()
+        fcntl(self._pipe[0], F_SETFL, os.O_NONBLOCK)
+        self._thread = threading.Thread(target=self._run)
+        self._scheduler.start()
+        self._release_roots()
+        self._thread.start()
+        self._started = True
+
+    def stop(self):
+        """"Stop the threads, nop if non started"""
+        if not self._started:
+            return
+        self._started = False
+        self._end.set()
+        os.write(self._pipe[1], '!')
+        self._scheduler.stop()
+        if threading.current_thread() is not self._thread:
+            # When dying from the reading thread, it will exit on its own
+            self._thread.join()
+
+    def started(self):
+        """"Check if we started"""
+        return self._started
+
+    def _watch(self, path, mask):
+        """Add a single watch, return its wd"""
+        wd = _check(_LIBC.inotify_add_watch(self._fd, path, mask))
+        with self._wd_lock:
+            old_path = self._paths.get(wd)
+            if old_path is not None and self._wd.get(old_path) == wd:
+                del self._wd[old_path]
+            self._paths[wd] = path
+            self._wd[path] = wd
+        return wd
+
+    def _watch_rec(self, path, mask, rec=True):
+        """Watch a folder with the given mask, and all the folders below it
+        with the default one unless rec is False. Raise an OSError if path
+        cannot be watched"""
+        self._watch(path, mask)
+        if not rec:
+            return
+        for (root, dirs, _) in os.walk(path):
+            for name in dirs:
+                try:
+                    self._watch(os.path.join(root, name), MASK)
+                except OSError:
+                    # Disappeared, its deletion will be notified
+                    pass
+
+    def add(self, root, rec=True):
+        """Add a folder to the list of watched folders, and the folders below
+        it unless rec is False"""
+        assert(os.path.isdir(root))
+        self._open()
+        try:
+            self._watch_rec(root, ROOT_MASK, rec)
+        except OSError:
+            return False
+        with self._wd_lock:
+            self._root_wds.add(self._wd[root])
+            self._root_fds.add(root)
+        return True
+
+    def add_dir(self, path, rec=True):
+        """Add a folder, and the folders below it unless rec is False, to the
+        watched ones"""
+        try:
+            self._watch_rec(path, MASK, rec)
+        except OSError as err:
+            # The path disappeared
+            warn(InotifyTranscientPath("{}:{}".format(path, err)))
+            return False
+        return True
+
+    def watched(self, path):
+        """List the watched folders below path (included)"""
+        with self._wd_lock:
+            return [folder for (folder, _) in self._wd.iter_subtree(path)]
+
+    def unwatch(self, paths):
+        """Stop watching those folders (not the folders below them), the
+        maps are cleaned when IN_IGNORED is received"""
+        with self._wd_lock:
+            for path in paths:
+                self._root_fds.remove(path)
+                wd = self._wd.get(path)
+                if wd is not None and \
+                        _LIBC.inotify_rm_watch(self._fd, wd) == -1:
+                    warn(InotifyDisappearingWD("{}:{}".format(
+                        path, os.strerror(ctypes.get_errno()))))
+
+    def _rm_subtree(self, path):
+        """Remove the watches of a folder and of the folders below it, the
+        maps are cleaned when IN_IGNORED is received"""
+        self.unwatch(self.watched(path))
+
+    def _rebase(self, old_path, new_path):
+        """A watched folder moved: update the paths of the watches below"""
+        with self._wd_lock:
+            moved = list(self._wd.iter_subtree(old_path))
+            for (path, _) in moved:
+                del self._wd[path]
+            for (path, wd) in moved:
+                path = new_path + path[len(old_path):]
+                self._wd[path] = wd
+                self._paths[wd] = path
+
+    def _root_moved(self, root):
+        """A root was moved: follow it, return False if it cannot be
+        found"""
+        with self._wd_lock:
+            new_root = self._root_fds.moved(root)
+            if new_root is None:
+                return False
+            self._rebase(root, new_root)
+        self._queue.put(('move_root', root, new_root))
+        return True
+
+    def _ignored(self, wd):
+        """The watch was removed"""
+        with self._wd_lock:
+            self._root_wds.discard(wd)
+            path = self._paths.pop(wd, None)
+            if path is not None and self._wd.get(path) == wd:
+                del self._wd[path]
+
+    def _moved_out(self, cookie):
+        """Callback from the scheduler: an IN_MOVED_FROM never got its pair"""
+        with self._move_lock:
+            try:
+                (path, is_dir) = self._moving.pop(cookie)
+            except KeyError:
+                # Already paired
+                return
+        if is_dir:
+            self._rm_subtree(path)
+            self._queue.put(('remove_dir', path))
+        else:
+            self._queue.put(('remove_file', path))
+
+    def _moved_in(self, cookie, path, is_dir, batch_moving):
+        """Process an IN_MOVED_TO, its pair is nearly always in the same
+        batch"""
+        src = batch_moving.pop(cookie, None)
+        if src is None:
+            self._scheduler.cancel(cookie)
+            with self._move_lock:
+                src = self._moving.pop(cookie, None)
+        if src is not None:
+            if is_dir:
+                self._rebase(src[0], path)
+                self._queue.put(('move_dir', src[0], path))
+            else:
+                self._queue.put(('move_file', src[0], path))
+        elif is_dir:
+            # Moved from an external place: new
+            if self.add_dir(path):
+                self._queue.put(('new_dir', path))
+        else:
+            self._queue.put(('modified', path))
+
+    def _process(self, events):
+        """Process a batch of decoded events"""
+        # IN_MOVED_FROM of this batch, cookie -> (path, is_dir)
+        batch_moving = {}
+        for (wd, mask, cookie, name) in events:
+            if mask & IN_Q_OVERFLOW:
+                warn(InotifyQueueOverflow(mask))
+                self.overflow()
+                continue
+            if mask & IN_IGNORED:
+                self._ignored(wd)
+                continue
+            with self._wd_lock:
+                parent = self._paths.get(wd)
+                is_root = wd in self._root_wds
+            if parent is None:
+                # Already removed watch
+                continue
+            if mask & IN_UNMOUNT:
+                self._release_root(parent)
+                self.die_on(InotifyFSUnmount(parent))
+                return
+            if mask & IN_DELETE_SELF:
+                if is_root:
+                    self._release_root(parent)
+                    self.die_on(InotifyRootDeleted(parent))
+                    return
+                continue
+            if mask & IN_MOVE_SELF:
+                if is_root and not self._root_moved(parent):
+                    self.die_on(InotifyRootMoved(parent))
+                    return
+                continue
+            path = os.path.join(parent, name)
+            is_dir = mask & IN_ISDIR != 0
+            if mask & IN_CLOSE_WRITE:
+                self._queue.put(('modified', path))
+            elif mask & IN_CREATE:
+                # Files are notified by IN_CLOSE_WRITE
+                if is_dir and self.add_dir(path):
+                    self._queue.put(('new_dir', path))
+            elif mask & IN_DELETE:
+                # The watch is removed later by IN_IGNORED
+                if is_dir:
+                    self._queue.put(('remove_dir', path))
+                else:
+                    self._queue.put(('remove_file', path))
+            elif mask & IN_MOVED_FROM:
+                batch_moving[cookie] = (path, is_dir)
+            elif mask & IN_MOVED_TO:
+                self._moved_in(cookie, path, is_dir, batch_moving)
+        # Only the unpaired leftovers wait for a later batch
+        if len(batch_moving) != 0:
+            with self._move_lock:
+                self._moving.update(batch_moving)
+            self._scheduler.add_many(self._delay,
+                                     [(cookie, self._moved_out, (cookie,))
+                                      for cookie in batch_moving])
+
+    def _read(self):
+        """Read and decode all the available events"""
+        self.previous_read = self.last_read
+        self.last_read = time.time()
+        chunks = []
+        while True:
+            try:
+                chunk = os.read(self._fd, READ_SIZE)
+            except OSError as err:
+                if err.errno == errno.EINTR:
+                    continue
+                if err.errno != errno.EAGAIN:
+                    raise
+                break
+            if len(chunk) == 0:
+                break
+            chunks.append(chunk)
+        return decode_events(''.join(chunks))
+
+    def _run(self):
+        """Wait for events, process them by batch until stopped"""
+        pollobj = poll()
+        pollobj.register(self._fd, POLLIN)
+        pollobj.register(self._pipe[0], POLLIN)
+        while not self._end.is_set():
+            pollobj.poll()
+            if self._end.is_set():
+                break
+            self._process(self._read())
+        os.close(self._pipe[0])
+        os.close(self._pipe[1])
+        os.close(self._fd)
+        self._fd = None
+        self._root_fds.close()
+
+    def _release_root(self, root):
+        """Close the fd of a deleted or unmounted root right away, nop for
+        other folders"""
+        with self._wd_lock:
+            self._root_fds.remove(root)
+
+    def _release_roots(self):
+        """Let the kernel notify the deletion of the roots, check again
+        later"""
+        with self._wd_lock:
+            self._root_fds.release_deleted()
+        self._scheduler.add(self._delay, 'release_roots', self._release_roots)
+
+    def overflow(self):
+        """Overflow callback: events were lost, but the queue was empty at
+        the previous read, send its time to the listener"""
+        self._queue.put(('overflow', self.previous_read))
+
+    def die_on(self, warning):
+        """Dying callback"""
+        self._queue.put(('DIE', warning))
+        self.stop()
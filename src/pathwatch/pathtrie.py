@@ -0,0 +1,151 @@
+# ----------------------------------------------------------------------------
+# "THE BEER-WARE LICENSE" (Revision 42):
+# <git@lerya.net> wrote this file. As long as you retain this notice you can
+# do whatever you want with this stuff. If we meet some day, and you think
+# this stuff is worth it, you can buy me a beer in return. Vincent Brillault
+# ----------------------------------------------------------------------------
+
+"""Mapping of absolute paths with fast subtree and ancestor lookups"""
+
+_MISSING = object()
+
+
+def _split(path):
+    """Split an absolute path into its components"""
+    return [part for part in path.split('/') if part != '']
+
+
+def _join(parts):
+    """Build an absolute path from its components"""
+    return '/' + '/'.join(parts)
+
+
+class PathTrie(object):
+    """Mapping from absolute paths to values, stored as a tree of their
+    components: finding the entries below a path, or the deepest entry above
+    it, costs O(depth + results) instead of a scan of all the keys"""
+
+    def __init__(self, items=None):
+        # Each node is [value or _MISSING, {component: child node}]
+        self._root = [_MISSING, {}]
+        self._len = 0
+        if items is not None:
+            self.update(items)
+
+    def _node(self, path):
+        """Return the node of path, None if there are none"""
+        node = self._root
+        for part in _split(path):
+            try:
+                node = node[1][part]
+            except KeyError:
+                return None
+        return node
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, path):
+        node = self._node(path)
+        return node is not None and node[0] is not _MISSING
+
+    def __getitem__(self, path):
+        node = self._node(path)
+        if node is None or node[0] is _MISSING:
+            raise KeyError(path)
+        return node[0]
+
+    def get(self, path, default=None):
+        """Return the value of path, default if absent"""
+        node = self._node(path)
+        if node is None or node[0] is _MISSING:
+            return default
+        return node[0]
+
+    def __setitem__(self, path, value):
+        node = self._root
+        for part in _split(path):
+            try:
+                node = node[1][part]
+            except KeyError:
+                child = [_MISSING, {}]
+                node[1][part] = child
+                node = child
+        if node[0] is _MISSING:
+            self._len += 1
+        node[0] = value
+
+    def __delitem__(self, path):
+        parts = _split(path)
+        nodes = [self._root]
+        for part in parts:
+            try:
+                nodes.append(nodes[-1][1][part])
+            except KeyError:
+                raise KeyError(path)
+        if nodes[-1][0] is _MISSING:
+            raise KeyError(path)
+        nodes[-1][0] = _MISSING
+        self._len -= 1
+        # Prune the nodes left without value nor children
+        for index in xrange(len(parts), 0, -1):
+            node = nodes[index]
+            if node[0] is not _MISSING or len(node[1]) != 0:
+                break
+            del nodes[index - 1][1][parts[index - 1]]
+
+    def update(self, items):
+        """Add the entries of a dict, or of an iterable of (path, value)"""
+        if hasattr(items, 'iteritems'):
+            items = items.iteritems()
+        for (path, value) in items:
+            self[path] = value
+
+    @staticmethod
+    def _iter_node(parts, node):
+        """Iterate over the (path, value) of a node and its children"""
+        stack = [(parts, node)]
+        while len(stack) != 0:
+            (parts, node) = stack.pop()
+            if node[0] is not _MISSING:
+                yield (_join(parts), node[0])
+            for (part, child) in node[1].iteritems():
+                stack.append((parts + [part], child))
+
+    def iteritems(self):
+        """Iterate over all the (path, value)"""
+        return self._iter_node([], self._root)
+
+    def __iter__(self):
+        for (path, _) in self.iteritems():
+            yield path
+
+    def iter_subtree(self, path):
+        """Iterate over the (path, value) of path and of the paths below it"""
+        node = self._node(path)
+        if node is None:
+            return iter([])
+        return self._iter_node(_split(path), node)
+
+    def longest_prefix(self, path):
+        """Return the (path, value) of the deepest entry that is path or one
+        of its parents, None if there are none"""
+        node = self._root
+        found = None
+        if node[0] is not _MISSING:
+            found = ([], node[0])
+        parts = _split(path)
+        for (index, part) in enumerate(parts):
+            try:
+                node = node[1][part]
+            except KeyError:
+                break
+            if node[0] is not _MISSING:
+                found = (parts[:index + 1], node[0])
+        if found is None:
+            return None
+        return (_join(found[0]), found[1])
+
+    def contains_prefix(self, path):
+        """Check if path, or one of its parents, is in the trie"""
+        return self.longest_prefix(path) is not None
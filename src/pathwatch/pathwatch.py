@@ -1,54 +1,214 @@
 '''Central class, include every other class'''
 
+import os
 import threading
-import Queue
+import time
 
-from .database import DBRootHelper, DBFilesHelper
+from warnings import warn
+
+from .budget import WatchBudget
+from .coalescer import coalesce_updates
+from .database import DBFilesHelper, DBRootHelper
+from .errorwarn import InotifyTranscientPath, InvalidRoot
 from .hasher import Hasher
 from .inotify_interface import InotifyWatch
+from .native_inotify import NativeInotifyWatch
+from .pathtrie import PathTrie
+from .poller import MtimePoller, PollingWatch
 from .scanner import Scanner
+from .storm import StormDetector
+from .subscriptions import Dispatcher
+from .updatequeue import PATH_UPDATES, UpdateQueue
+from .writer import DBWriter
+
+
+# The change feed is pruned at most that often, in seconds
+PRUNE_INTERVAL = 3600
+
 
+# Available interfaces, polling is for filesystems without inotify
+BACKENDS = {'pyinotify': InotifyWatch,
+            'native': NativeInotifyWatch,
+            'polling': PollingWatch}
 
-def _is_in(path, roots):
-    """Check if a path is in a collection of roots"""
-    for root in roots:
-        if path.startswith(root):
-            return True
-    return False
+
+def _subdirs(path):
+    """List the subfolders of a folder, none if it disappeared"""
+    for (_, dirs, _) in os.walk(path):
+        return [os.path.join(path, name) for name in dirs]
+    return []
 
 
 class PathWatch(threading.Thread):
-    """Watch all the given roots store tree with hashes in database"""
+    """Watch all the given roots store tree with hashes in database.
+    Either start() its thread, or drive it from an event loop: open(), then
+    call process() when fileno() is readable or after timeout() seconds.
+    A file descriptor stays open on each root to follow its moves: a root
+    which is a mount point cannot be unmounted while watched (remove_root
+    first), and a deleted or lazily unmounted root is noticed within
+    inotify_delay seconds"""
 
-    def __init__(self, database, inotify_delay=2, files_per_call=10):
+    def __init__(self, database, inotify_delay=2, files_per_call=10,
+                 coalesce_delay=0.1, batch_size=1000, storm_threshold=1000,
+                 storm_calm=2.0, crawl_chunk=100, backend='pyinotify',
+                 max_watches=None, poll_interval=60, max_stats=1000,
+                 queue_high_water=100000, change_retention=7 * 24 * 3600,
+                 delete_chunk=10000, file_poll_interval=600):
         super(PathWatch, self).__init__()
         self._database = database
-        self._filedb = None
-        self._inc_queue = Queue.Queue()
-        self._inotify = InotifyWatch(self._inc_queue, inotify_delay)
+        self._coalesce_delay = coalesce_delay
+        self._batch_size = batch_size
+        self._storms = StormDetector(storm_threshold, calm=storm_calm)
+        self._roots = PathTrie()
+        # Background rescans, root -> (since, generator from iter_scan). Full
+        # crawls (since is None) list all the folders, to watch them
+        self._crawls = {}
+        # Roots being crawled -> number of folders scanned so far
+        self._crawled = {}
+        self._crawl_chunk = crawl_chunk
+        # Rows of a removed root deleted per writer batch
+        self._delete_chunk = delete_chunk
+        # Changes older than that are pruned from the feed, None: kept
+        self._change_retention = change_retention
+        self._last_prune = 0
+        self._dispatcher = Dispatcher(database)
+        self._writer = DBWriter(database,
+                                on_commit=self._dispatcher.notify)
+        self._inc_queue = UpdateQueue(queue_high_water)
+        options = {}
+        if backend == 'polling':
+            options = {'max_interval': poll_interval, 'max_stats': max_stats,
+                       'file_interval': file_poll_interval}
+        self._inotify = BACKENDS[backend](self._inc_queue, inotify_delay,
+                                          **options)
+        # Without budget, every folder is watched with inotify
+        self._budget = None
+        self._poller = None
+        if max_watches is not None:
+            self._budget = WatchBudget(max_watches)
+            self._poller = MtimePoller(self._inc_queue, poll_interval,
+                                       file_poll_interval)
         self._scanner = None
-        self._hasher = Hasher(database, files_per_call)
+        self._hasher = Hasher(database, files_per_call, self._writer)
         self._end = threading.Event()
         self._lock = threading.Lock()
+        # Driven by an event loop instead of the thread
+        self._embedded = False
+        self._processing = False
+
+    def _track(self, update):
+        """Keep the watch budget and the polled folders up to date"""
+        cmd = update[0]
+        now = time.time()
+        if cmd in ('modified', 'remove_file'):
+            self._budget.touch(os.path.dirname(update[1]), now)
+        elif cmd == 'move_file':
+            self._budget.touch(os.path.dirname(update[1]), now)
+            self._budget.touch(os.path.dirname(update[2]), now)
+        elif cmd == 'move_dir':
+            self._budget.move(update[1], update[2], now)
+            self._poller.move(update[1], update[2])
+            self._budget.touch(os.path.dirname(update[1]), now)
+            self._budget.touch(os.path.dirname(update[2]), now)
+        elif cmd == 'remove_dir':
+            self._budget.remove(update[1])
+            self._poller.remove(update[1])
+            self._budget.touch(os.path.dirname(update[1]), now)
+        elif cmd == 'cold_dir':
+            # Watch it again, it is scanned as a new folder. Its subfolders
+            # stay polled, the new ones are watched within the budget
+            self._poller.discard(update[1])
+            if self._inotify.add_dir(update[1], rec=False):
+                self._budget.watch([update[1]], now)
+            self._watch_dirs(path for path in _subdirs(update[1])
+                             if path not in self._budget and
+                             path not in self._poller)
+
+    def _evict(self):
+        """Poll the least recently changed folders exceeding the budget"""
+        evicted = self._budget.evict()
+        if len(evicted) != 0:
+            self._inotify.unwatch(evicted)
+            self._poller.add(evicted)
+
+    def _watch_dirs(self, paths):
+        """Watch folders with inotify while the budget allows it, poll the
+        others"""
+        now = time.time()
+        cold = []
+        for path in paths:
+            if (len(self._budget) < self._budget.max_watches and
+                    self._inotify.add_dir(path, rec=False)):
+                self._budget.watch([path], now)
+            else:
+                cold.append(path)
+        self._poller.add(cold)
+
+    def _watch_root(self, root):
+        """Watch a root with inotify, the folders exceeding the budget are
+        polled"""
+        if self._budget is None:
+            self._inotify.add(root)
+            return
+        self._budget.add_root(root)
+        self._inotify.add(root, rec=False)
+        self._budget.watch([root], time.time())
+        self._watch_dirs(os.path.join(folder, name)
+                         for (folder, dirs, _) in os.walk(root)
+                         for name in dirs)
+
+    def _restrict(self, update):
+        """Restrict a path update to the roots, return the updates to apply:
+        updates can still come for a root that was just removed"""
+        inside = [self._roots.contains_prefix(path) for path in update[1:]]
+        if all(inside):
+            return [update]
+        if update[0] == 'move_dir':
+            if inside[0]:
+                return [('remove_dir', update[1])]
+            elif inside[1]:
+                return [('new_dir', update[2])]
+        elif update[0] == 'move_file':
+            if inside[0]:
+                return [('remove_file', update[1])]
+            elif inside[1]:
+                return [('modified', update[2])]
+        return []
 
     def _apply_update(self, update, notify=True, concurrent=None):
         """Apply an inotify update"""
         cmd = update[0]
+        if cmd in PATH_UPDATES:
+            restricted = self._restrict(update)
+            if restricted != [update]:
+                for new_update in restricted:
+                    self._apply_update(new_update, notify, concurrent)
+                return
+        if self._budget is not None:
+            self._track(update)
         if cmd == 'DIE':
             self.die(update[1])
+        elif cmd == 'overflow':
+            self._reconcile(update[1])
+        elif cmd == 'new_root':
+            self._start_crawl(update[1])
+        elif cmd == 'remove_root':
+            self._teardown(update[1])
+        elif cmd == 'move_root':
+            self._move_root(update[1], update[2])
         elif cmd == 'modified':
             self._scanner.scan_file(update[1])
             if notify:
                 self._hasher.notify()
         elif cmd == 'move_dir':
-            self._filedb.move_dir(update[1], update[2])
+            self._writer.move_dir(update[1], update[2])
         elif cmd == 'move_file':
-            self._filedb.move_file(update[1], update[2])
+            self._writer.move_file(update[1], update[2])
         elif cmd == 'remove_dir':
-            self._filedb.delete_path(update[1])
+            self._writer.delete_path(update[1])
         elif cmd == 'remove_file':
-            self._filedb.delete_single(update[1])
-        elif cmd == 'new_dir':
+            self._writer.delete_single(update[1])
+        elif cmd in ('new_dir', 'cold_dir'):
             if concurrent is None:
                 self._check_path(update[1], notify)
             else:
@@ -63,43 +223,258 @@ class PathWatch(threading.Thread):
     def _check_paths(self, paths, notify=True):
         """Re-scan those paths and recursively scan concurrent modifications"""
         for path in paths:
+            if self._budget is not None:
+                self._budget.watch(self._inotify.watched(path), time.time())
             self._scanner.scan(path)
+        scanned = PathTrie((path, True) for path in paths)
         concurrent_updates = set()
-        while not self._inc_queue.empty():
-            message = self._inc_queue.get()
-            if (_is_in(message[1], paths) or
-                    (len(message) > 2 and _is_in(message[2], paths))):
-                for path in message[1:]:
-                    concurrent_updates.add(path)
-            else:
-                self._apply_update(message, notify, concurrent_updates)
+        while True:
+            messages = self._inc_queue.get_many(self._batch_size, 0)
+            if len(messages) == 0:
+                break
+            for update in self._storms.filter(messages, time.time()):
+                if update[0] in PATH_UPDATES and (
+                        scanned.contains_prefix(update[1]) or
+                        (len(update) > 2 and
+                         scanned.contains_prefix(update[2]))):
+                    for path in update[1:]:
+                        concurrent_updates.add(path)
+                else:
+                    self._apply_update(update, notify, concurrent_updates)
         if len(concurrent_updates) != 0:
             self._check_paths(concurrent_updates, notify)
         elif notify:
             self._hasher.notify()
 
-    def run(self):
-        """Called by start, should not be runned direclty"""
-        self._filedb = DBFilesHelper(self._database)
-        self._scanner = Scanner(self._database)
+    def _reconcile(self, since):
+        """Updates were lost after <since>: rescan all the roots in the
+        background, only comparing what was modified after it"""
+        # mtimes are truncated to the second
+        since = int(since) - 1
+        for root in self._roots:
+            root_since = since
+            if root in self._crawls:
+                # Restart the current rescan, from the oldest loss (None:
+                # full crawl of a new root)
+                old_since = self._crawls[root][0]
+                if old_since is None:
+                    root_since = None
+                else:
+                    root_since = min(since, old_since)
+            self._crawls[root] = (root_since,
+                                  self._iter_crawl(root, root_since))
+            self._crawled[root] = 0
+
+    def _start_crawl(self, root):
+        """Watch a new root and crawl it in the background: its folders are
+        watched as the crawl discovers them"""
+        if root in self._roots:
+            return
+        # Checked by add_root, but it might have disappeared since: nothing
+        # is stored for it then
+        if not os.path.isdir(root) or not self._inotify.add(root, rec=False):
+            warn(InotifyTranscientPath(root))
+            return
+        # The crawl compares with what a previous removal left, and must not
+        # be deleted by it
+        self._writer.cancel_tree(root)
+        self._writer.add_root(root)
+        self._storms.add_root(root)
+        self._roots[root] = True
+        if self._budget is not None:
+            self._budget.add_root(root)
+            self._budget.watch([root], time.time())
+        self._crawls[root] = (None, self._iter_crawl(root))
+        self._crawled[root] = 0
+
+    def _teardown(self, root):
+        """Stop watching a root, delete its content in the background. The
+        root is removed from the database with the last rows, a stop in the
+        meantime resumes the deletion on open"""
+        if root not in self._roots:
+            return
+        del self._roots[root]
+        self._storms.remove_root(root)
+        self._crawls.pop(root, None)
+        self._crawled.pop(root, None)
+        self._inotify.unwatch(self._inotify.watched(root))
+        if self._budget is not None:
+            self._budget.remove_root(root)
+            self._poller.remove(root)
+        self._writer.retire_root(root)
+        self._writer.delete_tree(root, self._delete_chunk, root=True)
+
+    def _move_root(self, src, dst):
+        """A root was moved: rename it and its content, hashes are kept"""
+        if src not in self._roots:
+            return
+        self._writer.move_root(src, dst)
+        del self._roots[src]
+        self._roots[dst] = True
+        self._storms.remove_root(src)
+        self._storms.add_root(dst)
+        if self._budget is not None:
+            self._budget.move_root(src, dst, time.time())
+            self._poller.move(src, dst)
+        if src in self._crawls:
+            # Restart it under the new path
+            since = self._crawls.pop(src)[0]
+            del self._crawled[src]
+            self._crawls[dst] = (since, self._iter_crawl(dst, since))
+            self._crawled[dst] = 0
+
+    def _iter_crawl(self, root, since=None):
+        """Background rescan of a root: a full crawl (since is None) yields
+        every folder, its watches might be missing (a root added back while
+        its rows were kept), otherwise only the new ones"""
+        return self._scanner.iter_scan(root, since, all_dirs=since is None)
+
+    def _advance_crawls(self):
+        """Scan up to crawl_chunk folders from the background rescans"""
+        budget = self._crawl_chunk
+        for root in list(self._crawls):
+            crawl = self._crawls[root][1]
+            while budget > 0:
+                try:
+                    new_dirs = next(crawl)
+                except StopIteration:
+                    del self._crawls[root]
+                    del self._crawled[root]
+                    break
+                budget -= 1
+                self._crawled[root] += 1
+                # Their creation was missed too, the crawl goes through their
+                # subfolders later
+                if self._budget is None:
+                    for new_dir in new_dirs:
+                        self._inotify.add_dir(new_dir, rec=False)
+                else:
+                    self._watch_dirs(new_dir for new_dir in new_dirs
+                                     if new_dir not in self._budget and
+                                     new_dir not in self._poller)
+            if budget == 0:
+                break
+
+    def _timeout(self):
+        """Time before a storm might calm down, 0 if background rescans are
+        waiting, None if there is nothing to do without updates"""
+        if len(self._crawls) != 0:
+            return 0
+        return self._storms.timeout(time.time())
+
+    def _get_updates(self):
+        """Wait for an update, gather the ones following it closely.
+        Return nothing if a storm might have calmed down in the meantime, or
+        if background rescans are waiting"""
+        return self._inc_queue.get_many(self._batch_size, self._timeout(),
+                                        self._coalesce_delay)
+
+    def _open(self):
+        """Start the helpers, watch and scan the roots"""
+        self._scanner = Scanner(self._database, self._writer)
         with self._lock:
+            self._dispatcher.start()
+            self._writer.start()
             self._inotify.start()
             db_root = DBRootHelper(self._database)
             root_list = db_root.list_roots()
+            retired = db_root.list_retired_roots()
             db_root.close()
+            for root in retired:
+                self._writer.delete_tree(root, self._delete_chunk, root=True)
+            if self._poller is not None:
+                self._poller.start()
             for root in root_list:
-                self._inotify.add(root)
+                self._watch_root(root)
+                self._storms.add_root(root)
+                self._roots[root] = True
             self._check_paths(root_list, notify=False)
             self._hasher.start()
-        while not self._end.is_set():
-            update = self._inc_queue.get()
-            if self._end.is_set():
-                break
-            with self._lock:
-                self._apply_update(update)
+
+    def _process(self, updates):
+        """Apply a batch of updates, then the pending background work"""
+        with self._lock:
+            for update in self._storms.filter(coalesce_updates(updates),
+                                              time.time()):
+                self._apply_update(update, notify=False)
+            # Storms are handled with a single rescan once calmed down
+            calmed = self._storms.calmed(time.time())
+            if len(calmed) != 0:
+                self._check_paths(calmed, notify=False)
+            if len(self._crawls) != 0:
+                self._advance_crawls()
+            if self._budget is not None:
+                self._evict()
+            if self._change_retention is not None:
+                self._prune_changes()
+            self._hasher.notify()
+
+    def _prune_changes(self):
+        """Prune the change feed, at most every PRUNE_INTERVAL seconds"""
+        now = time.time()
+        if now - self._last_prune < PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        self._writer.prune_changes(int(now - self._change_retention))
+
+    def _close(self):
+        """Stop the watches and the helpers"""
         self._inotify.stop()
+        if self._poller is not None:
+            self._poller.stop()
         self._hasher.stop()
         self._scanner.close()
+        self._writer.stop()
+        self._dispatcher.stop()
+        self._inc_queue.close()
+
+    def run(self):
+        """Called by start, should not be runned direclty"""
+        self._open()
+        while not self._end.is_set():
+            updates = self._get_updates()
+            if self._end.is_set():
+                break
+            self._process(updates)
+        self._close()
+
+    def open(self):
+        """Start watching without the thread, process() must then be called
+        by the event loop"""
+        assert(not self.is_alive() and not self._embedded)
+        self._embedded = True
+        self._open()
+
+    def fileno(self):
+        """File descriptor readable when updates are waiting for
+        process()"""
+        return self._inc_queue.fileno()
+
+    def timeout(self):
+        """Time before process() must be called even if fileno() is not
+        readable, None if it only depends on fileno()"""
+        with self._lock:
+            return self._timeout()
+
+    def process(self):
+        """Apply the waiting updates and background work, without
+        blocking"""
+        if self._end.is_set():
+            return
+        self._processing = True
+        try:
+            self._process(self._inc_queue.get_many(self._batch_size, 0))
+        finally:
+            self._processing = False
+        if self._end.is_set():
+            # Died meanwhile
+            self._close()
+
+    def _running(self):
+        """Check if the updates are processed, by the thread or by an event
+        loop"""
+        return self.is_alive() or (self._embedded and
+                                   not self._end.is_set())
 
     def die(self, reason):
         """Die for some given reason"""
@@ -109,18 +484,75 @@ class PathWatch(threading.Thread):
 
     def stop(self):
         """Stop everything"""
+        if self._embedded:
+            if not self._end.is_set():
+                self._end.set()
+                if not self._processing:
+                    self._close()
+            return
         self._end.set()
-        self._inc_queue.put(('Shutdown'))
-        self.join()
+        self._inc_queue.put(('shutdown',))
+        if threading.current_thread() is not self:
+            self.join()
+
+    def db_stats(self):
+        """Queue depth and commit latency of the database writer"""
+        return self._writer.stats()
+
+    def subscribe(self, target, prefix=None, events=None):
+        """Deliver the committed changes below <prefix> (all if None) whose
+        type is in <events> (all if None) to target, by batches, from a
+        dedicated thread. target is a callable or a queue. Events are
+        ('scanned'|'modified', path, mtime), ('moved', src, dst),
+        ('removed', path) and ('hashed', path, identity). Moving or removing
+        an ancestor of prefix is delivered as moving or removing prefix.
+        Return a token for unsubscribe"""
+        return self._dispatcher.subscribe(target, prefix, events)
+
+    def unsubscribe(self, token):
+        """Stop delivering changes to a subscriber"""
+        self._dispatcher.unsubscribe(token)
+
+    def cold_folders(self):
+        """Folders polled instead of watched, above max_watches: their
+        changes are seen within poll_interval seconds, their files rewritten
+        in place within file_poll_interval seconds"""
+        if self._poller is None:
+            return []
+        return self._poller.folders()
+
+    def crawl_progress(self):
+        """Roots being crawled in the background (new roots or rescans) and
+        the number of folders scanned so far"""
+        with self._lock:
+            return dict(self._crawled)
 
     def add_root(self, path):
-        """Add a root to the database"""
+        """Add a root to the database. Once started, the root is added and
+        crawled in the background without blocking the other roots (see
+        crawl_progress). Raise InvalidRoot if path is not a folder"""
+        if not os.path.isdir(path):
+            raise InvalidRoot(path)
+        if self._running():
+            self._inc_queue.put(('new_root', path))
+            return
         db_root = DBRootHelper(self._database)
+        db_root.add_root(path)
+        db_root.close()
         scanner = Scanner(self._database)
-        with self._lock:
-            db_root.add_root(path)
-            if self._inotify.started():
-                self._inotify.add(path)
-            scanner.scan(path)
+        scanner.scan(path)
         scanner.close()
-        db_root.close()
+
+    def remove_root(self, path):
+        """Remove a root from the database. Once started, its watches are
+        removed and its content is deleted in the background"""
+        if self._running():
+            self._inc_queue.put(('remove_root', path))
+            return
+        db_files = DBFilesHelper(self._database)
+        db_root = DBRootHelper(None, db_files)
+        db_files.begin()
+        db_root.remove_root(path)
+        db_files.delete_path(path)
+        db_files.commit()
+        db_files.close()
@@ -0,0 +1,603 @@
+# ----------------------------------------------------------------------------
+# "THE BEER-WARE LICENSE" (Revision 42):
+# <git@lerya.net> wrote this file. As long as you retain this notice you can
+# do whatever you want with this stuff. If we meet some day, and you think
+# this stuff is worth it, you can buy me a beer in return. Vincent Brillault
+# ----------------------------------------------------------------------------
+
+"""Poll folders for changes instead of watching them with inotify"""
+
+import os
+import stat
+import threading
+import time
+from collections import deque
+from heapq import heapify, heappop, heappush
+from itertools import count
+from warnings import warn
+
+from .errorwarn import PollingRootDeleted, InotifyTranscientPath
+from .pathtrie import PathTrie
+from .rootfd import RootFDs
+
+
+def _mtime(path):
+    """Return the mtime of a folder, None if it disappeared"""
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _files_changed(path, since):
+    """Check if a file of a folder was modified after <since>"""
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return False
+    for name in names:
+        try:
+            info = os.lstat(os.path.join(path, name))
+        except OSError:
+            continue
+        # mtimes might be truncated to the second
+        if not stat.S_ISDIR(info.st_mode) and info.st_mtime >= since - 1:
+            return True
+    return False
+
+
+class MtimePoller(threading.Thread):
+    """Poll the mtime of folders every <interval> seconds. When a folder
+    changes, it is forgotten and ('cold_dir', path) is sent to the listener.
+    A file rewritten in place does not change the mtime of its folder: the
+    files are stated every <file_interval> seconds, a folder with a
+    modified file changed too."""
+
+    def __init__(self, listener, interval=60, file_interval=600):
+        super(MtimePoller, self).__init__()
+        self._queue = listener
+        self._interval = interval
+        self._file_interval = file_interval
+        # Folder -> (mtime, time since which its files did not change)
+        self._folders = PathTrie()
+        self._lock = threading.Lock()
+        self._end = threading.Event()
+
+    def __len__(self):
+        """Number of polled folders"""
+        return len(self._folders)
+
+    def __contains__(self, path):
+        """Check if a folder is polled"""
+        with self._lock:
+            return path in self._folders
+
+    def folders(self):
+        """List the polled folders"""
+        with self._lock:
+            return [path for (path, _) in self._folders.iteritems()]
+
+    def add(self, paths):
+        """Start polling folders"""
+        now = time.time()
+        mtimes = [(path, _mtime(path)) for path in paths]
+        with self._lock:
+            for (path, mtime) in mtimes:
+                if mtime is not None:
+                    self._folders[path] = (mtime, now)
+
+    def discard(self, path):
+        """Stop polling a folder, not its subfolders"""
+        with self._lock:
+            if path in self._folders:
+                del self._folders[path]
+
+    def remove(self, path):
+        """Stop polling a folder and its subfolders"""
+        with self._lock:
+            for (folder, _) in list(self._folders.iter_subtree(path)):
+                del self._folders[folder]
+
+    def move(self, src, dst):
+        """A folder was moved, with its subfolders"""
+        with self._lock:
+            moved = list(self._folders.iter_subtree(src))
+            for (path, _) in moved:
+                del self._folders[path]
+            for (path, mtime) in moved:
+                self._folders[dst + path[len(src):]] = mtime
+
+    def poll(self):
+        """Check all the folders once, and their files every file_interval
+        seconds"""
+        now = time.time()
+        with self._lock:
+            folders = list(self._folders.iteritems())
+        for (path, state) in folders:
+            new_mtime = _mtime(path)
+            if new_mtime == state[0]:
+                if now - state[1] < self._file_interval:
+                    continue
+                if not _files_changed(path, state[1]):
+                    with self._lock:
+                        if self._folders.get(path) == state:
+                            self._folders[path] = (state[0], now)
+                    continue
+            with self._lock:
+                if self._folders.get(path) != state:
+                    # Removed or moved meanwhile
+                    continue
+                del self._folders[path]
+            # A folder that disappeared is reported by its parent
+            if new_mtime is not None:
+                self._queue.put(('cold_dir', path))
+
+    def run(self):
+        """Poll until stopped"""
+        while not self._end.wait(self._interval):
+            self.poll()
+
+    def stop(self):
+        """Notify the underlying thread to stop, join it"""
+        self._end.set()
+        if self.is_alive():
+            self.join()
+
+
+def _lmtime(path):
+    """Return the mtime of a folder (not followed if a link), None if it
+    disappeared"""
+    try:
+        return os.lstat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _snapshot(path):
+    """Return the mtime of a folder, its entries, name ->
+    (inode, is_dir, mtime, links), and the time it was taken, and the number
+    of stat calls needed. Return None as snapshot if the folder
+    disappeared"""
+    taken = time.time()
+    mtime = _lmtime(path)
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return (None, 1)
+    entries = {}
+    for name in names:
+        try:
+            info = os.lstat(os.path.join(path, name))
+        except OSError:
+            # Disappeared meanwhile, seen by the next poll
+            continue
+        entries[name] = (info.st_ino, stat.S_ISDIR(info.st_mode),
+                         int(info.st_mtime), info.st_nlink)
+    return ((mtime, entries, taken), 1 + len(names))
+
+
+def _settled(snapshot):
+    """Check if the entries of a folder were listed long enough after its
+    last change: if its mtime did not change since, they did not either"""
+    return snapshot[0] is not None and snapshot[2] - snapshot[0] > 1
+
+
+def _linked(entry):
+    """Check if an entry is a file with several hard links: its inode does
+    not identify it, it cannot be paired for a move"""
+    return not entry[1] and entry[3] > 1
+
+
+def _removal(is_dir, path):
+    """Return the update of a removed entry"""
+    if is_dir:
+        return ('remove_dir', path)
+    return ('remove_file', path)
+
+
+class PollingWatch(object):
+    """Watch folders by polling them, for filesystems without inotify
+    (NFS, FUSE...). Same interface and updates as InotifyWatch.
+
+    Each folder is polled on its own interval, between <min_interval> and
+    <max_interval> seconds: halved when the folder changed, doubled when it
+    did not. A poll only stats the folder while its mtime does not change,
+    its entries are listed and stated when it does, and every
+    <file_interval> seconds for the files modified in place. At most
+    <max_stats> stat calls are done per second.
+    Moves are paired by inode: an entry that disappeared waits <delay>
+    seconds to be found in another folder before its removal is sent, an
+    entry found in another folder that was not polled yet is a move too.
+    Files with several hard links are not paired: a removal and a creation
+    are sent instead.
+
+    The Scanner is not reused: the listener needs the moves and removals
+    of the entries, as inotify sends them, the Scanner only updates the
+    database."""
+
+    def __init__(self, listener, delay=2, min_interval=1, max_interval=60,
+                 max_stats=1000, file_interval=600):
+        self._queue = listener
+        self._delay = delay
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._file_interval = file_interval
+        self._max_stats = max_stats
+        self._roots = set()
+        self._root_fds = RootFDs()
+        # Folder -> [snapshot, interval, token, time of the next listing]
+        self._folders = PathTrie()
+        # Heap of (time, token, folder), valid if the folder has the token
+        self._heap = []
+        self._tokens = count()
+        # (inode, is_dir) -> path, for the entries of the polled folders
+        self._inodes = {}
+        # (inode, is_dir) -> (path, entry) of the entries that disappeared,
+        # and the (time, key, path) queue of their removals
+        self._removed = {}
+        self._removals = deque()
+        self._lock = threading.Condition(threading.RLock())
+        # Stat calls that can be done without waiting (negative: debt)
+        self._allowance = max_stats
+        self._last_spend = time.time()
+        self._spend_lock = threading.Lock()
+        self._thread = None
+        self._end = threading.Event()
+        self._started = False
+
+    def start(self):
+        """Start the thread, must not be called twice on the same instance"""
+        assert(not self._started)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.start()
+        self._started = True
+
+    def stop(self):
+        """"Stop the thread, nop if non started"""
+        if not self._started:
+            return
+        self._started = False
+        self._end.set()
+        with self._lock:
+            self._lock.notify()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+        self._root_fds.close()
+
+    def started(self):
+        """"Check if we started"""
+        return self._started
+
+    def _schedule(self, path, folder, interval):
+        """Poll a folder again in <interval> seconds (in the lock)"""
+        folder[1] = interval
+        folder[2] = next(self._tokens)
+        heappush(self._heap, (time.time() + interval, folder[2], path))
+        if len(self._heap) > 2 * len(self._folders) + 1024:
+            self._heap = [entry for entry in self._heap
+                          if self._folders.get(entry[2], [0, 0, -1])[2] ==
+                          entry[1]]
+            heapify(self._heap)
+        self._lock.notify()
+
+    def _watch(self, path, rec):
+        """Snapshot and poll a folder, and the folders below it if rec,
+        return False if it disappeared"""
+        pending = [path]
+        while len(pending) != 0:
+            folder = pending.pop()
+            (snapshot, stats) = _snapshot(folder)
+            self._spend(stats)
+            if snapshot is None:
+                if folder == path:
+                    return False
+                continue
+            with self._lock:
+                if folder in self._folders:
+                    self._unindex(folder, self._folders[folder][0][1])
+                state = [snapshot, None, None,
+                         time.time() + self._file_interval]
+                self._folders[folder] = state
+                self._index(folder, snapshot[1])
+                self._schedule(folder, state, self._min_interval)
+            if rec:
+                pending.extend(os.path.join(folder, name) for (name, entry)
+                               in snapshot[1].iteritems() if entry[1])
+        return True
+
+    def add(self, root, rec=True):
+        """Add a folder to the list of watched folders, and the folders below
+        it unless rec is False"""
+        assert(os.path.isdir(root))
+        self._roots.add(root)
+        self._root_fds.add(root)
+        return self._watch(root, rec)
+
+    def add_dir(self, path, rec=True):
+        """Add a folder, and the folders below it unless rec is False, to the
+        watched ones"""
+        if not self._watch(path, rec):
+            # The path disappeared
+            warn(InotifyTranscientPath(path))
+            return False
+        return True
+
+    def watched(self, path):
+        """List the watched folders below path (included)"""
+        with self._lock:
+            return [folder for (folder, _) in self._folders.iter_subtree(path)]
+
+    def unwatch(self, paths):
+        """Stop watching those folders (not the folders below them)"""
+        with self._lock:
+            for path in paths:
+                if path in self._roots:
+                    self._roots.discard(path)
+                    self._root_fds.remove(path)
+                if path in self._folders:
+                    self._drop(path)
+
+    def _index(self, folder, entries):
+        """Index the entries of a folder by inode (in the lock)"""
+        for (name, entry) in entries.iteritems():
+            if not _linked(entry):
+                self._inodes[entry[:2]] = os.path.join(folder, name)
+
+    def _unindex(self, folder, entries):
+        """Remove the entries of a folder from the index (in the lock)"""
+        for (name, entry) in entries.iteritems():
+            if self._inodes.get(entry[:2]) == os.path.join(folder, name):
+                del self._inodes[entry[:2]]
+
+    def _drop(self, folder):
+        """Stop watching a single folder (in the lock)"""
+        self._unindex(folder, self._folders[folder][0][1])
+        del self._folders[folder]
+
+    def _forget(self, path):
+        """Stop watching a folder and the folders below it (in the lock)"""
+        for (folder, _) in list(self._folders.iter_subtree(path)):
+            self._drop(folder)
+
+    def _rebase(self, src, dst):
+        """A folder was renamed (in the lock)"""
+        moved = list(self._folders.iter_subtree(src))
+        for (folder, _) in moved:
+            self._drop(folder)
+        for (folder, state) in moved:
+            folder = dst + folder[len(src):]
+            self._folders[folder] = state
+            self._index(folder, state[0][1])
+            self._schedule(folder, state, state[1])
+
+    def _spend(self, stats):
+        """Account for <stats> stat calls, wait to stay under max_stats per
+        second"""
+        with self._spend_lock:
+            now = time.time()
+            self._allowance = min(self._max_stats, self._allowance +
+                                  (now - self._last_spend) * self._max_stats)
+            self._last_spend = now
+            self._allowance -= stats
+            debt = -self._allowance
+        if debt > 0:
+            self._end.wait(debt / float(self._max_stats))
+
+    def _moved_from(self, key):
+        """Return the previous path and entry of an entry found in a folder,
+        (None, None) if it was not moved from another folder (in the lock)"""
+        if key in self._removed:
+            return self._removed.pop(key)
+        src = self._inodes.get(key)
+        if src is None:
+            return (None, None)
+        folder = self._folders.get(os.path.dirname(src))
+        name = os.path.basename(src)
+        if folder is None or folder[0][1].get(name, (None, None))[:2] != key:
+            return (None, None)
+        try:
+            if os.lstat(src).st_ino == key[0]:
+                # Still there, a hard link
+                return (None, None)
+        except OSError:
+            pass
+        # Its folder was not polled since: it must not see its removal
+        entry = folder[0][1].pop(name)
+        del self._inodes[key]
+        if key[1]:
+            self._forget(src)
+        return (src, entry)
+
+    def _expired(self, now):
+        """Return the removals of the entries that were not found elsewhere
+        within <delay> seconds (in the lock)"""
+        updates = []
+        while len(self._removals) != 0 and self._removals[0][0] <= now:
+            (_, key, path) = self._removals.popleft()
+            if self._removed.get(key, (None, None))[0] != path:
+                # Moved
+                continue
+            del self._removed[key]
+            folder = self._folders.get(os.path.dirname(path))
+            if folder is not None and folder[0][1].get(
+                    os.path.basename(path), (None, None))[1] == key[1]:
+                # Replaced since, already sent as modified or new_dir
+                continue
+            updates.append(_removal(key[1], path))
+        return updates
+
+    def _compare(self, path, old, new):
+        """Return the updates between two snapshots of a folder and its new
+        subfolders (in the lock)"""
+        updates = []
+        new_dirs = []
+        removed = {}
+        added = {}
+        for (name, entry) in old.iteritems():
+            if new.get(name, (None, None))[:2] == entry[:2]:
+                continue
+            elif _linked(entry):
+                src = os.path.join(path, name)
+                if self._inodes.get(entry[:2]) == src:
+                    # Indexed before it was linked
+                    del self._inodes[entry[:2]]
+                updates.append(_removal(False, src))
+            else:
+                removed[entry[:2]] = name
+        for (name, entry) in new.iteritems():
+            old_entry = old.get(name)
+            if old_entry is not None and old_entry[:2] == entry[:2]:
+                if not entry[1] and old_entry[2] != entry[2]:
+                    updates.append(('modified', os.path.join(path, name)))
+            elif _linked(entry):
+                updates.append(('modified', os.path.join(path, name)))
+            else:
+                added[entry[:2]] = name
+        # Renames keep the inode
+        for key in [key for key in added if key in removed]:
+            src = os.path.join(path, removed.pop(key))
+            dst = os.path.join(path, added.pop(key))
+            self._inodes[key] = dst
+            if key[1]:
+                self._rebase(src, dst)
+                updates.append(('move_dir', src, dst))
+            else:
+                updates.append(('move_file', src, dst))
+        due = time.time() + self._delay
+        for (key, name) in removed.iteritems():
+            src = os.path.join(path, name)
+            if self._inodes.get(key) == src:
+                del self._inodes[key]
+            if key[1]:
+                self._forget(src)
+            if name in new:
+                # Replaced in place
+                updates.append(_removal(key[1], src))
+                continue
+            if key in self._removed:
+                # Inode reused, the previous entry was not moved
+                updates.append(_removal(key[1], self._removed[key][0]))
+            # Maybe moved to a folder polled later
+            self._removed[key] = (src, old[name])
+            self._removals.append((due, key, src))
+        for (key, name) in added.iteritems():
+            dst = os.path.join(path, name)
+            (src, entry) = self._moved_from(key)
+            self._inodes[key] = dst
+            if src is None:
+                if key[1]:
+                    new_dirs.append(dst)
+                else:
+                    updates.append(('modified', dst))
+            elif key[1]:
+                updates.append(('move_dir', src, dst))
+                # Its content may have changed since its last poll
+                new_dirs.append(dst)
+            else:
+                updates.append(('move_file', src, dst))
+                if entry[2] != new[name][2]:
+                    updates.append(('modified', dst))
+        return (updates, new_dirs)
+
+    def _root_moved(self, root):
+        """A root disappeared: follow it if it was moved, die otherwise (in
+        the lock)"""
+        new_root = self._root_fds.moved(root)
+        if new_root is None:
+            self.die_on(PollingRootDeleted(root))
+            return
+        self._roots.discard(root)
+        self._roots.add(new_root)
+        self._rebase(root, new_root)
+        self._queue.put(('move_root', root, new_root))
+
+    def _unchanged(self, path):
+        """Check if a folder did not change since its last listing, and its
+        files do not need to be stated yet"""
+        with self._lock:
+            state = self._folders.get(path)
+            if (state is None or time.time() >= state[3] or
+                    not _settled(state[0])):
+                return False
+            mtime = state[0][0]
+        self._spend(1)
+        if _lmtime(path) != mtime:
+            return False
+        with self._lock:
+            if self._folders.get(path) is not state:
+                # Forgotten or moved meanwhile
+                return True
+            updates = self._expired(time.time())
+            self._schedule(path, state,
+                           min(self._max_interval, state[1] * 2.0))
+        for update in updates:
+            self._queue.put(update)
+        return True
+
+    def _poll(self, path):
+        """Poll a folder, send its changes"""
+        if self._unchanged(path):
+            return
+        (snapshot, stats) = _snapshot(path)
+        self._spend(stats)
+        with self._lock:
+            state = self._folders.get(path)
+            if state is None:
+                # Forgotten meanwhile
+                return
+            if snapshot is None:
+                if path in self._roots:
+                    self._root_moved(path)
+                    return
+                # Its removal is reported by its parent
+                self._drop(path)
+                return
+            (updates, new_dirs) = self._compare(path, state[0][1],
+                                                snapshot[1])
+            state[0] = snapshot
+            state[3] = time.time() + self._file_interval
+            updates.extend(self._expired(time.time()))
+            if len(updates) + len(new_dirs) != 0:
+                interval = max(self._min_interval, state[1] / 2.0)
+            else:
+                interval = min(self._max_interval, state[1] * 2.0)
+            self._schedule(path, state, interval)
+        for update in updates:
+            self._queue.put(update)
+        for new_dir in new_dirs:
+            # The listener should use the scanner to find sub-files/folders
+            if self._watch(new_dir, True):
+                self._queue.put(('new_dir', new_dir))
+
+    def _next(self):
+        """Wait for the next folder to poll, None when stopped"""
+        with self._lock:
+            while not self._end.is_set():
+                if len(self._heap) == 0:
+                    self._lock.wait()
+                    continue
+                (due, token, path) = self._heap[0]
+                if self._folders.get(path, [0, 0, -1])[2] != token:
+                    # Forgotten or rescheduled
+                    heappop(self._heap)
+                    continue
+                now = time.time()
+                if due > now:
+                    self._lock.wait(due - now)
+                    continue
+                heappop(self._heap)
+                return path
+        return None
+
+    def _run(self):
+        """Poll the folders until stopped"""
+        while True:
+            path = self._next()
+            if path is None:
+                break
+            self._poll(path)
+
+    def die_on(self, warning):
+        """Dying callback"""
+        self._queue.put(('DIE', warning))
+        self.stop()
@@ -0,0 +1,88 @@
+# ----------------------------------------------------------------------------
+# "THE BEER-WARE LICENSE" (Revision 42):
+# <git@lerya.net> wrote this file. As long as you retain this notice you can
+# do whatever you want with this stuff. If we meet some day, and you think
+# this stuff is worth it, you can buy me a beer in return. Vincent Brillault
+# ----------------------------------------------------------------------------
+
+"""Follow the roots when they are moved"""
+
+import os
+
+
+class RootFDs(object):
+    """Keep a file descriptor open on each root folder: the kernel still
+    knows where the folder is after it was moved (/proc/self/fd).
+    An open fd keeps the folder busy: a root which is a mount point cannot
+    be unmounted (EBUSY, umount -l detaches it but the kernel only sends
+    IN_UNMOUNT once the fd is closed), and IN_DELETE_SELF is delayed until
+    the fd is closed. Call release_deleted regularly, and remove as soon as
+    the root is reported deleted or unmounted"""
+
+    def __init__(self):
+        self._fds = {}
+
+    def add(self, root):
+        """Follow a root"""
+        if root in self._fds:
+            return
+        try:
+            self._fds[root] = os.open(root, os.O_RDONLY)
+        except OSError:
+            # Disappeared, its watch reports it
+            pass
+
+    def remove(self, root):
+        """Stop following a root, nop if not followed"""
+        fd = self._fds.pop(root, None)
+        if fd is not None:
+            os.close(fd)
+
+    def moved(self, root):
+        """Return (and follow) the new path of a moved root, None if it
+        cannot be found anymore"""
+        fd = self._fds.get(root)
+        if fd is None:
+            return None
+        try:
+            path = os.readlink('/proc/self/fd/{}'.format(fd))
+        except OSError:
+            return None
+        if path == root or not os.path.isdir(path):
+            # Deleted: the link ends with ' (deleted)'
+            return None
+        del self._fds[root]
+        self._fds[path] = fd
+        return path
+
+    @staticmethod
+    def _reachable(fd):
+        """Check if a path still leads to the folder of an fd: not after
+        its deletion, nor once its filesystem was detached (umount -l)"""
+        info = os.fstat(fd)
+        if info.st_nlink == 0:
+            return False
+        try:
+            path = os.readlink('/proc/self/fd/{}'.format(fd))
+        except OSError:
+            # No /proc, cannot tell
+            return True
+        try:
+            found = os.stat(path)
+        except OSError:
+            return False
+        return (found.st_dev, found.st_ino) == (info.st_dev, info.st_ino)
+
+    def release_deleted(self):
+        """Close the fds of the deleted or detached roots, for the kernel to
+        notify it"""
+        for (root, fd) in self._fds.items():
+            if not self._reachable(fd):
+                del self._fds[root]
+                os.close(fd)
+
+    def close(self):
+        """Stop following all the roots"""
+        for fd in self._fds.itervalues():
+            os.close(fd)
+        self._fds = {}
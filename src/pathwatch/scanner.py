@@ -18,11 +18,19 @@ class Scanner(object):
         Need to be the only one that insert/delete rows in the database when
         running: no concurrency protection (Other threads/processes can still
         try to update those values, but need to handle row suppression)
+
+        If a DBWriter is given, mutations are queued to it instead of being
+        applied directly.
     """
 
-    def __init__(self, database):
+    def __init__(self, database, writer=None):
         self._db = DBFilesHelper(database)
         self._db.create_table()
+        self._writer = writer
+        if writer is None:
+            self._writedb = self._db
+        else:
+            self._writedb = writer
 
     def close(self):
         """Close the scanner (close the underlying sqlite connection)"""
@@ -33,64 +41,106 @@ class Scanner(object):
         row = self._db.get_path(path)
         if row is not None and row[0] == 0:
             # Was a dir, clean it
-            self._db.delete_path(path)
+            self._writedb.delete_path(path)
         if not os.path.exists(path):
             # Was a file but does not exists anymore, clean
-            self._db.delete_single(path)
+            self._writedb.delete_single(path)
             return
-        mtime = int(os.stat(path).st_mtime)
+        info = os.stat(path)
+        mtime = int(info.st_mtime)
         if row is None:
-            self._db.insert_file(path, mtime)
+            self._writedb.insert_file(path, mtime, info.st_size)
         elif row[0] < mtime:
-            self._db.update_file(path, mtime)
+            self._writedb.update_file(path, mtime, info.st_size)
+
+    def _scan_dir(self, root, dirs, files, all_dirs=False):
+        """Update the content of a single folder, return the new sub-folders
+        (all of them if all_dirs)"""
+        # Extract old data
+        (old_files, old_dirs) = self._db.list_path(root)
+        # Remove old dirs
+        self._writedb.delete_paths(root, old_dirs - set(dirs))
+        # Remove old files
+        self._writedb.delete_singles(root,
+                                     set(old_files.keys()) - set(files))
+        # Create new folders
+        new_dirs = set(dirs) - old_dirs
+        self._writedb.insert_dirs(root, new_dirs)
+        # Update files
+        insert_file = []
+        update_file = []
+        for new_file in files:
+            info = os.stat(os.path.join(root, new_file))
+            new_mtime = int(info.st_mtime)
+            try:
+                old_mtime = old_files[new_file]
+                if old_mtime < new_mtime:
+                    update_file.append((new_mtime, root, new_file,
+                                        info.st_size))
+            except KeyError:
+                insert_file.append((new_mtime, root, new_file, info.st_size))
+        self._writedb.insert_files(insert_file)
+        self._writedb.update_files(update_file)
+        if all_dirs:
+            return [os.path.join(root, name) for name in dirs]
+        return [os.path.join(root, new_dir) for new_dir in new_dirs]
+
+    def _scan_dir_since(self, root, files, since):
+        """Update the files of a folder whose entries did not change since
+        <since>: only files modified after it need to be compared"""
+        modified = []
+        for new_file in files:
+            info = os.stat(os.path.join(root, new_file))
+            if int(info.st_mtime) >= since:
+                modified.append((int(info.st_mtime), new_file, info.st_size))
+        if len(modified) == 0:
+            return []
+        (old_files, _) = self._db.list_path(root)
+        update_file = []
+        for (new_mtime, new_file, size) in modified:
+            if old_files.get(new_file, 0) < new_mtime:
+                update_file.append((new_mtime, root, new_file, size))
+        self._writedb.update_files(update_file)
+        return []
 
-    def _scan_folder(self, path):
-        """Scan the tree under path (a folder). Does not follow symlinks"""
+    def iter_scan(self, path, since=None, all_dirs=False):
+        """Scan a path like scan, one folder at a time: after each folder,
+        yield the list of its new sub-folders (all of them if all_dirs). The
+        database can be modified between two folders.
+        If since is given, the database is assumed to be up to date before
+        it: folders not modified after it are not compared with the database
+        (only their files modified after it are)."""
+        if self._writer is not None:
+            # Folder scans compare with the database content
+            self._writer.flush()
+        if not os.path.exists(path):
+            self._writedb.delete_path(path)
+            return
+        if not os.path.isdir(path):
+            self._scan_file(path)
+            return
         # Check if it was a file before
         row = self._db.get_path(path)
         if row is None:
-            self._db.insert_dir(path)
+            self._writedb.insert_dir(path)
         elif not row[0] == 0:
-            self._db.delete_single(path)
-        # Walk (does not follow symlinks
+            self._writedb.delete_single(path)
+        # Walk (does not follow symlinks)
         for (root, dirs, files) in os.walk(path):
-            # Extract old data
-            (old_files, old_dirs) = self._db.list_path(root)
-            # Remove old dirs
-            self._db.delete_paths(root, old_dirs - set(dirs))
-            # Remove old files
-            self._db.delete_singles(root,
-                                    set(old_files.keys()) - set(files))
-            # Create new folders
-            self._db.insert_dirs(root, set(dirs) - old_dirs)
-            # Update files
-            insert_file = []
-            update_file = []
-            for new_file in files:
-                new_mtime = int(os.stat(os.path.join(root, new_file)).st_mtime)
-                try:
-                    old_mtime = old_files[new_file]
-                    if old_mtime < new_mtime:
-                        update_file.append((new_mtime, root, new_file))
-                except KeyError:
-                    insert_file.append((new_mtime, root, new_file))
-            self._db.insert_files(insert_file)
-            self._db.update_files(update_file)
+            if since is not None and int(os.stat(root).st_mtime) < since:
+                yield self._scan_dir_since(root, files, since)
+            else:
+                yield self._scan_dir(root, dirs, files, all_dirs)
 
     def scan(self, path):
         """Scan a path, file or folder"""
-        if not os.path.exists(path):
-            self._db.delete_path(path)
-            return
-        if os.path.isdir(path):
-            self._scan_folder(path)
-        else:
-            self._scan_file(path)
+        for _ in self.iter_scan(path):
+            pass
 
     def scan_file(self, path):
         """Scan a  file (abort if folder)"""
         if not os.path.exists(path):
-            self._db.delete_path(path)
+            self._writedb.delete_path(path)
             return
         if not os.path.isdir(path):
             self._scan_file(path)
@@ -9,40 +9,78 @@
 
 from fcntl import fcntl, F_SETFL
 from heapq import heapify, heappop, heappush
+from itertools import count
 from os import pipe, read, write, O_NONBLOCK
 from select import poll, POLLIN
 from time import time
 from threading import Event, RLock, Thread
 
 READ_MAX_SIZE = 8
+# Compact the heap once there are more cancelled entries than that and
+# than valid ones
+COMPACT_MIN = 1024
 
 
 class Scheduler(Thread):
-    """Thread implementation of sched, with a proper poll"""
+    """Thread implementation of sched, with a proper poll.
+    Cancelled events are left in the heap (lazy deletion), they are skipped
+    when reaching its top and purged when they are the majority"""
 
     def __init__(self):
         super(Scheduler, self).__init__()
+        # Heap of (end, token, ident), valid if _heap_content has the token
         self._heap = []
+        # ident -> (token, callback, args, kwargs)
         self._heap_content = {}
+        self._tokens = count()
+        self._cancelled = 0
         self._lock = RLock()
         self._fd = pipe()
         self._pollobj = poll()
         self._pollobj.register(self._fd[0], POLLIN)
         fcntl(self._fd[0], F_SETFL, O_NONBLOCK)
         self._end = Event()
+        # Next wakeup of the thread, and if it was already woken up
         self._next = None
+        self._woken = False
 
     def add(self, delay, ident, callback, *args, **kwargs):
         """Run the given callback after the given delay,
         the ident must be unique and is used for cancelling the event"""
+        self._add(delay, [(ident, callback, args, kwargs)])
+
+    def add_many(self, delay, events):
+        """Run the callbacks of the given events, (ident, callback, args)
+        tuples, after the given delay. Nothing is added if one of the idents
+        is already present"""
+        self._add(delay, [(ident, callback, args, {})
+                          for (ident, callback, args) in events])
+
+    def _add(self, delay, events):
+        """Add (ident, callback, args, kwargs) events, wake the thread up at
+        most once"""
+        if len(events) == 0:
+            return
         end = time() + delay
-        if ident in self._heap_content:
-            raise KeyError('Identifier already present')
-        self._heap_content[ident] = (end, callback, args, kwargs)
         with self._lock:
-            heappush(self._heap, (end, ident))
-            if (self._next is None or
-                    self._next > end):
+            idents = set(event[0] for event in events)
+            if (len(idents) != len(events) or
+                    not idents.isdisjoint(self._heap_content)):
+                raise KeyError('Identifier already present')
+            entries = []
+            for (ident, callback, args, kwargs) in events:
+                token = next(self._tokens)
+                self._heap_content[ident] = (token, callback, args, kwargs)
+                entries.append((end, token, ident))
+            if len(entries) > len(self._heap):
+                self._heap.extend(entries)
+                heapify(self._heap)
+            else:
+                for entry in entries:
+                    heappush(self._heap, entry)
+            if (not self._woken and
+                    (self._next is None or self._next > end)):
+                self._woken = True
                 write(self._fd[1], '.')
 
     def cancel(self, ident):
@@ -52,11 +90,49 @@ class Scheduler(Thread):
                 del self._heap_content[ident]
             except KeyError:
                 # Already removed
-                pass
+                return
+            self._cancelled += 1
+            if (self._cancelled > COMPACT_MIN and
+                    self._cancelled * 2 > len(self._heap)):
+                self._compact()
+
+    def __len__(self):
+        """Number of pending events"""
+        return len(self._heap_content)
+
+    def _valid(self, entry):
+        """Check if an heap entry was not cancelled"""
+        content = self._heap_content.get(entry[2])
+        return content is not None and content[0] == entry[1]
+
+    def _compact(self):
+        """Purge the cancelled entries from the heap (in the lock)"""
+        self._heap = [entry for entry in self._heap if self._valid(entry)]
+        heapify(self._heap)
+        self._cancelled = 0
+
+    def _pop_expired(self, now):
+        """Pop all the events expired at <now>, return their callbacks and
+        the time of the next event (in the lock)"""
+        expired = []
+        while len(self._heap) != 0:
+            entry = self._heap[0]
+            if not self._valid(entry):
+                # Event Cancelled (and maybe re-injected)
+                heappop(self._heap)
+                self._cancelled -= 1
+                continue
+            if entry[0] > now:
+                return (expired, entry[0])
+            heappop(self._heap)
+            (_, callback, args, kwargs) = self._heap_content.pop(entry[2])
+            expired.append((callback, args, kwargs))
+        return (expired, None)
 
     def _clean_fd(self):
         """Clean the pipe ((re-)enter the lock)"""
         with self._lock:
+            self._woken = False
             try:
                 while read(self._fd[0], READ_MAX_SIZE) != '':
                     pass
@@ -67,44 +143,19 @@ class Scheduler(Thread):
     def run(self):
         """Run the scheduler, rerun-it until the end"""
         while not self._end.is_set():
-            # As we are only removing element in this function, no lock needed
-            if len(self._heap) == 0:
-                self._pollobj.poll()
-                self._clean_fd()
+            with self._lock:
+                now = time()
+                (expired, self._next) = self._pop_expired(now)
+            if len(expired) != 0:
+                for (callback, args, kwargs) in expired:
+                    callback(*args, **kwargs)
                 continue
+            if self._next is None:
+                self._pollobj.poll()
             else:
-                with self._lock:
-                    (end, ident) = self._heap[0]
-                    try:
-                        raw = self._heap_content[ident]
-                    except KeyError:
-                        # Event Cancelled
-                        heappop(self._heap)
-                        continue
-                    if raw[0] != end:
-                        # Event Cancelled and re-injected
-                        heappop(self._heap)
-                        continue
-
-            now = time()
-            if now < end:
-                res = self._pollobj.poll(end - now)
-                if res is not None:
-                    self._clean_fd()
-                    continue
-            with self._lock:
-                self._heap.remove((end, ident))
-                heapify(self._heap)
-                try:
-                    (end2, callback, args, kwargs) = self._heap_content[ident]
-                    if end2 != end:
-                        # Event Cancelled and re-injected
-                        heappop(self._heap)
-                        continue
-                    del self._heap_content[ident]
-                except KeyError:
-                    continue
-            callback(*args, **kwargs)
+                # poll timeout is in milliseconds
+                self._pollobj.poll((self._next - now) * 1000)
+            self._clean_fd()
 
     def stop(self):
         """Notify the underlying thread to stop, join it"""
@@ -0,0 +1,151 @@
+# ----------------------------------------------------------------------------
+# "THE BEER-WARE LICENSE" (Revision 42):
+# <git@lerya.net> wrote this file. As long as you retain this notice you can
+# do whatever you want with this stuff. If we meet some day, and you think
+# this stuff is worth it, you can buy me a beer in return. Vincent Brillault
+# ----------------------------------------------------------------------------
+
+"""Detect floods of inotify updates under a subtree"""
+
+import os.path
+
+from .pathtrie import PathTrie
+
+
+class StormDetector(object):
+    """Count the updates under each folder of the roots. When more than
+    <threshold> updates happen under a folder within <window> seconds, the
+    updates under it are dropped until none came during <calm> seconds: the
+    whole folder should then be rescanned."""
+
+    def __init__(self, threshold=1000, window=1.0, calm=2.0):
+        self.threshold = threshold
+        self.window = window
+        self.calm = calm
+        self._roots = PathTrie()
+        self._counts = {}
+        self._window_start = None
+        # Folder in storm -> time of its last update
+        self._storms = {}
+
+    def add_root(self, root):
+        """Storms are detected below roots only"""
+        self._roots[root] = True
+
+    def remove_root(self, root):
+        """Forget a root and the storms below it"""
+        if root in self._roots:
+            del self._roots[root]
+        prefix = root + '/'
+        for folder in [folder for folder in self._storms
+                       if folder == root or folder.startswith(prefix)]:
+            del self._storms[folder]
+
+    def _root_of(self, path):
+        """Return the root containing path, None if there are none"""
+        found = self._roots.longest_prefix(path)
+        if found is None:
+            return None
+        return found[0]
+
+    def _in_storm(self, path):
+        """Return the folder in storm containing path, None if there are
+        none"""
+        if len(self._storms) == 0:
+            return None
+        while True:
+            if path in self._storms:
+                return path
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+    def _count(self, path, now):
+        """Count an update on path, return the folder that starts a storm
+        because of it, if any"""
+        root = self._root_of(path)
+        if root is None or root == path:
+            return None
+        if (self._window_start is None or
+                now - self._window_start >= self.window):
+            self._counts = {}
+            self._window_start = now
+        storm = None
+        folder = os.path.dirname(path)
+        while True:
+            count = self._counts.get(folder, 0) + 1
+            self._counts[folder] = count
+            if storm is None and count >= self.threshold:
+                storm = folder
+            if folder == root:
+                return storm
+            folder = os.path.dirname(folder)
+
+    def _start(self, folder, now):
+        """Start a storm on folder, absorbing the storms below it"""
+        prefix = folder + '/'
+        for inner in [inner for inner in self._storms
+                      if inner.startswith(prefix)]:
+            del self._storms[inner]
+        self._storms[folder] = now
+        # Its updates should not start a storm on the folders above
+        count = self._counts.pop(folder, 0)
+        while True:
+            parent = os.path.dirname(folder)
+            if parent == folder or parent not in self._counts:
+                break
+            self._counts[parent] -= count
+            folder = parent
+
+    def observe(self, path, now):
+        """Count an update on path, return True if it should be dropped"""
+        storm = self._in_storm(path)
+        if storm is not None:
+            self._storms[storm] = now
+            return True
+        storm = self._count(path, now)
+        if storm is not None:
+            self._start(storm, now)
+            return True
+        return False
+
+    def filter(self, updates, now):
+        """Return the updates that still need to be applied.
+        Moves are kept if they leave a storm (the destination is scanned too)
+        or if they enter one (hashes are kept, the storm rescan cleans)"""
+        result = []
+        for update in updates:
+            cmd = update[0]
+            if cmd in ('modified', 'new_dir', 'remove_file', 'remove_dir'):
+                if not self.observe(update[1], now):
+                    result.append(update)
+            elif cmd in ('move_file', 'move_dir'):
+                src_storm = self.observe(update[1], now)
+                dst_storm = self.observe(update[2], now)
+                if src_storm and dst_storm:
+                    continue
+                result.append(update)
+                if src_storm:
+                    if cmd == 'move_dir':
+                        result.append(('new_dir', update[2]))
+                    else:
+                        result.append(('modified', update[2]))
+            else:
+                result.append(update)
+        return result
+
+    def timeout(self, now):
+        """Time before the next storm may calm down, None without storms"""
+        if len(self._storms) == 0:
+            return None
+        return max(0, min(self._storms.values()) + self.calm - now)
+
+    def calmed(self, now):
+        """Return (and forget) the folders whose storm calmed down, they need
+        to be rescanned"""
+        result = [folder for (folder, last) in self._storms.iteritems()
+                  if now - last >= self.calm]
+        for folder in result:
+            del self._storms[folder]
+        return result
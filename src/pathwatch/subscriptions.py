@@ -0,0 +1,167 @@
+# ----------------------------------------------------------------------------
+# "THE BEER-WARE LICENSE" (Revision 42):
+# <git@lerya.net> wrote this file. As long as you retain this notice you can
+# do whatever you want with this stuff. If we meet some day, and you think
+# this stuff is worth it, you can buy me a beer in return. Vincent Brillault
+# ----------------------------------------------------------------------------
+
+"""Deliver the committed changes to in-process subscribers"""
+
+import threading
+from itertools import count
+from warnings import warn
+
+from .database import DBChangesHelper
+from .errorwarn import DBChangesPruned, SubscriberFailed, SubscribersLagging
+
+# Change feed operation -> event delivered to the subscribers
+EVENTS = {'insert': 'scanned',
+          'update': 'modified',
+          'move': 'moved',
+          'delete': 'removed',
+          'hash': 'hashed'}
+
+
+def _event(change):
+    """Return the event of a (seq, op, path, dest, mtime, identity) change:
+    ('scanned'|'modified', path, mtime), ('moved', src, dst), ('removed',
+    path) for the path and everything below it, or ('hashed', path,
+    identity)"""
+    (_, op, path, dest, mtime, identity) = change
+    if op == 'move':
+        return ('moved', path, dest)
+    elif op == 'delete':
+        return ('removed', path)
+    elif op == 'hash':
+        return ('hashed', path, identity)
+    return (EVENTS[op], path, mtime)
+
+
+def _below(path, prefix):
+    """Check if path is prefix or below it"""
+    return path == prefix or path.startswith(prefix.rstrip('/') + '/')
+
+
+def _restrict(event, prefix):
+    """Restrict an event to the paths below prefix, None if it does not
+    concern them. Moving or removing an ancestor of prefix, logged once for
+    the whole tree, is seen as moving or removing prefix itself"""
+    if _below(event[1], prefix):
+        return event
+    elif event[0] == 'moved' and _below(event[2], prefix):
+        return event
+    prefix = prefix.rstrip('/') or '/'
+    if event[0] == 'removed' and _below(prefix, event[1]):
+        return ('removed', prefix)
+    elif event[0] == 'moved':
+        (src, dst) = event[1:]
+        if _below(prefix, src):
+            return ('moved', prefix, dst + prefix[len(src.rstrip('/')):])
+        elif _below(prefix, dst):
+            return ('moved', src + prefix[len(dst.rstrip('/')):], prefix)
+    return None
+
+
+class Dispatcher(threading.Thread):
+    """Read the change feed after each commit (see notify), deliver the
+    events to the subscribers, by batches, from this thread"""
+
+    def __init__(self, database, batch_size=1000):
+        super(Dispatcher, self).__init__()
+        self._database = database
+        self.batch_size = batch_size
+        # token -> (target, prefix, events)
+        self._subscriptions = {}
+        self._tokens = count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._ready = threading.Event()
+        self._end = threading.Event()
+
+    def start(self):
+        """Start the thread, return once it knows where the change feed
+        ends: the changes committed after are delivered"""
+        super(Dispatcher, self).start()
+        self._ready.wait()
+
+    def subscribe(self, target, prefix=None, events=None):
+        """Deliver the events below <prefix> (all if None) whose type is in
+        <events> (all if None) to target: a callable called with each batch,
+        or a queue receiving each batch. Return a token for unsubscribe"""
+        if events is not None:
+            events = frozenset(events)
+            assert(events <= frozenset(EVENTS.itervalues()))
+        with self._lock:
+            token = next(self._tokens)
+            self._subscriptions[token] = (target, prefix, events)
+        return token
+
+    def unsubscribe(self, token):
+        """Stop delivering events to a subscriber"""
+        with self._lock:
+            self._subscriptions.pop(token, None)
+
+    def notify(self):
+        """Changes were committed"""
+        self._wakeup.set()
+
+    @staticmethod
+    def _match(event, prefix, events):
+        """Return the event as seen by a subscription, None if it does not
+        want it"""
+        if events is not None and event[0] not in events:
+            return None
+        if prefix is None:
+            return event
+        return _restrict(event, prefix)
+
+    def _deliver(self, events):
+        """Deliver a batch of events to the subscribers"""
+        with self._lock:
+            subscriptions = self._subscriptions.values()
+        for (target, prefix, wanted) in subscriptions:
+            batch = [seen for seen in (self._match(event, prefix, wanted)
+                                       for event in events)
+                     if seen is not None]
+            if len(batch) == 0:
+                continue
+            try:
+                if hasattr(target, 'put'):
+                    target.put(batch)
+                else:
+                    target(batch)
+            except Exception as err:  # pylint: disable=W0703
+                warn(SubscriberFailed('{}: {}'.format(target, err)))
+
+    def run(self):
+        """Deliver the new changes each time some are committed"""
+        changesdb = DBChangesHelper(self._database)
+        cursor = changesdb.last_seq()
+        self._ready.set()
+        while not self._end.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            # The changes committed before stop are still delivered, the
+            # ones committed without subscribers are skipped
+            if len(self._subscriptions) == 0:
+                cursor = changesdb.last_seq()
+                continue
+            while True:
+                try:
+                    changes = changesdb.changes_since(cursor,
+                                                      self.batch_size)
+                except DBChangesPruned:
+                    warn(SubscribersLagging(cursor))
+                    cursor = changesdb.last_seq()
+                    continue
+                if len(changes) == 0:
+                    break
+                cursor = changes[-1][0]
+                self._deliver([_event(change) for change in changes])
+        changesdb.close()
+
+    def stop(self):
+        """Notify the underlying thread to stop, join it"""
+        self._end.set()
+        self._wakeup.set()
+        self.join()
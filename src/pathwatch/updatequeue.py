@@ -0,0 +1,117 @@
+# ----------------------------------------------------------------------------
+# "THE BEER-WARE LICENSE" (Revision 42):
+# <git@lerya.net> wrote this file. As long as you retain this notice you can
+# do whatever you want with this stuff. If we meet some day, and you think
+# this stuff is worth it, you can buy me a beer in return. Vincent Brillault
+# ----------------------------------------------------------------------------
+
+"""Bounded queue of the updates sent by the watches"""
+
+import os
+import threading
+import time
+from collections import deque
+
+
+# Updates whose arguments are paths
+PATH_UPDATES = frozenset(['modified', 'new_dir', 'remove_file', 'remove_dir',
+                          'move_file', 'move_dir'])
+
+
+class UpdateQueue(object):
+    """Queue of the updates, drained by batches. Above <high_water> pending
+    updates, the path updates are dropped: a single ('overflow', time) is
+    queued instead, as for an inotify overflow, and a rescan catches up.
+    The other updates (roots, errors...) are always queued"""
+
+    def __init__(self, high_water=100000):
+        self.high_water = high_water
+        self.dropped = 0
+        self._items = deque()
+        self._cond = threading.Condition(threading.Lock())
+        # Number of items the consumer waits for
+        self._wanted = None
+        # ('overflow', time) queued for the updates dropped since
+        self._marker = None
+        # Pipe readable while updates are pending, see fileno
+        self._pipe = None
+
+    def __len__(self):
+        """Number of pending updates"""
+        return len(self._items)
+
+    def empty(self):
+        """Check if no updates are pending"""
+        return len(self._items) == 0
+
+    def fileno(self):
+        """File descriptor readable while updates are pending, for event
+        loops"""
+        with self._cond:
+            if self._pipe is None:
+                self._pipe = os.pipe()
+                if len(self._items) != 0:
+                    os.write(self._pipe[1], '!')
+            return self._pipe[0]
+
+    def close(self):
+        """Close the file descriptors, if any"""
+        with self._cond:
+            if self._pipe is not None:
+                os.close(self._pipe[0])
+                os.close(self._pipe[1])
+                self._pipe = None
+
+    def put(self, update):
+        """Queue an update, drop it if it is a path update above the
+        high-water mark"""
+        with self._cond:
+            if (len(self._items) >= self.high_water and
+                    update[0] in PATH_UPDATES):
+                self.dropped += 1
+                if self._marker is not None:
+                    return
+                self._marker = ('overflow', time.time())
+                update = self._marker
+            self._items.append(update)
+            if self._pipe is not None and len(self._items) == 1:
+                os.write(self._pipe[1], '!')
+            if self._wanted is not None and len(self._items) >= self._wanted:
+                self._cond.notify()
+
+    def _wait(self, wanted, timeout):
+        """Wait until <wanted> items are pending, at most <timeout> seconds
+        (forever if None), in the lock"""
+        if timeout is not None:
+            deadline = time.time() + timeout
+        self._wanted = wanted
+        try:
+            while len(self._items) < wanted:
+                if timeout is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        finally:
+            self._wanted = None
+
+    def get_many(self, max_items, timeout=None, linger=0):
+        """Wait at most <timeout> seconds (forever if None) for an update,
+        then <linger> seconds for the ones following it closely. Return up
+        to <max_items> updates, none on timeout"""
+        with self._cond:
+            self._wait(1, timeout)
+            if len(self._items) == 0:
+                return []
+            if linger > 0:
+                self._wait(max_items, linger)
+            count = min(max_items, len(self._items))
+            updates = [self._items.popleft() for _ in xrange(count)]
+            if self._marker is not None and any(
+                    update is self._marker for update in updates):
+                self._marker = None
+            if self._pipe is not None and len(self._items) == 0:
+                os.read(self._pipe[0], 1)
+        return updates
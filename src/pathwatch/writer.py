@@ -0,0 +1,313 @@
+# ----------------------------------------------------------------------------
+# "THE BEER-WARE LICENSE" (Revision 42):
+# <git@lerya.net> wrote this file. As long as you retain this notice you can
+# do whatever you want with this stuff. If we meet some day, and you think
+# this stuff is worth it, you can buy me a beer in return. Vincent Brillault
+# ----------------------------------------------------------------------------
+
+"""Single thread applying every mutation of the database, in batches"""
+
+import threading
+import time
+import Queue
+from warnings import warn
+
+from .database import (DBChangesHelper, DBFilesHelper, DBHashHelper,
+                       DBRootHelper)
+from .errorwarn import DBFailedMutation, DBWriterStopped
+
+# Mutations on a single path, a later one replaces an earlier one
+_REPLACEABLE = frozenset(['insert_file', 'update_file'])
+# Mutations on one or two single paths, given as first arguments
+_SINGLE = {'delete_single': 1, 'move_file': 2, 'hash_file': 1}
+# Mutations applied to the roots table
+_ROOTS = frozenset(['add_root', 'retire_root'])
+
+
+def _overlap(path, other):
+    """Check if a path is other, above or below it"""
+    return (path == other or path.startswith(other.rstrip('/') + '/') or
+            other.startswith(path.rstrip('/') + '/'))
+
+
+def coalesce_mutations(mutations):
+    """Merge the mutations that are overridden by a later one on the same
+    path, return the mutations to apply and the number of merged ones"""
+    result = []
+    # path -> index in result of the last replaceable mutation on this path
+    pending = {}
+    merged = 0
+    for (name, args) in mutations:
+        if name in _REPLACEABLE:
+            path = args[0]
+            try:
+                index = pending[path]
+            except KeyError:
+                pending[path] = len(result)
+                result.append((name, args))
+                continue
+            # An insert stays an insert, with the latest mtime
+            result[index] = (result[index][0], args)
+            merged += 1
+        elif name in _SINGLE:
+            for path in args[:_SINGLE[name]]:
+                pending.pop(path, None)
+            result.append((name, args))
+        else:
+            # Could touch any path
+            pending.clear()
+            result.append((name, args))
+    return (result, merged)
+
+
+class DBWriter(threading.Thread):
+    """Single thread applying every mutation of the database.
+
+    Producers call the mutation methods of DBFilesHelper on the writer, they
+    are queued, coalesced and applied in batched transactions. Reads done by
+    producers might not see the mutations still queued: flush() waits for
+    them to be committed."""
+
+    def __init__(self, database, batch_size=1000, on_commit=None):
+        super(DBWriter, self).__init__()
+        self._database = database
+        self.batch_size = batch_size
+        # Called after each commit
+        self._on_commit = on_commit
+        self._queue = Queue.Queue()
+        self._filedb = None
+        self._hashdb = None
+        self._changesdb = None
+        self._rootdb = None
+        # Trees deleted by chunks, path -> token of the current deletion
+        self._trees = {}
+        self._trees_cond = threading.Condition(threading.Lock())
+        self._stats_lock = threading.Lock()
+        self._stats = {'commits': 0,
+                       'mutations': 0,
+                       'coalesced': 0,
+                       'last_commit_latency': 0.0,
+                       'max_commit_latency': 0.0}
+
+    def _put(self, name, *args):
+        """Queue a mutation"""
+        self._queue.put((name, args))
+
+    def insert_file(self, path, mtime, size=None):
+        """Insert a new file"""
+        self._put('insert_file', path, mtime, size)
+
+    def insert_dir(self, path):
+        """Insert a new folder"""
+        self._put('insert_dir', path)
+
+    def insert_files(self, new_data):
+        """Insert a bunch of files"""
+        if len(new_data) != 0:
+            self._put('insert_files', new_data)
+
+    def insert_dirs(self, root, names):
+        """Insert a bunch of folders"""
+        if len(names) != 0:
+            self._put('insert_dirs', root, names)
+
+    def move_file(self, old_path, new_path):
+        """Move a file"""
+        self._put('move_file', old_path, new_path)
+
+    def move_dir(self, old_path, new_path):
+        """Move a folder"""
+        self._put('move_dir', old_path, new_path)
+
+    def update_file(self, path, mtime, size=None):
+        """Update the mtime information about a file"""
+        self._put('update_file', path, mtime, size)
+
+    def update_files(self, new_data):
+        """Update the mtime information about a bunch of files"""
+        if len(new_data) != 0:
+            self._put('update_files', new_data)
+
+    def delete_single(self, path):
+        """Delete a single file/folder"""
+        self._put('delete_single', path)
+
+    def delete_path(self, path):
+        """Delete the whole tree under a path"""
+        self._put('delete_path', path)
+
+    def delete_tree(self, path, chunk=10000, root=False):
+        """Delete the whole tree under a path, <chunk> rows per batch: the
+        other mutations are not delayed by a big tree. flush() does not wait
+        for the end of the deletion. If root, the retired root is removed
+        with the last chunk"""
+        token = object()
+        with self._trees_cond:
+            self._trees[path] = token
+        self._put('delete_tree', path, chunk, root, token)
+
+    def cancel_tree(self, path):
+        """Stop deleting the tree under path by chunks, the rows not deleted
+        yet are kept. Wait for the end of the deletions of the trees above
+        or below it"""
+        with self._trees_cond:
+            self._trees.pop(path, None)
+            while any(_overlap(path, other) for other in self._trees):
+                if not self.is_alive():
+                    raise DBWriterStopped('{} mutations left'.format(
+                        self.queue_depth()))
+                self._trees_cond.wait(1)
+
+    def add_root(self, path):
+        """Add a root, or add a retired one back"""
+        self._put('add_root', path)
+
+    def retire_root(self, path):
+        """Mark a root as removed until its files are deleted"""
+        self._put('retire_root', path)
+
+    def move_root(self, old_path, new_path):
+        """Rename a root and move its content, in the same transaction"""
+        self._put('move_root', old_path, new_path)
+
+    def delete_singles(self, root, names):
+        """Remove a bunch of outdated paths"""
+        if len(names) != 0:
+            self._put('delete_singles', root, names)
+
+    def delete_paths(self, root, names):
+        """Remove a bunch of outdated paths"""
+        if len(names) != 0:
+            self._put('delete_paths', root, names)
+
+    def hash_file(self, path, e2dk, crc, size=None):
+        """Insert a hash and link a path to it"""
+        self._put('hash_file', path, e2dk, crc, size)
+
+    def prune_changes(self, before):
+        """Delete the changes older than the timestamp <before> from the
+        change feed"""
+        self._put('prune_changes', before)
+
+    def flush(self):
+        """Wait until all the mutations queued before are committed, raise
+        DBWriterStopped if the writer thread is not running"""
+        done = threading.Event()
+        self._queue.put(('_flush', (done,)))
+        while not done.wait(1):
+            if not self.is_alive():
+                raise DBWriterStopped('{} mutations left'.format(
+                    self.queue_depth()))
+
+    def queue_depth(self):
+        """Number of mutations waiting to be applied"""
+        return self._queue.qsize()
+
+    def stats(self):
+        """Counters about the applied mutations and the commit latency"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self.queue_depth()
+        return stats
+
+    def _apply(self, name, args):
+        """Apply a single mutation"""
+        if name == 'hash_file':
+            (path, e2dk, crc, size) = args
+            rowid = self._hashdb.insert_hash(e2dk, crc, size)
+            self._filedb.link_to_hash(path, rowid)
+        elif name == 'delete_tree':
+            self._delete_tree(*args)
+        elif name in _ROOTS:
+            getattr(self._rootdb, name)(*args)
+        elif name == 'move_root':
+            self._rootdb.move_root(*args)
+            self._filedb.move_dir(*args)
+        elif name == 'prune_changes':
+            self._changesdb.prune(*args)
+        else:
+            getattr(self._filedb, name)(*args)
+
+    def _delete_tree(self, path, chunk, root, token):
+        """Delete a chunk of a tree, unless its deletion was cancelled"""
+        with self._trees_cond:
+            if self._trees.get(path) is not token:
+                return
+            done = True
+            try:
+                if self._filedb.delete_subtree_chunk(path, chunk) == chunk:
+                    # Continue in a later batch
+                    done = False
+                    self._put('delete_tree', path, chunk, root, token)
+                    return
+                self._filedb.delete_single(path)
+                if root:
+                    self._rootdb.remove_root(path)
+            finally:
+                if done:
+                    del self._trees[path]
+                    self._trees_cond.notify_all()
+
+    def _commit(self, mutations):
+        """Apply a batch of mutations in a single transaction"""
+        (mutations, merged) = coalesce_mutations(mutations)
+        start = time.time()
+        self._filedb.begin()
+        for (name, args) in mutations:
+            # Mutations run several statements, a failing one is undone
+            # entirely instead of being committed half-applied
+            self._filedb.savepoint('mutation')
+            try:
+                self._apply(name, args)
+            except Exception as err:  # pylint: disable=W0703
+                # Skip it, the thread must keep applying the others
+                self._filedb.rollback_to('mutation')
+                warn(DBFailedMutation('{}{}: {}'.format(name, args, err)))
+            else:
+                self._filedb.release('mutation')
+        self._filedb.commit()
+        latency = time.time() - start
+        with self._stats_lock:
+            self._stats['commits'] += 1
+            self._stats['mutations'] += len(mutations)
+            self._stats['coalesced'] += merged
+            self._stats['last_commit_latency'] = latency
+            self._stats['max_commit_latency'] = max(
+                latency, self._stats['max_commit_latency'])
+        if self._on_commit is not None:
+            self._on_commit()
+
+    def run(self):
+        """Wait for mutations, apply them in batches until stopped"""
+        self._hashdb = DBHashHelper(self._database)
+        self._filedb = DBFilesHelper(None, self._hashdb)
+        self._changesdb = DBChangesHelper(None, self._hashdb)
+        self._rootdb = DBRootHelper(None, self._hashdb)
+        end = False
+        # Chunked deletions queue themselves again, finish them before ending
+        while not end or not self._queue.empty():
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+            mutations = []
+            flushed = []
+            for (name, args) in batch:
+                if name == '_flush':
+                    flushed.append(args[0])
+                elif name == '_stop':
+                    end = True
+                else:
+                    mutations.append((name, args))
+            if len(mutations) != 0:
+                self._commit(mutations)
+            for done in flushed:
+                done.set()
+        self._hashdb.close()
+
+    def stop(self):
+        """Apply the queued mutations, stop the underlying thread, join it"""
+        self._queue.put(('_stop', ()))
+        self.join()
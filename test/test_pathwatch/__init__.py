@@ -1,8 +1,21 @@
 """PathWatch tests"""
 
-from .test_database import (TestDBRoot, TestDBFiles,
-                            TestDBHahes, TestDBFilesHahes)
+from .test_database import (TestDBConnectionManager, TestDBRoot, TestDBFiles,
+                            TestDBHahes, TestDBFilesHahes, TestDBChanges,
+                            TestDBDuplicates, TestDBLookup,
+                            TestDBDirStats)
 from .test_scanner import TestScanner
 from .test_scheduler import TestScheduler
-from .test_inotify_interface import TestInotifyWatch
+from .test_inotify_interface import TestInotifyWatch, TestNativeInotifyWatch
 from .test_hasher import TestHashes, TestHasher
+from .test_writer import TestCoalesce, TestDBWriter
+from .test_coalescer import TestCoalesceUpdates
+from .test_storm import TestStormDetector
+from .test_pathtrie import TestPathTrie
+from .test_budget import TestWatchBudget
+from .test_poller import TestMtimePoller, TestPollingWatch
+from .test_rootfd import TestRootFDs
+from .test_updatequeue import TestUpdateQueue
+from .test_subscriptions import TestDispatcher
+from .test_export import TestExport
+from .test_pathwatch import TestPathWatch
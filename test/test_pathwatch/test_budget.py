@@ -0,0 +1,76 @@
+"""Test if the watch budget is working as predicted or not"""
+
+import unittest
+
+from pathwatch.budget import WatchBudget
+
+
+class TestWatchBudget(unittest.TestCase):  # pylint: disable=R0904
+    """Test if the WatchBudget is working as predicted or not"""
+
+    def setUp(self):  # pylint: disable=C0103
+        """Create a budget of 3 watches"""
+        self.budget = WatchBudget(3)
+        self.budget.add_root('/r')
+        self.budget.watch(['/r'], 0)
+
+    def test_under_budget(self):
+        """Nothing is evicted under the budget"""
+        self.budget.watch(['/r/a', '/r/b'], 1)
+        self.assertEqual(3, len(self.budget))
+        self.assertListEqual([], self.budget.evict())
+
+    def test_evict_oldest(self):
+        """The least recently changed folders are evicted first"""
+        self.budget.watch(['/r/a', '/r/b'], 1)
+        self.budget.touch('/r/a', 2)
+        self.budget.watch(['/r/c', '/r/d'], 3)
+        self.assertListEqual(['/r/b', '/r/a'], self.budget.evict())
+        self.assertEqual(3, len(self.budget))
+        self.assertTrue('/r/c' in self.budget)
+        self.assertFalse('/r/a' in self.budget)
+
+    def test_root_pinned(self):
+        """Roots are never evicted"""
+        self.budget.watch(['/r/a', '/r/b', '/r/c'], 1)
+        self.assertListEqual(['/r/a'], self.budget.evict())
+        self.assertTrue('/r' in self.budget)
+
+    def test_touch_unwatched(self):
+        """Touching an unwatched folder does not watch it"""
+        self.budget.touch('/r/a', 1)
+        self.assertFalse('/r/a' in self.budget)
+
+    def test_move(self):
+        """Moved folders keep being watched under their new path"""
+        self.budget.watch(['/r/a', '/r/a/b'], 1)
+        self.budget.move('/r/a', '/r/c', 2)
+        self.assertFalse('/r/a' in self.budget)
+        self.assertTrue('/r/c' in self.budget)
+        self.assertTrue('/r/c/b' in self.budget)
+        self.budget.watch(['/r/d'], 3)
+        self.assertEqual(1, len(self.budget.evict()))
+        self.assertTrue('/r/d' in self.budget)
+
+    def test_remove(self):
+        """Removed folders are forgotten with their subfolders"""
+        self.budget.watch(['/r/a', '/r/a/b', '/r/ab'], 1)
+        self.budget.remove('/r/a')
+        self.assertEqual(2, len(self.budget))
+        self.assertTrue('/r/ab' in self.budget)
+        self.assertListEqual([], self.budget.evict())
+
+    def test_remove_root(self):
+        """Removed roots are forgotten with their subfolders"""
+        self.budget.watch(['/r/a', '/r/b', '/r/c'], 1)
+        self.budget.remove_root('/r')
+        self.assertEqual(0, len(self.budget))
+        self.assertListEqual([], self.budget.evict())
+
+    def test_move_root(self):
+        """Moved roots stay pinned"""
+        self.budget.watch(['/r/a'], 1)
+        self.budget.move_root('/r', '/s', 2)
+        self.assertTrue('/s/a' in self.budget)
+        self.budget.watch(['/s/b', '/s/c'], 3)
+        self.assertListEqual(['/s/a'], self.budget.evict())
@@ -0,0 +1,133 @@
+"""Test if the inotify updates are merged as predicted or not"""
+
+import unittest
+
+from pathwatch.coalescer import coalesce_updates
+
+
+class TestCoalesceUpdates(unittest.TestCase):  # pylint: disable=R0904
+    """Test if the inotify updates are merged as predicted or not"""
+
+    def _check(self, updates, expected):
+        """Helper: coalesce updates and compare with the expected ones"""
+        self.assertListEqual(expected, coalesce_updates(updates))
+
+    def test_empty(self):
+        """Nothing to merge"""
+        self._check([], [])
+
+    def test_modified_modified(self):
+        """Only one modified is kept"""
+        self._check([('modified', '/a'),
+                     ('modified', '/b'),
+                     ('modified', '/a')],
+                    [('modified', '/b'),
+                     ('modified', '/a')])
+
+    def test_create_delete(self):
+        """A file created then deleted only needs the deletion"""
+        self._check([('modified', '/a'),
+                     ('remove_file', '/a')],
+                    [('remove_file', '/a')])
+
+    def test_delete_create(self):
+        """A file deleted then created needs both"""
+        updates = [('remove_file', '/a'),
+                   ('modified', '/a')]
+        self._check(updates, updates)
+
+    def test_new_dir_remove(self):
+        """A folder created then deleted only needs the deletion"""
+        self._check([('new_dir', '/a'),
+                     ('new_dir', '/a'),
+                     ('remove_dir', '/a')],
+                    [('remove_dir', '/a')])
+
+    def test_modified_move(self):
+        """A file modified then moved is scanned at its new place"""
+        self._check([('modified', '/a'),
+                     ('move_file', '/a', '/b')],
+                    [('move_file', '/a', '/b'),
+                     ('modified', '/b')])
+
+    def test_move_overwrite(self):
+        """A file overwritten by a move does not need to be scanned"""
+        self._check([('modified', '/b'),
+                     ('move_file', '/a', '/b')],
+                    [('move_file', '/a', '/b')])
+
+    def test_move_chain(self):
+        """Chained moves are merged"""
+        self._check([('move_file', '/a', '/b'),
+                     ('modified', '/c'),
+                     ('move_file', '/b', '/c')],
+                    [('move_file', '/a', '/c')])
+
+    def test_move_chain_origin_modified(self):
+        """A chain is not merged once its origin was modified"""
+        updates = [('move_file', '/a', '/b'),
+                   ('modified', '/a'),
+                   ('move_file', '/b', '/c')]
+        self._check(updates, updates)
+
+    def test_move_chain_origin_removed(self):
+        """A chain is not merged once its origin was removed"""
+        updates = [('move_file', '/a', '/b'),
+                   ('remove_file', '/a'),
+                   ('move_file', '/b', '/c')]
+        self._check(updates, updates)
+
+    def test_move_chain_origin_overwritten(self):
+        """A chain is not merged once another file was moved to its
+        origin"""
+        updates = [('move_file', '/a', '/b'),
+                   ('move_file', '/c', '/a'),
+                   ('move_file', '/b', '/d')]
+        self._check(updates, updates)
+
+    def test_move_chain_origin_folder_removed(self):
+        """A chain is not merged once the folder of its origin was
+        removed"""
+        updates = [('move_file', '/a/f', '/b'),
+                   ('remove_dir', '/a'),
+                   ('move_file', '/b', '/c')]
+        self._check(updates, updates)
+
+    def test_move_back(self):
+        """A file moved back to its origin does not move"""
+        self._check([('move_file', '/a', '/b'),
+                     ('move_file', '/b', '/a')],
+                    [])
+
+    def test_move_dir_chain(self):
+        """Consecutive folder moves are merged"""
+        self._check([('move_dir', '/a', '/b'),
+                     ('move_dir', '/b', '/c')],
+                    [('move_dir', '/a', '/c')])
+
+    def test_new_dir_move(self):
+        """A folder created then moved is scanned at its new place"""
+        self._check([('new_dir', '/a'),
+                     ('modified', '/a/b'),
+                     ('modified', '/c'),
+                     ('move_dir', '/a', '/d')],
+                    [('modified', '/c'),
+                     ('move_dir', '/a', '/d'),
+                     ('new_dir', '/d'),
+                     ('modified', '/d/b')])
+
+    def test_move_dir_barrier(self):
+        """Updates are not merged across a folder move"""
+        self._check([('modified', '/a/b'),
+                     ('move_dir', '/a', '/c'),
+                     ('modified', '/a/b')],
+                    [('move_dir', '/a', '/c'),
+                     ('modified', '/c/b'),
+                     ('modified', '/a/b')])
+
+    def test_die(self):
+        """Unknown updates are kept in order"""
+        updates = [('modified', '/a'),
+                   ('DIE', 'reason'),
+                   ('modified', '/a')]
+        self._check(updates, updates)
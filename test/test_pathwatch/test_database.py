@@ -1,12 +1,77 @@
 """Test if the database helper are working as predicted or not"""
 
-from pathwatch.database import DBRootHelper, DBFilesHelper, DBHashHelper
+from pathwatch.database import (DBRootHelper, DBFilesHelper, DBHashHelper,
+                                 DBChangesHelper, DBQueryHelper,
+                                 DBConnectionManager)
+from pathwatch.errorwarn import DBChangesPruned
 
 import os.path
+import random
 import re
+import shutil
+import sqlite3
+import tempfile
+import time
 import unittest
 
 
+class TestDBConnectionManager(unittest.TestCase):  # pylint: disable=R0904
+    """Test if the DBConnectionManager is working as predicted or not"""
+
+    def setUp(self):  # pylint: disable=C0103
+        """Create a manager on a temporary database"""
+        self.tempdir = tempfile.mkdtemp()
+        self._manager = DBConnectionManager(os.path.join(self.tempdir, 'db'),
+                                            pool_size=1)
+
+    def tearDown(self):  # pylint: disable=C0103
+        """Close the manager, delete the temporary database"""
+        self._manager.close()
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_wal(self):
+        """Connections should be in WAL mode"""
+        con = self._manager.acquire()
+        mode = con.execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual('wal', mode.lower())
+        self._manager.release(con)
+
+    def test_pool(self):
+        """Released connections should be reused, up to the pool size"""
+        con_1 = self._manager.acquire()
+        con_2 = self._manager.acquire()
+        self.assertIsNot(con_1, con_2)
+        self._manager.release(con_1)
+        self._manager.release(con_2)
+        self.assertIs(con_1, self._manager.acquire())
+        self.assertIsNot(con_2, self._manager.acquire())
+
+    def test_memory_not_pooled(self):
+        """In-memory databases should never be shared"""
+        manager = DBConnectionManager(':memory:')
+        con = manager.acquire()
+        manager.release(con)
+        self.assertIsNot(con, manager.acquire())
+
+    def test_reader_does_not_block(self):
+        """A writer should commit while a reader is in a transaction"""
+        writer = self._manager.acquire()
+        reader = self._manager.acquire()
+        writer.execute('CREATE TABLE test (value INTEGER)')
+        writer.execute('INSERT INTO test VALUES (1)')
+        reader.execute('BEGIN')
+        self.assertEqual(1, reader.execute('SELECT COUNT(*) FROM test')
+                         .fetchone()[0])
+        writer.execute('INSERT INTO test VALUES (2)')
+        self.assertEqual(1, reader.execute('SELECT COUNT(*) FROM test')
+                         .fetchone()[0])
+        reader.execute('COMMIT')
+        self.assertEqual(2, reader.execute('SELECT COUNT(*) FROM test')
+                         .fetchone()[0])
+        self._manager.release(reader)
+        self._manager.release(writer)
+
+
 class TestDBRoot(unittest.TestCase):  # pylint: disable=R0904
     """Test if the DBRootHelper is working as predicted or not"""
 
@@ -40,6 +105,35 @@ class TestDBRoot(unittest.TestCase):  # pylint: disable=R0904
         self.assertTrue(self._db.is_root("/b"))
         self.assertFalse(self._db.is_root("/c"))
 
+    def test_move_root(self):
+        """Try to rename a root"""
+        self._db.add_root("/a")
+        self._db.move_root("/a", "/b")
+        self.expected_roots.append("/b")
+        self.assertFalse(self._db.is_root("/a"))
+
+    def test_remove_root(self):
+        """Try to remove a root"""
+        self._db.add_root("/a")
+        self._db.add_root("/b")
+        self.expected_roots.append("/b")
+        self._db.remove_root("/a")
+        self.assertFalse(self._db.is_root("/a"))
+
+    def test_retire_root(self):
+        """A retired root is listed apart until removed, or added back"""
+        self._db.add_root("/a")
+        self._db.add_root("/b")
+        self._db.retire_root("/a")
+        self._db.retire_root("/b")
+        self.assertFalse(self._db.is_root("/a"))
+        self.assertListEqual(["/a", "/b"],
+                             sorted(self._db.list_retired_roots()))
+        self._db.add_root("/a")
+        self.expected_roots.append("/a")
+        self._db.remove_root("/b")
+        self.assertListEqual([], self._db.list_retired_roots())
+
 
 class TestDBFiles(unittest.TestCase):  # pylint: disable=R0904
     """Test if the DBFilesHelper is working as predicted or not"""
@@ -87,6 +181,29 @@ class TestDBFiles(unittest.TestCase):  # pylint: disable=R0904
         self._db.move_file(path_1, path_2)
         self._expected_move(path_1, path_2, path_1)
 
+    def test_move_file_over(self):
+        """Move single file over another one"""
+        path_1 = "/home/a"
+        path_2 = "/home/b"
+        self._insert_file(path_1, 42)
+        self._insert_file(path_2, 43)
+        self._db.move_file(path_1, path_2)
+        del self.expected_db[path_2]
+        self._expected_move(path_1, path_2, path_1)
+
+    def test_move_folder_over(self):
+        """Move a folder over an empty one"""
+        dir_1 = "/home/a"
+        dir_2 = "/home/b"
+        filename = os.path.join(dir_1, 'a')
+        self._insert_dir(dir_1)
+        self._insert_file(filename, 42)
+        self._insert_dir(dir_2)
+        self._db.move_dir(dir_1, dir_2)
+        del self.expected_db[dir_2]
+        self._expected_move(dir_1, dir_2, dir_1)
+        self._expected_move(dir_1, dir_2, filename)
+
     def test_move_simple_folder(self):
         """Move a folder containing a file"""
         dir_1 = "/home/a"
@@ -124,6 +241,70 @@ class TestDBFiles(unittest.TestCase):  # pylint: disable=R0904
         self._expected_move(base_dir, new_dir, second_file)
         self._expected_move(base_dir, new_dir, third_file)
 
+    def test_move_keep_siblings(self):
+        """Move a folder, siblings sharing its prefix should not move"""
+        dir_1 = "/home/a"
+        dir_2 = "/home/b"
+        filename = os.path.join(dir_1, 'a')
+        self._insert_dir(dir_1)
+        self._insert_file(filename, 42)
+        self._insert_dir("/home/ab")
+        self._insert_file("/home/ab/a", 43)
+        self._insert_file("/home/a-b/a", 44)
+        self._db.move_dir(dir_1, dir_2)
+        self._expected_move(dir_1, dir_2, dir_1)
+        self._expected_move(dir_1, dir_2, filename)
+
+    def test_move_inner_match(self):
+        """Move a folder whose name appears again deeper in its tree"""
+        dir_1 = "/home/a"
+        dir_2 = "/home/b"
+        inner_dir = os.path.join(dir_1, 'home', 'a')
+        filename = os.path.join(inner_dir, 'a')
+        self._insert_dir(dir_1)
+        self._insert_dir(inner_dir)
+        self._insert_file(filename, 42)
+        self._db.move_dir(dir_1, dir_2)
+        self._expected_move('^' + dir_1, dir_2, dir_1)
+        self._expected_move('^' + dir_1, dir_2, inner_dir)
+        self._expected_move('^' + dir_1, dir_2, filename)
+
+    def test_delete_path(self):
+        """Delete a tree, siblings sharing its prefix should be kept"""
+        self._db.insert_dir("/home/a")
+        self._db.insert_file("/home/a/a", 42)
+        self._db.insert_dir("/home/a/b")
+        self._db.insert_file("/home/a/b/c", 42)
+        self._insert_dir("/home/ab")
+        self._insert_file("/home/ab/a", 43)
+        self._insert_file("/home/a-b/a", 44)
+        self._db.delete_path("/home/a")
+
+    def test_delete_paths(self):
+        """Delete a bunch of trees from the same parent"""
+        self._insert_dir("/home")
+        self._db.insert_dir("/home/a")
+        self._db.insert_file("/home/a/a", 42)
+        self._db.insert_dir("/home/b")
+        self._db.insert_file("/home/b/b/c", 42)
+        self._insert_dir("/home/c")
+        self._insert_file("/home/c/a", 43)
+        self._db.delete_paths("/home", set(['a', 'b']))
+
+    def test_delete_subtree_chunk(self):
+        """Delete a tree by chunks, siblings sharing its prefix should be
+        kept"""
+        self._insert_dir("/home/a")
+        for name in range(5):
+            self._db.insert_file("/home/a/{}".format(name), 42)
+        self._db.insert_dir("/home/a/b")
+        self._db.insert_file("/home/a/b/c", 42)
+        self._insert_file("/home/ab/a", 43)
+        self.assertEqual(3, self._db.delete_subtree_chunk("/home/a", 3))
+        self.assertEqual(3, self._db.delete_subtree_chunk("/home/a", 3))
+        self.assertEqual(1, self._db.delete_subtree_chunk("/home/a", 3))
+        self.assertEqual(0, self._db.delete_subtree_chunk("/home/a", 3))
+
     # TODO: test all the functions
 
 
@@ -242,3 +423,425 @@ class TestDBFilesHahes(unittest.TestCase):  # pylint: disable=R0904
         self.assertEqual(worked, 1)
         self.expected_links[path_3] = id_2
         self.expected_unlinked.remove(path_3)
+
+
+class TestDBChanges(unittest.TestCase):  # pylint: disable=R0904
+    """Test if the change feed is working as predicted or not"""
+
+    def setUp(self):  # pylint: disable=C0103
+        """Create an in-memory database"""
+        self._filedb = DBFilesHelper(':memory:')
+        self._changes = DBChangesHelper(None, self._filedb)
+
+    def tearDown(self):  # pylint: disable=C0103
+        """Delete the in-memory database"""
+        self._filedb.close()
+
+    def _ops(self, seq=0):
+        """Changes following seq, without their sequence numbers"""
+        return [change[1:] for change in self._changes.changes_since(seq)]
+
+    def test_empty(self):
+        """No changes yet"""
+        self.assertEqual(0, self._changes.last_seq())
+        self.assertListEqual([], self._changes.changes_since(0))
+
+    def test_mutations(self):
+        """Each mutation is logged, in order"""
+        self._filedb.insert_dir('/a')
+        self._filedb.insert_files([(42, '/a', 'f', 1)])
+        self._filedb.update_file('/a/f', 43)
+        self._filedb.link_to_hash('/a/f', 7)
+        self._filedb.move_dir('/a', '/b')
+        self._filedb.delete_path('/b')
+        self.assertListEqual([('insert', '/a', None, 0, None),
+                              ('insert', '/a/f', None, 42, None),
+                              ('update', '/a/f', None, 43, None),
+                              ('hash', '/a/f', None, None, 7),
+                              ('move', '/a', '/b', None, None),
+                              ('delete', '/b', None, None, None)],
+                             self._ops())
+        self.assertEqual(6, self._changes.last_seq())
+
+    def test_missing(self):
+        """Mutations of missing paths are not logged"""
+        self._filedb.delete_single('/a')
+        self._filedb.move_file('/a', '/b')
+        self._filedb.link_to_hash('/a', 7)
+        self._filedb.insert_file('/b', 42)
+        self._filedb.update_files([(43, '/', 'a', 1), (43, '/', 'b', 1)])
+        self.assertListEqual([('insert', '/b', None, 42, None),
+                              ('update', '/b', None, 43, None)],
+                             self._ops())
+
+    def test_since(self):
+        """Only the changes following the cursor are read"""
+        self._filedb.insert_file('/a', 42)
+        cursor = self._changes.last_seq()
+        self._filedb.insert_file('/b', 42)
+        self.assertListEqual([('insert', '/b', None, 42, None)],
+                             self._ops(cursor))
+        self.assertEqual(1, len(self._changes.changes_since(0, limit=1)))
+
+    def test_prune(self):
+        """Old changes are pruned, their consumers are told"""
+        self._filedb.insert_file('/a', 42)
+        self._filedb.insert_file('/b', 42)
+        self.assertEqual(2, self._changes.prune(time.time() + 1))
+        self.assertEqual(0, self._changes.prune(time.time() + 1))
+        self.assertRaises(DBChangesPruned, self._changes.changes_since, 0)
+        self.assertListEqual([], self._ops(2))
+        self._filedb.insert_file('/c', 42)
+        self.assertRaises(DBChangesPruned, self._changes.changes_since, 1)
+        self.assertListEqual([('insert', '/c', None, 42, None)], self._ops(2))
+
+
+class TestDBDuplicates(unittest.TestCase):  # pylint: disable=R0904
+    """Test if the duplicate lookups of DBQueryHelper are working as
+    predicted or not"""
+
+    def setUp(self):  # pylint: disable=C0103
+        """Create an in-memory database, with two hashes of 10 and 100
+        bytes"""
+        self._filedb = DBFilesHelper(':memory:')
+        self._hashdb = DBHashHelper(None, self._filedb)
+        self._query = DBQueryHelper(None, self._filedb)
+        self.small = self._hashdb.insert_hash('12', '34', 10)
+        self.big = self._hashdb.insert_hash('56', '78', 100)
+
+    def tearDown(self):  # pylint: disable=C0103
+        """Delete the in-memory database"""
+        self._filedb.close()
+
+    def _link(self, identity, *paths):
+        """Insert files linked to a hash"""
+        for path in paths:
+            self._filedb.insert_file(path, 42)
+            self._filedb.link_to_hash(path, identity)
+
+    def test_paths(self):
+        """List the paths of a hash"""
+        self._link(self.small, '/a/1', '/b/1')
+        self.assertListEqual(['/a/1', '/b/1'],
+                             sorted(self._query.paths(self.small)))
+        self.assertListEqual([], self._query.paths(self.big))
+
+    def test_duplicates(self):
+        """Duplicated hashes come by decreasing wasted bytes"""
+        self._link(self.small, '/a/1', '/b/1', '/c/1')
+        self.assertListEqual([(self.small, 3, 10, 20)],
+                             self._query.duplicates())
+        self._link(self.big, '/a/2', '/b/2')
+        self.assertListEqual([(self.big, 2, 100, 100),
+                              (self.small, 3, 10, 20)],
+                             self._query.duplicates())
+        self.assertListEqual([(self.small, 3, 10, 20)],
+                             self._query.duplicates(1, 1))
+
+    def test_maintained(self):
+        """The copies follow updates, replacements, moves and deletions"""
+        self._link(self.small, '/a/1', '/a/2', '/b/1', '/b/2', '/b/3')
+        self._filedb.update_file('/a/1', 43)
+        self._filedb.insert_file('/a/2', 43)
+        self._filedb.move_file('/a/1', '/b/1')
+        self._filedb.move_dir('/b', '/c')
+        self.assertListEqual([(self.small, 2, 10, 10)],
+                             self._query.duplicates())
+        self._filedb.link_to_hash('/c/2', self.big)
+        self.assertListEqual([], self._query.duplicates())
+        self._filedb.delete_path('/c')
+        self._link(self.small, '/d/1', '/d/2')
+        self.assertListEqual([(self.small, 2, 10, 10)],
+                             self._query.duplicates())
+
+    def test_duplicates_below(self):
+        """Only the copies under the path are listed, with copies anywhere"""
+        self._link(self.small, '/a/1', '/b/1')
+        self._link(self.big, '/a/2', '/a/3', '/ab/2')
+        self.assertDictEqual({self.small: ['/a/1'],
+                              self.big: ['/a/2', '/a/3']},
+                             self._query.duplicates_below('/a'))
+        self.assertDictEqual({self.big: ['/ab/2']},
+                             self._query.duplicates_below('/ab'))
+
+    def test_upgrade(self):
+        """The copies of a database created by an older version are
+        counted"""
+        tempdir = tempfile.mkdtemp()
+        database = os.path.join(tempdir, 'database')
+        con = sqlite3.connect(database)
+        con.execute('CREATE TABLE hashes (id INTEGER PRIMARY KEY,'
+                    ' crc TEXT NOT NULL, e2dk TEXT NOT NULL,'
+                    ' content INTEGER, upstream INTEGER,'
+                    ' UNIQUE (crc, e2dk))')
+        con.execute('CREATE TABLE files (parent TEXT NOT NULL,'
+                    ' name TEXT NOT NULL, mtime INTEGER,'
+                    ' identity INTEGER REFERENCES hashes (id),'
+                    ' PRIMARY KEY (parent, name))')
+        con.execute("INSERT INTO hashes (id, crc, e2dk) VALUES (1, '1', '2')")
+        con.executemany("INSERT INTO files VALUES ('/', ?, 42, 1)",
+                        [('a',), ('b',)])
+        con.commit()
+        con.close()
+        query = DBQueryHelper(database)
+        self.assertListEqual([(1, 2, None, None)], query.duplicates())
+        hashdb = DBHashHelper(None, query)
+        hashdb.insert_hash('2', '1', 10)
+        self.assertListEqual([(1, 2, 10, 10)], query.duplicates())
+        query.close()
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+
+class TestDBLookup(unittest.TestCase):  # pylint: disable=R0904
+    """Test if the hash lookups of DBQueryHelper are working as predicted or
+    not"""
+
+    def setUp(self):  # pylint: disable=C0103
+        """Create an in-memory database, with files of three hashes, two of
+        them sharing their CRC"""
+        self._filedb = DBFilesHelper(':memory:')
+        hashdb = DBHashHelper(None, self._filedb)
+        self._query = DBQueryHelper(None, self._filedb)
+        for (path, e2dk, crc) in (('/a', 'aa', '11'), ('/b', 'aa', '11'),
+                                  ('/c', 'bb', '11'), ('/d', 'cc', '22')):
+            self._filedb.insert_file(path, 42)
+            self._filedb.link_to_hash(path, hashdb.insert_hash(e2dk, crc))
+
+    def tearDown(self):  # pylint: disable=C0103
+        """Delete the in-memory database"""
+        self._filedb.close()
+
+    def test_lookup(self):
+        """Look up by e2dk, CRC or both"""
+        self.assertListEqual(['/a', '/b'], sorted(self._query.lookup('aa')))
+        self.assertListEqual(['/a', '/b', '/c'],
+                             sorted(self._query.lookup(crc='11')))
+        self.assertListEqual(['/c'], self._query.lookup('BB', '11'))
+        self.assertListEqual([], self._query.lookup('bb', '22'))
+        self.assertListEqual([], self._query.lookup('dd'))
+
+    def test_lookup_many(self):
+        """Look up many hashes at once"""
+        keys = [('aa', None), (None, '22'), ('cc', '22'), ('bb', '33')]
+        keys += [('{:032x}'.format(i), None) for i in range(1000)]
+        result = self._query.lookup_many(keys)
+        self.assertEqual(len(keys), len(result))
+        self.assertListEqual(['/a', '/b'], sorted(result[('aa', None)]))
+        self.assertListEqual(['/d'], result[(None, '22')])
+        self.assertListEqual(['/d'], result[('cc', '22')])
+        self.assertListEqual([], result[('bb', '33')])
+        self.assertListEqual([], result[('{:032x}'.format(999), None)])
+
+
+class TestDBDirStats(unittest.TestCase):  # pylint: disable=R0904
+    """Test if the folder statistics are working as predicted or not"""
+
+    def setUp(self):  # pylint: disable=C0103
+        """Create an in-memory database with a /r root"""
+        self._filedb = DBFilesHelper(':memory:')
+        self._hashdb = DBHashHelper(None, self._filedb)
+        self._query = DBQueryHelper(None, self._filedb)
+        self._filedb.insert_dir('/r')
+
+    def tearDown(self):  # pylint: disable=C0103
+        """Check the statistics against a rebuild, delete the database"""
+        stats = self._all_stats()
+        self._filedb.rebuild_stats()
+        self.assertListEqual(self._all_stats(), stats)
+        self._filedb.close()
+
+    def _all_stats(self):
+        """Statistics of every folder"""
+        # pylint: disable=W0212
+        self._filedb._cursor.execute('SELECT * FROM dirstats ORDER BY path')
+        return self._filedb._cursor.fetchall()
+
+    def _link(self, path, content):
+        """Link a path to the hash of a content of 10 bytes"""
+        self._filedb.link_to_hash(path, self._hashdb.insert_hash(
+            str(content), str(content), 10))
+
+    def test_counts(self):
+        """Files are counted in their folder and its ancestors"""
+        self._filedb.insert_dir('/r/a')
+        self._filedb.insert_dir('/r/a/b')
+        self._filedb.insert_file('/r/f', 42, 1)
+        self._filedb.insert_files([(42, '/r/a/b', 'f', 10),
+                                   (42, '/r/a/b', 'g', 100)])
+        self.assertEqual((3, 111, 3, 0), self._query.dir_stats('/r'))
+        self.assertEqual((2, 110, 2, 0), self._query.dir_stats('/r/a/'))
+        self._filedb.update_file('/r/a/b/f', 43, 20)
+        self._link('/r/f', 1)
+        self.assertEqual((3, 121, 2, 0), self._query.dir_stats('/r'))
+        self.assertIsNone(self._query.dir_stats('/r/f'))
+        self.assertIsNone(self._query.dir_stats('/x'))
+
+    def test_duplicates(self):
+        """Both copies of a content count as duplicate bytes"""
+        self._filedb.insert_dir('/r/a')
+        self._filedb.insert_dir('/r/b')
+        self._filedb.insert_file('/r/a/f', 42, 10)
+        self._filedb.insert_file('/r/b/f', 42, 10)
+        self._filedb.insert_file('/r/b/g', 42, 10)
+        self._link('/r/a/f', 1)
+        self.assertEqual((3, 30, 2, 0), self._query.dir_stats('/r'))
+        self._link('/r/b/f', 1)
+        self.assertEqual((1, 10, 0, 10), self._query.dir_stats('/r/a'))
+        self.assertEqual((3, 30, 1, 20), self._query.dir_stats('/r'))
+        self._link('/r/b/g', 1)
+        self.assertEqual((3, 30, 0, 30), self._query.dir_stats('/r'))
+        self._filedb.delete_single('/r/b/g')
+        self._filedb.update_file('/r/b/f', 43, 10)
+        self.assertEqual((1, 10, 0, 0), self._query.dir_stats('/r/a'))
+        self.assertEqual((2, 20, 1, 0), self._query.dir_stats('/r'))
+
+    def test_move(self):
+        """Moved files and folders carry their statistics"""
+        self._filedb.insert_dir('/r/a')
+        self._filedb.insert_dir('/r/a/b')
+        self._filedb.insert_dir('/r/c')
+        self._filedb.insert_file('/r/a/b/f', 42, 10)
+        self._filedb.move_dir('/r/a', '/r/c/a')
+        self.assertIsNone(self._query.dir_stats('/r/a'))
+        self.assertEqual((1, 10, 1, 0), self._query.dir_stats('/r/c/a/b'))
+        self.assertEqual((1, 10, 1, 0), self._query.dir_stats('/r/c'))
+        self._filedb.move_file('/r/c/a/b/f', '/r/f')
+        self.assertEqual((0, 0, 0, 0), self._query.dir_stats('/r/c'))
+        self.assertEqual((1, 10, 1, 0), self._query.dir_stats('/r'))
+
+    def test_delete(self):
+        """Deleted folders leave their ancestors"""
+        self._filedb.insert_dir('/r/a')
+        self._filedb.insert_dir('/r/a/b')
+        self._filedb.insert_files([(42, '/r/a/b', str(i), 1)
+                                   for i in range(10)])
+        self._filedb.insert_file('/r/f', 42, 5)
+        while self._filedb.delete_subtree_chunk('/r/a', 3) == 3:
+            pass
+        self._filedb.delete_single('/r/a')
+        self.assertIsNone(self._query.dir_stats('/r/a/b'))
+        self.assertEqual((1, 5, 1, 0), self._query.dir_stats('/r'))
+        self._filedb.delete_path('/r')
+        self.assertIsNone(self._query.dir_stats('/r'))
+
+    def test_transaction(self):
+        """In a transaction, the statistics are updated on commit"""
+        self._filedb.begin()
+        self._filedb.insert_file('/r/f', 42, 5)
+        self.assertEqual((0, 0, 0, 0), self._query.dir_stats('/r'))
+        self._filedb.commit()
+        self.assertEqual((1, 5, 1, 0), self._query.dir_stats('/r'))
+        # The changes of a deleted folder do not reach its new version
+        self._filedb.begin()
+        self._filedb.insert_dir('/r/a')
+        self._filedb.insert_file('/r/a/f', 42, 5)
+        self._filedb.delete_path('/r/a')
+        self._filedb.insert_dir('/r/a')
+        self._filedb.commit()
+        self.assertEqual((0, 0, 0, 0), self._query.dir_stats('/r/a'))
+        self.assertEqual((1, 5, 1, 0), self._query.dir_stats('/r'))
+
+    def test_random(self):
+        """Random mutations of a tree, in and out of transactions, keep the
+        statistics equal to a rebuild"""
+        rand = random.Random(42)
+        dirs = set(['/r'])
+        files = set()
+
+        def below(paths, root):
+            """Paths of the tree under root"""
+            return set(path for path in paths
+                       if path == root or path.startswith(root + '/'))
+
+        def moved(paths, src, dst):
+            """Paths once src moved over dst"""
+            paths = paths - below(paths, dst)
+            return set(dst + path[len(src):] if path in below(paths, src)
+                       else path for path in paths)
+
+        for step in range(1000):
+            if step % 100 == 0:
+                self._filedb.begin()
+            path = os.path.join(rand.choice(sorted(dirs)),
+                                str(rand.randrange(6)))
+            other = os.path.join(rand.choice(sorted(dirs)),
+                                 str(rand.randrange(6)))
+            operation = rand.randrange(8)
+            if path in dirs:
+                if operation < 2 and not (other == path or
+                                          other.startswith(path + '/') or
+                                          other in files):
+                    self._filedb.move_dir(path, other)
+                    dirs = moved(dirs, path, other)
+                    files = moved(files, path, other)
+                elif operation in (2, 3):
+                    if operation == 2:
+                        self._filedb.delete_path(path)
+                    else:
+                        while self._filedb.delete_subtree_chunk(path, 2) == 2:
+                            pass
+                        self._filedb.delete_single(path)
+                    dirs = dirs - below(dirs, path)
+                    files = files - below(files, path)
+            elif operation == 0 and path not in files:
+                self._filedb.insert_dir(path)
+                dirs.add(path)
+            elif operation in (1, 2):
+                self._filedb.insert_file(path, 42, rand.randrange(100))
+                files.add(path)
+            elif operation == 3:
+                self._filedb.update_file(path, 43, rand.randrange(100))
+                files.add(path)
+            elif operation in (4, 5) and path in files:
+                self._link(path, rand.randrange(1, 5))
+            elif operation == 6 and path in files and other not in dirs:
+                self._filedb.move_file(path, other)
+                files.remove(path)
+                files.add(other)
+            elif operation == 7:
+                self._filedb.delete_single(path)
+                files.discard(path)
+            if step % 100 == 49:
+                self._filedb.commit()
+        self.assertEqual(len(files), self._query.dir_stats('/r')[0])
+
+    def test_upgrade(self):
+        """The statistics of a database created by an older version are
+        computed"""
+        tempdir = tempfile.mkdtemp()
+        database = os.path.join(tempdir, 'database')
+        filedb = DBFilesHelper(database)
+        filedb.insert_dir('/a')
+        filedb.insert_file('/a/f', 42, 10)
+        filedb.close()
+        con = sqlite3.connect(database)
+        con.execute('DROP TABLE dirstats')
+        con.commit()
+        con.close()
+        query = DBQueryHelper(database)
+        self.assertEqual((1, 10, 1, 0), query.dir_stats('/a'))
+        query.close()
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+    def test_old_triggers(self):
+        """The triggers of an older version are replaced, the copies are
+        counted once"""
+        tempdir = tempfile.mkdtemp()
+        database = os.path.join(tempdir, 'database')
+        DBFilesHelper(database).close()
+        con = sqlite3.connect(database)
+        con.execute('CREATE TRIGGER files_copies_insert'
+                    ' AFTER INSERT ON files WHEN new.identity != 0'
+                    ' BEGIN UPDATE hashes SET copies = copies + 1'
+                    '  WHERE id = new.identity; END')
+        con.commit()
+        con.close()
+        filedb = DBFilesHelper(database)
+        query = DBQueryHelper(None, filedb)
+        identity = DBHashHelper(None, filedb).insert_hash('1', '2', 10)
+        filedb.insert_files([(42, '/', 'a', 10), (42, '/', 'b', 10)])
+        filedb.link_to_hash('/a', identity)
+        filedb.link_to_hash('/b', identity)
+        self.assertListEqual([(identity, 2, 10, 10)], query.duplicates())
+        filedb.close()
+        shutil.rmtree(tempdir, ignore_errors=True)
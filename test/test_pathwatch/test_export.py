@@ -0,0 +1,81 @@
+"""Test if the export is working as predicted or not"""
+
+import csv
+import json
+import os.path
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from pathwatch.database import DBFilesHelper, DBHashHelper, DBQueryHelper
+from pathwatch.export import ed2k_link, export
+
+
+class TestExport(unittest.TestCase):  # pylint: disable=R0904
+    """Test if the export is working as predicted or not"""
+
+    def setUp(self):  # pylint: disable=C0103
+        """Create a temporary database with a hashed and an unhashed file
+        under /a, and a file in a sibling folder"""
+        self.tempdir = tempfile.mkdtemp()
+        self.database = os.path.join(self.tempdir, 'database')
+        filedb = DBFilesHelper(self.database)
+        hashdb = DBHashHelper(None, filedb)
+        filedb.insert_dir('/a')
+        filedb.insert_dir('/a/b')
+        filedb.insert_file('/a/b/my file', 42, 1000)
+        filedb.link_to_hash('/a/b/my file',
+                            hashdb.insert_hash('0123abcd', '89ef', 1000))
+        filedb.insert_file('/a/c', 43, 10)
+        filedb.insert_file('/a-b/d', 44, 1)
+        filedb.close()
+
+    def tearDown(self):  # pylint: disable=C0103
+        """Delete the temporary database"""
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def _export(self, fmt, path='/a'):
+        """Export the files under path, return the number of files and the
+        lines written"""
+        output = StringIO()
+        count = export(self.database, path, output, fmt)
+        return (count, output.getvalue().splitlines())
+
+    def test_iter_files(self):
+        """Files under the path are listed in order, without folders"""
+        query = DBQueryHelper(self.database)
+        self.assertListEqual([('/a/c', 43, 10, None, None),
+                              ('/a/b/my file', 42, 1000, '0123abcd', '89ef')],
+                             list(query.iter_files('/a', batch_size=1)))
+        self.assertEqual(3, len(list(query.iter_files('/'))))
+        query.close()
+
+    def test_ed2k_link(self):
+        """Names are quoted, hashes upper-cased"""
+        self.assertEqual('ed2k://|file|my%20file|1000|0123ABCD|/',
+                         ed2k_link(u'/a/b/my file', 1000, u'0123abcd'))
+
+    def test_ed2k(self):
+        """Only the hashed files have a link"""
+        self.assertEqual((1, ['ed2k://|file|my%20file|1000|0123ABCD|/']),
+                         self._export('ed2k'))
+
+    def test_csv(self):
+        """A header, then a row per file"""
+        (count, lines) = self._export('csv')
+        self.assertEqual(2, count)
+        self.assertListEqual([['path', 'mtime', 'size', 'e2dk', 'crc'],
+                              ['/a/c', '43', '10', '', ''],
+                              ['/a/b/my file', '42', '1000', '0123abcd',
+                               '89ef']],
+                             list(csv.reader(lines)))
+
+    def test_json(self):
+        """A JSON object per file"""
+        (count, lines) = self._export('json', '/a/b')
+        self.assertEqual(1, count)
+        self.assertListEqual([{'path': '/a/b/my file', 'mtime': 42,
+                               'size': 1000, 'e2dk': '0123abcd',
+                               'crc': '89ef'}],
+                             [json.loads(line) for line in lines])
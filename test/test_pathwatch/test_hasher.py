@@ -36,7 +36,8 @@ class TestHashes(unittest.TestCase):
         """Try to hash a file with a small text inside"""
         with open(self.filename, 'w') as output:
             output.write("The quick brown fox jumps over the lazy dog")
-        (crc, e2dk) = _crc_and_e2dk(self.filename)
+        (crc, e2dk, size) = _crc_and_e2dk(self.filename)
+        self.assertEqual(size, 43)
         self.assertEqual(crc, '414fa339')
         self.assertEqual(e2dk, '1bee69a46ba811185c194762abaeae90')
 
@@ -44,7 +45,8 @@ class TestHashes(unittest.TestCase):
         """Try to hash a full e2dk block of 0"""
         with open(self.filename, 'w') as output:
             output.write('\0' * E2DK_BLOCK)
-        (crc, e2dk) = _crc_and_e2dk(self.filename)
+        (crc, e2dk, size) = _crc_and_e2dk(self.filename)
+        self.assertEqual(size, E2DK_BLOCK)
         self.assertEqual(crc, '3abc06ba')
         self.assertEqual(e2dk, 'd7def262a127cd79096a108e7a9fc138')
 
@@ -52,7 +54,8 @@ class TestHashes(unittest.TestCase):
         """Try to hash two full e2dk block of 0"""
         with open(self.filename, 'w') as output:
             output.write('\0' * (2 * E2DK_BLOCK))
-        (crc, e2dk) = _crc_and_e2dk(self.filename)
+        (crc, e2dk, size) = _crc_and_e2dk(self.filename)
+        self.assertEqual(size, 2 * E2DK_BLOCK)
         self.assertEqual(crc, 'adccde1a')
         self.assertEqual(e2dk, '194ee9e4fa79b2ee9f8829284c466051')
 
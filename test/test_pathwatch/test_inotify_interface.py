@@ -9,6 +9,7 @@ import Queue
 import os
 
 from pathwatch.inotify_interface import InotifyWatch
+from pathwatch.native_inotify import NativeInotifyWatch
 
 
 def stop_on_interrupt(fun):
@@ -27,10 +28,12 @@ def stop_on_interrupt(fun):
 class TestInotifyWatch(unittest.TestCase):  # pylint: disable=R0904
     """Test if InotifyWatch is working as predicted or not"""
 
+    WATCH = InotifyWatch
+
     def setUp(self):  # pylint: disable=C0103
         """Create a RemoveScheduler"""
         self.queue = Queue.Queue()
-        self.watch = InotifyWatch(self.queue)
+        self.watch = self.WATCH(self.queue)
         self.tempdir = tempfile.mkdtemp()
         self.watch.start()
 
@@ -197,3 +200,95 @@ class TestInotifyWatch(unittest.TestCase):  # pylint: disable=R0904
         time.sleep(6)
         self.assertFalse(self.queue.empty())
         self.assertEqual(('remove_dir', pos_1), self.queue.get())
+
+    @stop_on_interrupt
+    def test_move_many_files(self):
+        """Try to rename many files at once"""
+        names = [os.path.join(self.tempdir, str(i)) for i in xrange(100)]
+        for name in names:
+            with open(name, 'w') as new_file:
+                new_file.write('test')
+        self.watch.add(self.tempdir)
+        for name in names:
+            os.rename(name, name + '.new')
+        time.sleep(1)
+        for name in names:
+            self.assertFalse(self.queue.empty())
+            self.assertEqual(('move_file', name, name + '.new'),
+                             self.queue.get())
+
+    @stop_on_interrupt
+    def test_move_root(self):
+        """Try to move a root, then to create a file in it"""
+        root_1 = os.path.join(self.tempdir, 'root_1')
+        root_2 = os.path.join(self.tempdir, 'root_2')
+        os.makedirs(os.path.join(root_1, 'dir'))
+        self.watch.add(root_1)
+        os.rename(root_1, root_2)
+        time.sleep(1)
+        self.assertFalse(self.queue.empty())
+        self.assertEqual(('move_root', root_1, root_2), self.queue.get())
+        newfile = os.path.join(root_2, 'dir', 'file')
+        with open(newfile, 'w') as new_file:
+            new_file.write('test')
+        time.sleep(1)
+        self.assertFalse(self.queue.empty())
+        self.assertEqual(('modified', newfile), self.queue.get())
+
+    @stop_on_interrupt
+    def test_delete_root(self):
+        """Try to delete a root"""
+        root = os.path.join(self.tempdir, 'root')
+        os.mkdir(root)
+        self.watch.add(root)
+        os.rmdir(root)
+        # Noticed when the fd kept on the root is released
+        time.sleep(3)
+        self.assertFalse(self.queue.empty())
+        self.assertEqual('DIE', self.queue.get()[0])
+
+    @stop_on_interrupt
+    def test_movedir_then_create(self):
+        """Try to create a file in a dir moved inside the watched area"""
+        self.watch.add(self.tempdir)
+        pos_1 = os.path.join(self.tempdir, 'dir_1')
+        pos_2 = os.path.join(self.tempdir, 'dir_2')
+        os.mkdir(pos_1)
+        time.sleep(1)
+        self.assertEqual(('new_dir', pos_1), self.queue.get())
+        os.rename(pos_1, pos_2)
+        time.sleep(1)
+        self.assertEqual(('move_dir', pos_1, pos_2), self.queue.get())
+        newfile = os.path.join(pos_2, 'file')
+        with open(newfile, 'w') as new_file:
+            new_file.write('test')
+        time.sleep(1)
+        self.assertFalse(self.queue.empty())
+        self.assertEqual(('modified', newfile), self.queue.get())
+
+    @stop_on_interrupt
+    def test_move_between_roots(self):
+        """Try to move a dir to another root, then to create a file in it"""
+        root_1 = os.path.join(self.tempdir, 'root_1')
+        root_2 = os.path.join(self.tempdir, 'root_2')
+        pos_1 = os.path.join(root_1, 'dir')
+        pos_2 = os.path.join(root_2, 'dir')
+        os.makedirs(os.path.join(pos_1, 'sub'))
+        os.mkdir(root_2)
+        self.watch.add(root_1)
+        self.watch.add(root_2)
+        os.rename(pos_1, pos_2)
+        time.sleep(1)
+        self.assertEqual(('move_dir', pos_1, pos_2), self.queue.get())
+        newfile = os.path.join(pos_2, 'sub', 'file')
+        with open(newfile, 'w') as new_file:
+            new_file.write('test')
+        time.sleep(1)
+        self.assertFalse(self.queue.empty())
+        self.assertEqual(('modified', newfile), self.queue.get())
+
+
+class TestNativeInotifyWatch(TestInotifyWatch):  # pylint: disable=R0904
+    """Test if NativeInotifyWatch behaves as InotifyWatch"""
+
+    WATCH = NativeInotifyWatch
@@ -0,0 +1,61 @@
+"""Test if the PathTrie is working as predicted or not"""
+
+import unittest
+
+from pathwatch.pathtrie import PathTrie
+
+
+class TestPathTrie(unittest.TestCase):  # pylint: disable=R0904
+    """Test if the PathTrie is working as predicted or not"""
+
+    def setUp(self):  # pylint: disable=C0103
+        """Create a trie with a few entries"""
+        self.trie = PathTrie({'/a': 1, '/a/b': 2, '/a/b/c': 3, '/ab': 4,
+                              '/d/e': 5})
+
+    def test_mapping(self):
+        """Basic dict operations"""
+        self.assertEqual(5, len(self.trie))
+        self.assertEqual(2, self.trie['/a/b'])
+        self.assertTrue('/a/b' in self.trie)
+        self.assertFalse('/d' in self.trie)
+        self.assertRaises(KeyError, lambda: self.trie['/d'])
+        self.assertIsNone(self.trie.get('/a/b/c/d'))
+        self.trie['/a/b'] = 6
+        self.assertEqual(6, self.trie['/a/b'])
+        self.assertEqual(5, len(self.trie))
+        self.assertSetEqual(set(['/a', '/a/b', '/a/b/c', '/ab', '/d/e']),
+                            set(self.trie))
+
+    def test_delete(self):
+        """Deleting entries keeps the ones below"""
+        del self.trie['/a/b']
+        self.assertFalse('/a/b' in self.trie)
+        self.assertEqual(3, self.trie['/a/b/c'])
+        del self.trie['/a/b/c']
+        self.assertEqual(3, len(self.trie))
+        self.assertListEqual([], list(self.trie.iter_subtree('/a/b')))
+
+        def _delete(path):
+            """Helper: delete path from the trie"""
+            del self.trie[path]
+        self.assertRaises(KeyError, _delete, '/a/b')
+        self.assertRaises(KeyError, _delete, '/d')
+
+    def test_subtree(self):
+        """Only the paths below the given one are returned"""
+        self.assertSetEqual(set([('/a', 1), ('/a/b', 2), ('/a/b/c', 3)]),
+                            set(self.trie.iter_subtree('/a')))
+        self.assertSetEqual(set([('/d/e', 5)]),
+                            set(self.trie.iter_subtree('/d')))
+        self.assertListEqual([], list(self.trie.iter_subtree('/f')))
+
+    def test_longest_prefix(self):
+        """The deepest entry above a path is returned"""
+        self.assertEqual(('/a/b', 2), self.trie.longest_prefix('/a/b/d/e'))
+        self.assertEqual(('/a', 1), self.trie.longest_prefix('/a'))
+        self.assertEqual(('/ab', 4), self.trie.longest_prefix('/ab/c'))
+        self.assertIsNone(self.trie.longest_prefix('/abc'))
+        self.assertIsNone(self.trie.longest_prefix('/d'))
+        self.assertTrue(self.trie.contains_prefix('/d/e/f'))
+        self.assertFalse(self.trie.contains_prefix('/d/f'))
@@ -0,0 +1,152 @@
+"""Test if PathWatch is working as predicted or not"""
+
+from pathwatch.database import DBFilesHelper, DBRootHelper
+from pathwatch.errorwarn import InotifyTranscientPath, InvalidRoot
+from pathwatch.pathwatch import PathWatch
+
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+import warnings
+
+
+class TestPathWatch(unittest.TestCase):  # pylint: disable=R0904
+    """Test if PathWatch is working as predicted or not"""
+
+    def setUp(self):  # pylint: disable=C0103
+        """Create a root with a few folders, a watch crawling a folder per
+        iteration"""
+        self.tempdir = tempfile.mkdtemp()
+        self.database = os.path.join(self.tempdir, 'database')
+        self.root = os.path.join(self.tempdir, 'root')
+        self.expected = set([self.root])
+        for i in range(4):
+            folder = os.path.join(self.root, 'd{}'.format(i))
+            os.makedirs(folder)
+            self.expected.add(folder)
+            self._write(os.path.join(folder, 'f'))
+        self.watch = PathWatch(self.database, inotify_delay=0.1,
+                               coalesce_delay=0, crawl_chunk=1,
+                               delete_chunk=1, backend='native')
+
+    def tearDown(self):  # pylint: disable=C0103
+        """Stop the watch, delete the temporary folder"""
+        self.watch.stop()
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def _write(self, path):
+        """Write a file, expect it in the database"""
+        with open(path, 'w') as output:
+            output.write(path)
+        self.expected.add(path)
+
+    def _paths(self):
+        """Paths in the database"""
+        filedb = DBFilesHelper(self.database)
+        paths = set(filedb._get_full_content())  # pylint: disable=W0212
+        filedb.close()
+        return paths
+
+    def _wait(self, condition, timeout=10):
+        """Process the updates (if embedded) until condition is true"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if not self.watch.is_alive():
+                self.watch.process()
+            if condition():
+                return True
+            time.sleep(0.05)
+        return False
+
+    def _crawled(self):
+        """Check if the crawls are over and the database is expected"""
+        return (len(self.watch.crawl_progress()) == 0 and
+                self._paths() == self.expected)
+
+    def test_crawl(self):
+        """A root added once open is crawled in the background, the changes
+        made during the crawl are applied"""
+        self.watch.open()
+        self.watch.add_root(self.root)
+        self.watch.process()
+        self.assertDictEqual({self.root: 1}, self.watch.crawl_progress())
+        self._write(os.path.join(self.root, 'live'))
+        self._write(os.path.join(self.root, 'd0', 'live'))
+        self.assertTrue(self._wait(self._crawled))
+
+    def test_add_root_started(self):
+        """A root added once started is crawled by the thread"""
+        self.watch.start()
+        self.watch.add_root(self.root)
+        self.assertTrue(self._wait(self._crawled))
+        self._write(os.path.join(self.root, 'd3', 'live'))
+        self.assertTrue(self._wait(lambda: self._paths() == self.expected))
+
+    def test_add_root_invalid(self):
+        """Only folders can be roots, a root gone before being watched is
+        not stored and does not stop the watch"""
+        self.watch.start()
+        missing = os.path.join(self.tempdir, 'missing')
+        self.assertRaises(InvalidRoot, self.watch.add_root, missing)
+        self.assertRaises(InvalidRoot, self.watch.add_root, self.database)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            # Queued as add_root does, once the check passed
+            self.watch._inc_queue.put(  # pylint: disable=W0212
+                ('new_root', missing))
+            self.watch.add_root(self.root)
+            self.assertTrue(self._wait(self._crawled))
+        self.assertTrue(self.watch.is_alive())
+        self.assertIn(InotifyTranscientPath,
+                      [warning.category for warning in caught])
+        db_root = DBRootHelper(self.database)
+        self.assertListEqual([self.root], db_root.list_roots())
+        db_root.close()
+
+    def test_remove_add_root(self):
+        """A root added back while its content is deleted is crawled again
+        and watched, the deletion does not remove the new rows"""
+        self.watch.open()
+        self.watch.add_root(self.root)
+        self.assertTrue(self._wait(self._crawled))
+        self.watch.remove_root(self.root)
+        self.watch.add_root(self.root)
+        self.assertTrue(self._wait(self._crawled))
+        self._write(os.path.join(self.root, 'd2', 'live'))
+        self.assertTrue(self._wait(lambda: self._paths() == self.expected))
+        self.watch.remove_root(self.root)
+        self.expected = set()
+        self.assertTrue(self._wait(lambda: self._paths() == self.expected))
+        db_root = DBRootHelper(self.database)
+        self.assertListEqual([], db_root.list_roots())
+        self.assertListEqual([], db_root.list_retired_roots())
+        db_root.close()
+
+    def _mtime(self, path):
+        """mtime of a file in the database"""
+        filedb = DBFilesHelper(self.database)
+        row = filedb.get_path(path)
+        filedb.close()
+        return None if row is None else row[0]
+
+    def test_cold_folders(self):
+        """Above max_watches, folders are polled and files rewritten in place
+        are seen within file_poll_interval"""
+        path = os.path.join(self.root, 'd0', 'f')
+        os.utime(path, (1000, 1000))
+        self.watch = PathWatch(self.database, inotify_delay=0.1,
+                               coalesce_delay=0, backend='native',
+                               max_watches=1, poll_interval=0.1,
+                               file_poll_interval=0)
+        self.watch.start()
+        self.watch.add_root(self.root)
+        self.assertTrue(self._wait(self._crawled))
+        self.assertSetEqual(self.expected - set([self.root]) -
+                            set(os.path.join(folder, 'f')
+                                for folder in self.expected),
+                            set(self.watch.cold_folders()))
+        with open(path, 'w') as output:
+            output.write('rewritten')
+        self.assertTrue(self._wait(lambda: self._mtime(path) != 1000))
@@ -0,0 +1,318 @@
+"""Test if the MtimePoller is working as predicted or not"""
+
+import unittest
+import shutil
+import tempfile
+import time
+import Queue
+
+import os
+
+from pathwatch.poller import MtimePoller, PollingWatch
+
+
+class TestMtimePoller(unittest.TestCase):  # pylint: disable=R0904
+    """Test if the MtimePoller is working as predicted or not"""
+
+    def setUp(self):  # pylint: disable=C0103
+        """Create a poller (not started) and a folder"""
+        self.queue = Queue.Queue()
+        self.poller = MtimePoller(self.queue)
+        self.tempdir = tempfile.mkdtemp()
+        self.folder = os.path.join(self.tempdir, 'folder')
+        os.mkdir(self.folder)
+        os.utime(self.folder, (0, 0))
+
+    def tearDown(self):  # pylint: disable=C0103
+        """Remove the folder"""
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+        if not self.queue.empty():
+            self.fail("Too many messages: {0}".format(self.queue.get()))
+
+    def test_unchanged(self):
+        """Nothing is sent for unchanged folders"""
+        self.poller.add([self.folder])
+        self.poller.poll()
+        self.assertEqual(1, len(self.poller))
+
+    def test_changed(self):
+        """Changed folders are sent and forgotten"""
+        self.poller.add([self.folder])
+        open(os.path.join(self.folder, 'file'), 'w').close()
+        self.poller.poll()
+        self.assertEqual(('cold_dir', self.folder), self.queue.get())
+        self.assertEqual(0, len(self.poller))
+
+    def test_disappeared(self):
+        """Disappeared folders are forgotten silently"""
+        self.poller.add([self.folder])
+        os.rmdir(self.folder)
+        self.poller.poll()
+        self.assertEqual(0, len(self.poller))
+
+    def test_move(self):
+        """Moved folders are polled under their new path"""
+        self.poller.add([self.folder])
+        moved = os.path.join(self.tempdir, 'moved')
+        os.rename(self.folder, moved)
+        self.poller.move(self.folder, moved)
+        open(os.path.join(moved, 'file'), 'w').close()
+        self.poller.poll()
+        self.assertEqual(('cold_dir', moved), self.queue.get())
+
+    def test_remove(self):
+        """Removed folders are not polled anymore"""
+        self.poller.add([self.folder])
+        self.poller.remove(self.tempdir)
+        open(os.path.join(self.folder, 'file'), 'w').close()
+        self.poller.poll()
+        self.assertEqual(0, len(self.poller))
+
+    def test_discard(self):
+        """Discarded folders are not polled anymore, their subfolders are"""
+        self.poller.add([self.tempdir, self.folder])
+        self.poller.discard(self.tempdir)
+        self.assertListEqual([self.folder], self.poller.folders())
+        self.assertNotIn(self.tempdir, self.poller)
+        self.assertIn(self.folder, self.poller)
+
+    def test_files(self):
+        """Files rewritten in place are seen every file_interval seconds"""
+        path = os.path.join(self.folder, 'file')
+        open(path, 'w').close()
+        os.utime(path, (0, 0))
+        os.utime(self.folder, (0, 0))
+        self.poller = MtimePoller(self.queue, file_interval=0)
+        self.poller.add([self.folder])
+        self.poller.poll()
+        self.assertEqual(1, len(self.poller))
+        with open(path, 'w') as output:
+            output.write('rewritten')
+        self.poller.poll()
+        self.assertEqual(('cold_dir', self.folder), self.queue.get())
+        self.assertEqual(0, len(self.poller))
+
+    def test_files_interval(self):
+        """Files are not stated before file_interval seconds"""
+        path = os.path.join(self.folder, 'file')
+        open(path, 'w').close()
+        os.utime(self.folder, (0, 0))
+        self.poller.add([self.folder])
+        with open(path, 'w') as output:
+            output.write('rewritten')
+        self.poller.poll()
+        self.assertEqual(1, len(self.poller))
+
+
+class TestPollingWatch(unittest.TestCase):  # pylint: disable=R0904
+    """Test if the PollingWatch is working as predicted or not"""
+
+    def setUp(self):  # pylint: disable=C0103
+        """Create a watch (polls are triggered by hand, removals are not
+        delayed) on a folder"""
+        self.queue = Queue.Queue()
+        self.watch = PollingWatch(self.queue, delay=0)
+        self.tempdir = tempfile.mkdtemp()
+        self.file = os.path.join(self.tempdir, 'file')
+        with open(self.file, 'w') as new_file:
+            new_file.write('test')
+        os.utime(self.file, (0, 0))
+        self.folder = os.path.join(self.tempdir, 'folder')
+        os.mkdir(self.folder)
+        self.watch.add(self.tempdir)
+
+    def tearDown(self):  # pylint: disable=C0103
+        """Remove the folder"""
+        self.watch.stop()
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+        if not self.queue.empty():
+            self.fail("Too many messages: {0}".format(self.queue.get()))
+
+    def poll(self):
+        """Poll every watched folder once"""
+        for path in self.watch.watched(self.tempdir):
+            self.watch._poll(path)  # pylint: disable=W0212
+
+    def test_watched(self):
+        """Folders below the root are watched"""
+        self.assertListEqual(sorted([self.tempdir, self.folder]),
+                             sorted(self.watch.watched(self.tempdir)))
+        self.poll()
+
+    def test_create_file(self):
+        """Try to create a file"""
+        newfile = os.path.join(self.folder, 'new')
+        open(newfile, 'w').close()
+        self.poll()
+        self.assertEqual(('modified', newfile), self.queue.get())
+
+    def test_modify_file(self):
+        """Try to modify a file in place"""
+        with open(self.file, 'w') as new_file:
+            new_file.write('modified')
+        self.poll()
+        self.assertEqual(('modified', self.file), self.queue.get())
+
+    def test_remove_file(self):
+        """Try to remove a file"""
+        os.remove(self.file)
+        self.poll()
+        self.assertEqual(('remove_file', self.file), self.queue.get())
+
+    def test_move_file(self):
+        """Try to rename a file"""
+        moved = os.path.join(self.tempdir, 'moved')
+        os.rename(self.file, moved)
+        self.poll()
+        self.assertEqual(('move_file', self.file, moved), self.queue.get())
+
+    def test_create_dir(self):
+        """Try to create a dir containing a file"""
+        newdir = os.path.join(self.folder, 'new')
+        os.mkdir(newdir)
+        open(os.path.join(newdir, 'file'), 'w').close()
+        self.poll()
+        self.assertEqual(('new_dir', newdir), self.queue.get())
+        self.assertTrue(newdir in self.watch.watched(newdir))
+        self.poll()
+
+    def test_remove_dir(self):
+        """Try to remove a dir"""
+        os.rmdir(self.folder)
+        self.poll()
+        self.assertEqual(('remove_dir', self.folder), self.queue.get())
+        self.assertListEqual([self.tempdir],
+                             self.watch.watched(self.tempdir))
+
+    def test_move_dir(self):
+        """Try to rename a dir, then to create a file in it"""
+        moved = os.path.join(self.tempdir, 'moved')
+        os.rename(self.folder, moved)
+        self.poll()
+        self.assertEqual(('move_dir', self.folder, moved), self.queue.get())
+        newfile = os.path.join(moved, 'new')
+        open(newfile, 'w').close()
+        self.poll()
+        self.assertEqual(('modified', newfile), self.queue.get())
+
+    def test_move_file_away(self):
+        """Try to move a file to another folder, polled after its source"""
+        watch = PollingWatch(self.queue, delay=10)
+        watch.add(self.tempdir)
+        moved = os.path.join(self.folder, 'moved')
+        os.rename(self.file, moved)
+        watch._poll(self.tempdir)  # pylint: disable=W0212
+        self.assertTrue(self.queue.empty())
+        watch._poll(self.folder)  # pylint: disable=W0212
+        self.assertEqual(('move_file', self.file, moved), self.queue.get())
+
+    def test_move_file_before(self):
+        """Try to move a file to another folder, polled before its source"""
+        moved = os.path.join(self.folder, 'moved')
+        os.rename(self.file, moved)
+        self.watch._poll(self.folder)  # pylint: disable=W0212
+        self.assertEqual(('move_file', self.file, moved), self.queue.get())
+        self.watch._poll(self.tempdir)  # pylint: disable=W0212
+
+    def test_move_dir_away(self):
+        """Try to move a dir to another folder, then to create a file in
+        it"""
+        watch = PollingWatch(self.queue, delay=10)
+        watch.add(self.tempdir)
+        moved = os.path.join(self.tempdir, 'moved')
+        os.mkdir(moved)
+        watch._poll(self.tempdir)  # pylint: disable=W0212
+        self.assertEqual(('new_dir', moved), self.queue.get())
+        inner = os.path.join(moved, 'folder')
+        os.rename(self.folder, inner)
+        watch._poll(self.tempdir)  # pylint: disable=W0212
+        self.assertTrue(self.queue.empty())
+        watch._poll(moved)  # pylint: disable=W0212
+        self.assertEqual(('move_dir', self.folder, inner), self.queue.get())
+        self.assertEqual(('new_dir', inner), self.queue.get())
+        newfile = os.path.join(inner, 'new')
+        open(newfile, 'w').close()
+        watch._poll(inner)  # pylint: disable=W0212
+        self.assertEqual(('modified', newfile), self.queue.get())
+
+    def test_hard_link(self):
+        """A new hard link is not a move"""
+        linked = os.path.join(self.folder, 'linked')
+        os.link(self.file, linked)
+        self.watch._poll(self.folder)  # pylint: disable=W0212
+        self.assertEqual(('modified', linked), self.queue.get())
+        self.poll()
+
+    def test_hard_links(self):
+        """Hard links in the same folder are not paired by inode"""
+        linked = os.path.join(self.tempdir, 'linked')
+        os.link(self.file, linked)
+        self.poll()
+        self.assertEqual(('modified', linked), self.queue.get())
+        moved = os.path.join(self.tempdir, 'moved')
+        os.rename(self.file, moved)
+        os.remove(linked)
+        self.poll()
+        self.assertItemsEqual([('remove_file', self.file),
+                               ('remove_file', linked),
+                               ('modified', moved)],
+                              [self.queue.get() for _ in range(3)])
+
+    def test_unchanged_folder(self):
+        """The entries of a folder whose mtime did not change are only
+        listed every file_interval"""
+        os.utime(self.tempdir, (0, 0))
+        lazy = PollingWatch(self.queue, file_interval=3600)
+        lazy.add(self.tempdir, rec=False)
+        eager = PollingWatch(self.queue, file_interval=0)
+        eager.add(self.tempdir, rec=False)
+        with open(self.file, 'w') as new_file:
+            new_file.write('modified')
+        lazy._poll(self.tempdir)  # pylint: disable=W0212
+        self.assertTrue(self.queue.empty())
+        eager._poll(self.tempdir)  # pylint: disable=W0212
+        self.assertEqual(('modified', self.file), self.queue.get())
+        newfile = os.path.join(self.tempdir, 'new')
+        open(newfile, 'w').close()
+        lazy._poll(self.tempdir)  # pylint: disable=W0212
+        self.assertItemsEqual([('modified', self.file),
+                               ('modified', newfile)],
+                              [self.queue.get() for _ in range(2)])
+
+    def test_root_deleted(self):
+        """Try to delete the root"""
+        shutil.rmtree(self.tempdir)
+        self.watch._poll(self.tempdir)  # pylint: disable=W0212
+        self.assertEqual('DIE', self.queue.get()[0])
+
+    def test_move_root(self):
+        """Try to move the root, then to create a file in it"""
+        moved = self.tempdir + '.moved'
+        os.rename(self.tempdir, moved)
+        self.watch._poll(self.tempdir)  # pylint: disable=W0212
+        self.assertEqual(('move_root', self.tempdir, moved), self.queue.get())
+        self.tempdir = moved
+        newfile = os.path.join(moved, 'folder', 'new')
+        open(newfile, 'w').close()
+        self.poll()
+        self.assertEqual(('modified', newfile), self.queue.get())
+
+    def test_thread(self):
+        """Try to create a file with the thread running"""
+        watch = PollingWatch(self.queue, min_interval=0.1, max_interval=0.5)
+        watch.add(self.tempdir)
+        watch.start()
+        newfile = os.path.join(self.folder, 'new')
+        open(newfile, 'w').close()
+        time.sleep(1)
+        watch.stop()
+        self.assertEqual(('modified', newfile), self.queue.get())
+
+    def test_max_stats(self):
+        """Stat calls are rate limited"""
+        watch = PollingWatch(self.queue, max_stats=2)
+        start = time.time()
+        watch.add(self.tempdir)
+        for _ in range(3):
+            watch._poll(self.tempdir)  # pylint: disable=W0212
+        self.assertTrue(time.time() - start >= 3)
@@ -0,0 +1,54 @@
+"""Test if the root fds are working as predicted or not"""
+
+import unittest
+import shutil
+import tempfile
+
+import os
+
+from pathwatch.rootfd import RootFDs
+
+
+class TestRootFDs(unittest.TestCase):  # pylint: disable=R0904
+    """Test if the RootFDs are working as predicted or not"""
+
+    def setUp(self):  # pylint: disable=C0103
+        """Follow a root"""
+        self.tempdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tempdir, 'root')
+        os.mkdir(self.root)
+        self.fds = RootFDs()
+        self.fds.add(self.root)
+
+    def tearDown(self):  # pylint: disable=C0103
+        """Close the fds, remove the folder"""
+        self.fds.close()
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def _followed(self):
+        """Roots with an open fd"""
+        return sorted(self.fds._fds)  # pylint: disable=W0212
+
+    def test_moved(self):
+        """A moved root is kept, and found at its new path"""
+        moved = os.path.join(self.tempdir, 'moved')
+        os.rename(self.root, moved)
+        self.fds.release_deleted()
+        self.assertListEqual([self.root], self._followed())
+        self.assertEqual(moved, self.fds.moved(self.root))
+        self.assertListEqual([moved], self._followed())
+
+    def test_deleted(self):
+        """The fd of a deleted root is closed"""
+        self.fds.release_deleted()
+        self.assertListEqual([self.root], self._followed())
+        os.rmdir(self.root)
+        self.fds.release_deleted()
+        self.assertListEqual([], self._followed())
+        self.assertIsNone(self.fds.moved(self.root))
+
+    def test_remove(self):
+        """A removed root is not followed anymore"""
+        self.fds.remove(self.root)
+        self.fds.remove(self.root)
+        self.assertListEqual([], self._followed())
@@ -6,6 +6,7 @@ import shutil
 import tempfile
 import time
 
+from pathwatch.database import DBQueryHelper
 from pathwatch.scanner import Scanner
 
 
@@ -207,3 +208,61 @@ class TestScanner(unittest.TestCase):  # pylint: disable=R0904
         _create_file(file_name, database)
         self.scanner.scan(self.tempdir)
         self.assertDictEqual(database, _get_sql_content(self.scanner))
+
+    def test_size(self):
+        """The size of the files is recorded on insert and update"""
+        file_name = os.path.join(self.tempdir, 'a')
+        with open(file_name, 'w') as fff:
+            fff.write('abc')
+        self.scanner.scan(self.tempdir)
+        query = DBQueryHelper(None, self.scanner._db)  # pylint: disable=W0212
+        self.assertListEqual([3], [row[2] for row in
+                                   query.iter_files(self.tempdir)])
+        with open(file_name, 'w') as fff:
+            fff.write('abcdef')
+        os.utime(file_name, (time.time() + 10, time.time() + 10))
+        self.scanner.scan(self.tempdir)
+        self.assertListEqual([6], [row[2] for row in
+                                   query.iter_files(self.tempdir)])
+
+    def test_iter_scan(self):
+        """Scan a folder one folder at a time, get the new folders"""
+        database = {self.tempdir: 0}
+        dir_name_1 = os.path.join(self.tempdir, 'a')
+        dir_name_2 = os.path.join(dir_name_1, 'b')
+        _create_dir(dir_name_1, database)
+        _create_dir(dir_name_2, database)
+        new_dirs = list(self.scanner.iter_scan(self.tempdir))
+        self.assertListEqual([[dir_name_1], [dir_name_2], []], new_dirs)
+        self.assertDictEqual(database, _get_sql_content(self.scanner))
+        new_dirs = list(self.scanner.iter_scan(self.tempdir))
+        self.assertListEqual([[], [], []], new_dirs)
+        all_dirs = list(self.scanner.iter_scan(self.tempdir, all_dirs=True))
+        self.assertListEqual([[dir_name_1], [dir_name_2], []], all_dirs)
+
+    def test_scan_since(self):
+        """Rescan, only looking at what was modified after a given time"""
+        database = {self.tempdir: 0}
+        dir_name = os.path.join(self.tempdir, 'a')
+        file_name_1 = os.path.join(dir_name, 'b')
+        file_name_2 = os.path.join(dir_name, 'c')
+        _create_dir(dir_name, database)
+        _create_file(file_name_1, database)
+        self.scanner.scan(self.tempdir)
+        self.assertDictEqual(database, _get_sql_content(self.scanner))
+        since = database[file_name_1] + 100
+        # Modified after since, thus updated
+        os.utime(file_name_1, (since + 1, since + 1))
+        database[file_name_1] = since + 1
+        # In a folder not modified after since, thus ignored
+        with open(file_name_2, 'w') as fff:
+            fff.write('\n')
+        os.utime(dir_name, (since - 1, since - 1))
+        os.utime(self.tempdir, (since - 1, since - 1))
+        for _ in self.scanner.iter_scan(self.tempdir, since):
+            pass
+        self.assertDictEqual(database, _get_sql_content(self.scanner))
+        # Without since, everything is compared
+        database[file_name_2] = int(os.stat(file_name_2).st_mtime)
+        self.scanner.scan(self.tempdir)
+        self.assertDictEqual(database, _get_sql_content(self.scanner))
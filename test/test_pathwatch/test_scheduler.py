@@ -1,6 +1,7 @@
 """Test if the Scheduler is working as predicted or not"""
 
 import unittest
+import threading
 import time
 
 from pathwatch.scheduler import Scheduler
@@ -154,3 +155,71 @@ class TestScheduler(unittest.TestCase):  # pylint: disable=R0904
         self.assertTrue('test_twice' in self.dict)
         time.sleep(6)
         self.assertFalse('test_twice' in self.dict)
+
+    @stop_on_interrupt
+    def test_many_cancel(self):
+        """Verify that cancelled items are purged from the heap"""
+        for i in xrange(10000):
+            self.scheduler.add(5, i, self.remover.delete, 'noflag')
+        for i in xrange(10000):
+            self.scheduler.cancel(i)
+        self.assertEqual(0, len(self.scheduler))
+        self.assertTrue(len(self.scheduler._heap) <  # pylint: disable=W0212
+                        10000)
+        time.sleep(6)
+
+    @stop_on_interrupt
+    def test_many_expire(self):
+        """Verify that many items expiring together are all removed"""
+        for i in xrange(1000):
+            self.dict[i] = 'Not Working'
+            self.scheduler.add(1, i, self.remover.delete, i)
+        time.sleep(2)
+        self.assertEqual(0, len(self.scheduler))
+        for i in xrange(1000):
+            self.assertFalse(i in self.dict)
+
+    @stop_on_interrupt
+    def test_add_many(self):
+        """Verify that items added together are all removed"""
+        self.dict['test_add_many_1'] = 'Not Working'
+        self.dict['test_add_many_2'] = 'Not Working'
+        self.scheduler.add_many(5, [('test_1', self.remover.delete,
+                                     ('test_add_many_1',)),
+                                    ('test_2', self.remover.delete,
+                                     ('test_add_many_2',))])
+        self.assertTrue('test_add_many_1' in self.dict)
+        time.sleep(6)
+        self.assertFalse('test_add_many_1' in self.dict)
+        self.assertFalse('test_add_many_2' in self.dict)
+
+    @stop_on_interrupt
+    def test_add_many_present(self):
+        """Verify that add_many adds nothing if one item is present"""
+        self.dict['test_present'] = 'Not Working'
+        self.scheduler.add(5, 'test_1', self.remover.delete, 'test_present')
+        self.assertRaises(KeyError, self.scheduler.add_many, 5,
+                          [('test_2', self.remover.delete, ('noflag',)),
+                           ('test_1', self.remover.delete, ('noflag',))])
+        self.assertEqual(1, len(self.scheduler))
+        time.sleep(6)
+        self.assertFalse('test_present' in self.dict)
+
+    @stop_on_interrupt
+    def test_concurrent_add(self):
+        """Verify that items added from several threads are all removed"""
+        def add_range(start):
+            """Add 1000 items"""
+            for i in xrange(start, start + 1000):
+                self.dict[i] = 'Not Working'
+                self.scheduler.add(1, i, self.remover.delete, i)
+        threads = [threading.Thread(target=add_range, args=(i * 1000,))
+                   for i in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        time.sleep(2)
+        self.assertEqual(0, len(self.scheduler))
+        for i in xrange(4000):
+            self.assertFalse(i in self.dict)
@@ -0,0 +1,75 @@
+"""Test if the storm detection is working as predicted or not"""
+
+import unittest
+
+from pathwatch.storm import StormDetector
+
+
+class TestStormDetector(unittest.TestCase):  # pylint: disable=R0904
+    """Test if the StormDetector is working as predicted or not"""
+
+    def setUp(self):  # pylint: disable=C0103
+        """Create a detector with a low threshold"""
+        self.detector = StormDetector(threshold=3, window=1.0, calm=2.0)
+        self.detector.add_root('/r')
+
+    def test_no_storm(self):
+        """A few updates are kept"""
+        updates = [('modified', '/r/a/1'), ('modified', '/r/b/2')]
+        self.assertListEqual(updates, self.detector.filter(updates, 0))
+        self.assertIsNone(self.detector.timeout(0))
+        self.assertListEqual([], self.detector.calmed(10))
+
+    def test_outside_roots(self):
+        """Updates outside the roots are never dropped"""
+        updates = [('modified', '/o/{}'.format(i)) for i in range(10)]
+        self.assertListEqual(updates, self.detector.filter(updates, 0))
+
+    def test_storm(self):
+        """Updates in a storm are dropped until it calms down"""
+        updates = [('modified', '/r/a/b/{}'.format(i)) for i in range(5)]
+        self.assertListEqual(updates[:2], self.detector.filter(updates, 0))
+        self.assertEqual(2.0, self.detector.timeout(0))
+        self.assertListEqual([], self.detector.filter([updates[0]], 1))
+        self.assertListEqual([], self.detector.calmed(2))
+        self.assertListEqual(['/r/a/b'], self.detector.calmed(3))
+        self.assertIsNone(self.detector.timeout(3))
+        self.assertListEqual(updates[:1],
+                             self.detector.filter(updates[:1], 3))
+
+    def test_storm_subtree(self):
+        """The storm covers the deepest folder above the threshold"""
+        updates = [('modified', '/r/a/{}/c'.format(i)) for i in range(5)]
+        self.assertListEqual(updates[:2], self.detector.filter(updates, 0))
+        self.assertListEqual([('modified', '/r/b')],
+                             self.detector.filter([('modified', '/r/b')], 0))
+        self.assertListEqual(['/r/a'], self.detector.calmed(5))
+
+    def test_window(self):
+        """Updates spread over several windows are not a storm"""
+        for now in range(5):
+            update = ('modified', '/r/a/{}'.format(now))
+            self.assertListEqual([update],
+                                 self.detector.filter([update], now))
+
+    def test_moves(self):
+        """Moves leaving a storm also scan their destination"""
+        updates = [('modified', '/r/a/{}'.format(i)) for i in range(3)]
+        self.detector.filter(updates, 0)
+        self.assertListEqual([], self.detector.filter(
+            [('move_file', '/r/a/0', '/r/a/1')], 0))
+        self.assertListEqual([('move_file', '/r/b', '/r/a/1')],
+                             self.detector.filter(
+                                 [('move_file', '/r/b', '/r/a/1')], 0))
+        self.assertListEqual([('move_dir', '/r/a/0', '/r/c'),
+                              ('new_dir', '/r/c')],
+                             self.detector.filter(
+                                 [('move_dir', '/r/a/0', '/r/c')], 0))
+
+    def test_remove_root(self):
+        """Storms below a removed root are forgotten"""
+        updates = [('modified', '/r/a/{}'.format(i)) for i in range(5)]
+        self.detector.filter(updates, 0)
+        self.detector.remove_root('/r')
+        self.assertIsNone(self.detector.timeout(0))
+        self.assertListEqual(updates, self.detector.filter(updates, 0))
@@ -0,0 +1,119 @@
+"""Test if the subscriptions are working as predicted or not"""
+
+import os.path
+import shutil
+import tempfile
+import unittest
+import warnings
+import Queue
+
+from pathwatch.database import DBFilesHelper
+from pathwatch.errorwarn import SubscriberFailed
+from pathwatch.subscriptions import Dispatcher
+
+
+class TestDispatcher(unittest.TestCase):  # pylint: disable=R0904
+    """Test if the Dispatcher is working as predicted or not"""
+
+    def setUp(self):  # pylint: disable=C0103
+        """Create a temporary database, start a dispatcher"""
+        self.tempdir = tempfile.mkdtemp()
+        database = os.path.join(self.tempdir, 'database')
+        self._filedb = DBFilesHelper(database)
+        self._filedb.insert_file('/before', 1)
+        self._dispatcher = Dispatcher(database)
+        self._dispatcher.start()
+        self.queue = Queue.Queue()
+
+    def tearDown(self):  # pylint: disable=C0103
+        """Stop the dispatcher, delete the temporary database"""
+        self._dispatcher.stop()
+        self._filedb.close()
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+        if not self.queue.empty():
+            self.fail("Too many messages: {0}".format(self.queue.get()))
+
+    def _commit(self):
+        """Tell the dispatcher about the commits"""
+        self._dispatcher.notify()
+
+    def test_events(self):
+        """Every change committed after the start is delivered"""
+        self._dispatcher.subscribe(self.queue)
+        self._filedb.insert_dir('/a')
+        self._filedb.insert_file('/a/f', 42)
+        self._filedb.update_file('/a/f', 43)
+        self._filedb.link_to_hash('/a/f', 7)
+        self._filedb.move_dir('/a', '/b')
+        self._filedb.delete_path('/b')
+        self._commit()
+        self.assertListEqual([('scanned', '/a', 0),
+                              ('scanned', '/a/f', 42),
+                              ('modified', '/a/f', 43),
+                              ('hashed', '/a/f', 7),
+                              ('moved', '/a', '/b'),
+                              ('removed', '/b')],
+                             self.queue.get(timeout=1))
+
+    def test_filters(self):
+        """Only the events below the prefix, of the given types, are
+        delivered"""
+        self._dispatcher.subscribe(self.queue, prefix='/a',
+                                   events=['scanned', 'moved'])
+        self._filedb.insert_file('/a/f', 42)
+        self._filedb.insert_file('/ab', 42)
+        self._filedb.update_file('/a/f', 43)
+        self._filedb.move_file('/ab', '/a/g')
+        self._commit()
+        self.assertListEqual([('scanned', '/a/f', 42),
+                              ('moved', '/ab', '/a/g')],
+                             self.queue.get(timeout=1))
+
+    def test_ancestors(self):
+        """Moving or removing an ancestor of the prefix is delivered as
+        moving or removing the prefix"""
+        self._dispatcher.subscribe(self.queue, prefix='/a/b')
+        self._filedb.insert_dir('/a')
+        self._filedb.insert_dir('/a/b')
+        self._filedb.move_dir('/a', '/z')
+        self._filedb.delete_path('/z')
+        self._filedb.insert_dir('/y')
+        self._filedb.move_dir('/y', '/a')
+        self._filedb.delete_path('/a')
+        self._commit()
+        self.assertListEqual([('scanned', '/a/b', 0),
+                              ('moved', '/a/b', '/z/b'),
+                              ('moved', '/y/b', '/a/b'),
+                              ('removed', '/a/b')],
+                             self.queue.get(timeout=1))
+
+    def test_callback(self):
+        """Callbacks are called with each batch"""
+        self._dispatcher.subscribe(self.queue.put)
+        self._filedb.insert_file('/a', 42)
+        self._commit()
+        self.assertListEqual([('scanned', '/a', 42)],
+                             self.queue.get(timeout=1))
+
+    def test_unsubscribe(self):
+        """Nothing is delivered once unsubscribed"""
+        token = self._dispatcher.subscribe(self.queue)
+        self._dispatcher.unsubscribe(token)
+        self._filedb.insert_file('/a', 42)
+        self._commit()
+        self.assertRaises(Queue.Empty, self.queue.get, timeout=0.2)
+
+    def test_failing(self):
+        """A failing subscriber does not stop the others"""
+        def fail(_):
+            """Failing callback"""
+            raise ValueError()
+        self._dispatcher.subscribe(fail)
+        self._dispatcher.subscribe(self.queue)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self._filedb.insert_file('/a', 42)
+            self._commit()
+            self.assertListEqual([('scanned', '/a', 42)],
+                                 self.queue.get(timeout=1))
+        self.assertTrue(isinstance(caught[0].message, SubscriberFailed))
@@ -0,0 +1,79 @@
+"""Test if the update queue is working as predicted or not"""
+
+import select
+import threading
+import time
+import unittest
+
+from pathwatch.updatequeue import UpdateQueue
+
+
+class TestUpdateQueue(unittest.TestCase):  # pylint: disable=R0904
+    """Test if the UpdateQueue is working as predicted or not"""
+
+    def setUp(self):  # pylint: disable=C0103
+        """Create a queue with a high-water mark of 3 updates"""
+        self.queue = UpdateQueue(3)
+
+    def test_get_many(self):
+        """Updates are drained by batches, in order"""
+        for i in range(3):
+            self.queue.put(('modified', str(i)))
+        self.assertListEqual([('modified', '0'), ('modified', '1')],
+                             self.queue.get_many(2, 0))
+        self.assertEqual(1, len(self.queue))
+        self.assertListEqual([('modified', '2')], self.queue.get_many(2, 0))
+        self.assertTrue(self.queue.empty())
+
+    def test_timeout(self):
+        """Nothing is returned on timeout"""
+        start = time.time()
+        self.assertListEqual([], self.queue.get_many(10, 0.2))
+        self.assertTrue(time.time() - start >= 0.2)
+
+    def test_linger(self):
+        """The updates following the first one closely are gathered"""
+        def later():
+            """Put an update after the first one"""
+            time.sleep(0.1)
+            self.queue.put(('modified', 'b'))
+        thread = threading.Thread(target=later)
+        thread.start()
+        self.queue.put(('modified', 'a'))
+        self.assertListEqual([('modified', 'a'), ('modified', 'b')],
+                             self.queue.get_many(10, None, 1))
+        thread.join()
+
+    def test_high_water(self):
+        """Above the high-water mark, path updates are replaced by a single
+        overflow"""
+        for i in range(5):
+            self.queue.put(('modified', str(i)))
+        self.queue.put(('new_root', '/r'))
+        updates = self.queue.get_many(10, 0)
+        self.assertEqual(5, len(updates))
+        self.assertEqual('overflow', updates[3][0])
+        self.assertEqual(('new_root', '/r'), updates[4])
+        self.assertEqual(2, self.queue.dropped)
+
+    def test_overflow_again(self):
+        """A new overflow is queued once the previous one was drained"""
+        for i in range(4):
+            self.queue.put(('modified', str(i)))
+        self.queue.get_many(10, 0)
+        for i in range(4):
+            self.queue.put(('modified', str(i)))
+        self.assertEqual('overflow', self.queue.get_many(10, 0)[3][0])
+
+    def test_fileno(self):
+        """The file descriptor is readable while updates are pending"""
+        readable = lambda: select.select([self.queue.fileno()], [], [], 0)[0]
+        self.assertFalse(readable())
+        self.queue.put(('modified', 'a'))
+        self.queue.put(('modified', 'b'))
+        self.assertTrue(readable())
+        self.queue.get_many(1, 0)
+        self.assertTrue(readable())
+        self.queue.get_many(1, 0)
+        self.assertFalse(readable())
+        self.queue.close()
@@ -0,0 +1,195 @@
+"""Test if the database writer is working as predicted or not"""
+
+from pathwatch.database import (DBChangesHelper, DBFilesHelper, DBHashHelper,
+                                 DBRootHelper)
+from pathwatch.errorwarn import DBFailedMutation, DBWriterStopped
+from pathwatch.writer import coalesce_mutations, DBWriter
+
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+import warnings
+
+
+class TestCoalesce(unittest.TestCase):  # pylint: disable=R0904
+    """Test if the mutations are merged as predicted or not"""
+
+    def test_empty(self):
+        """Nothing to merge"""
+        self.assertEqual(([], 0), coalesce_mutations([]))
+
+    def test_updates(self):
+        """Several updates of the same path only keep the last one"""
+        mutations = [('update_file', ('/a', 1)),
+                     ('update_file', ('/b', 1)),
+                     ('update_file', ('/a', 2)),
+                     ('update_file', ('/a', 3))]
+        self.assertEqual(([('update_file', ('/a', 3)),
+                           ('update_file', ('/b', 1))], 2),
+                         coalesce_mutations(mutations))
+
+    def test_insert_update(self):
+        """An insert followed by an update stays an insert"""
+        mutations = [('insert_file', ('/a', 1)),
+                     ('update_file', ('/a', 2))]
+        self.assertEqual(([('insert_file', ('/a', 2))], 1),
+                         coalesce_mutations(mutations))
+
+    def test_barrier_single(self):
+        """An other mutation on the same path prevents merging"""
+        mutations = [('update_file', ('/a', 1)),
+                     ('hash_file', ('/a', '12', '34')),
+                     ('update_file', ('/a', 2))]
+        self.assertEqual((mutations, 0), coalesce_mutations(mutations))
+
+    def test_barrier_tree(self):
+        """Tree mutations prevent merging on any path"""
+        mutations = [('update_file', ('/a', 1)),
+                     ('move_dir', ('/b', '/c')),
+                     ('update_file', ('/a', 2))]
+        self.assertEqual((mutations, 0), coalesce_mutations(mutations))
+
+
+class TestDBWriter(unittest.TestCase):  # pylint: disable=R0904
+    """Test if the DBWriter is working as predicted or not"""
+
+    def setUp(self):  # pylint: disable=C0103
+        """Create a temporary database, start a writer"""
+        self.tempdir = tempfile.mkdtemp()
+        database = os.path.join(self.tempdir, 'database')
+        self._filedb = DBFilesHelper(database)
+        self._writer = DBWriter(database)
+        self._writer.start()
+        self.expected_db = {}
+
+    def tearDown(self):  # pylint: disable=C0103
+        """Stop the writer, check and delete the temporary database"""
+        self._writer.stop()
+        real_db = self._filedb._get_full_content()
+        self.assertDictEqual(self.expected_db, real_db)
+        self._filedb.close()
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_start_stop(self):
+        """Do nothing exept starting/stoping the writer"""
+        pass
+
+    def test_flush(self):
+        """Mutations should be visible once flushed"""
+        self._writer.insert_dir('/a')
+        self._writer.insert_file('/a/b', 42)
+        self._writer.update_file('/a/b', 43)
+        self._writer.flush()
+        self.assertEqual((43,), self._filedb.get_path('/a/b'))
+        self.assertEqual(0, self._writer.queue_depth())
+        self.expected_db = {'/a': 0, '/a/b': 43}
+
+    def test_move(self):
+        """Mutations should be applied in order"""
+        self._writer.insert_dir('/a')
+        self._writer.insert_file('/a/b', 42)
+        self._writer.move_dir('/a', '/c')
+        self._writer.delete_single('/c/b')
+        self._writer.insert_file('/c/d', 43)
+        self.expected_db = {'/c': 0, '/c/d': 43}
+
+    def test_hash(self):
+        """Hash a queued file"""
+        self._writer.insert_file('/a', 42)
+        self._writer.hash_file('/a', '1234', '5678')
+        self._writer.flush()
+        hashdb = DBHashHelper(None, self._filedb)
+        self.assertEqual(['1234'], [row[0] for row in
+                                    hashdb._get_full_content().values()])
+        self.assertEqual([], self._filedb.get_unhashed_files(10))
+        self.expected_db = {'/a': 42}
+
+    def test_delete_tree(self):
+        """Delete a tree by chunks, mutations queued meanwhile are applied"""
+        self._writer.insert_dir('/a')
+        self._writer.insert_files([(42, '/a', str(i), 1) for i in range(10)])
+        self._writer.insert_file('/b', 42)
+        self._writer.delete_tree('/a', 3)
+        self._writer.insert_file('/c', 43)
+        self._writer.flush()
+        self.assertEqual((43,), self._filedb.get_path('/c'))
+        self.expected_db = {'/b': 42, '/c': 43}
+
+    def test_cancel_tree(self):
+        """Rows inserted once the deletion of a tree is cancelled are kept,
+        the deletion of a tree above is waited for"""
+        self._writer.insert_dir('/a')
+        self._writer.insert_dir('/a/b')
+        self._writer.insert_files([(42, '/a/b', str(i), 1)
+                                   for i in range(10)])
+        self._writer.delete_tree('/a/b', 1)
+        self._writer.cancel_tree('/a/b')
+        self._writer.insert_file('/a/b/new', 43)
+        self._writer.delete_tree('/a', 1)
+        self._writer.cancel_tree('/a/b')
+        self._writer.insert_file('/a/c', 43)
+        self._writer.flush()
+        self.expected_db = {'/a/c': 43}
+
+    def test_move_root(self):
+        """A root and its content are moved together"""
+        self._writer.add_root('/a')
+        self._writer.insert_dir('/a')
+        self._writer.insert_file('/a/b', 42)
+        self._writer.move_root('/a', '/c')
+        self._writer.flush()
+        self.assertListEqual(['/c'],
+                             DBRootHelper(None, self._filedb).list_roots())
+        self.expected_db = {'/c': 0, '/c/b': 42}
+
+    def test_prune_changes(self):
+        """The change feed is pruned in order with the mutations"""
+        self._writer.insert_file('/a', 42)
+        self._writer.prune_changes(time.time() + 1)
+        self._writer.insert_file('/b', 43)
+        self._writer.flush()
+        changes = DBChangesHelper(None, self._filedb)
+        self.assertListEqual(['/b'], [change[2] for change in
+                                      changes.changes_since(1)])
+        self.expected_db = {'/a': 42, '/b': 43}
+
+    def test_failed_mutation(self):
+        """A failing mutation is skipped, the next ones are applied"""
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self._writer.delete_single(None)
+            self._writer.insert_file('/a', 42)
+            self._writer.flush()
+        self.assertListEqual([DBFailedMutation],
+                             [warning.category for warning in caught])
+        self.expected_db = {'/a': 42}
+
+    def test_failed_mutation_undone(self):
+        """What a mutation did before failing is not committed"""
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            # The hash is inserted, then linking it to no path fails
+            self._writer.hash_file(None, '12', '34', 10)
+            self._writer.flush()
+        self.assertListEqual([DBFailedMutation],
+                             [warning.category for warning in caught])
+        hashdb = DBHashHelper(None, self._filedb)
+        self.assertDictEqual({}, hashdb._get_full_content())
+
+    def test_flush_stopped(self):
+        """Flushing a stopped writer raises instead of waiting forever"""
+        self._writer.stop()
+        self._writer.insert_file('/a', 42)
+        self.assertRaises(DBWriterStopped, self._writer.flush)
+
+    def test_stats(self):
+        """Commits should be counted"""
+        self._writer.insert_file('/a', 42)
+        self._writer.flush()
+        stats = self._writer.stats()
+        self.assertEqual(1, stats['commits'])
+        self.assertEqual(1, stats['mutations'])
+        self.assertEqual(0, stats['queue_depth'])
+        self.expected_db = {'/a': 42}